@@ -12,6 +12,7 @@ from pages.Patient_Information import render_patient_page
 from pages.Upload_Images import render_images_page
 from pages.Symptoms_Lab_Results import render_symptoms_page
 from pages.Diagnostic_Results import render_results_page
+from medical_assistants.triage import warm_up as warm_up_triage
 
 # Configure the page
 configure_page()
@@ -19,6 +20,9 @@ configure_page()
 # Initialize session state
 initialize_session_state()
 
+# Load the triage knowledge in the background before the first case needs it
+warm_up_triage()
+
 # Render sidebar navigation
 render_sidebar()
 
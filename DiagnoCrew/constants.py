@@ -59,6 +59,12 @@ IMAGE_TYPES = [
     "Other",
 ]
 
+# Where uploaded DICOM files are kept while their case is being prepared
+DICOM_UPLOAD_DIR = "diagnostic_data/uploads"
+
+# Caches shared between cases, including the perceptual hash index of stored images
+CACHE_DIR = "diagnostic_data/cache"
+
 # Body regions for demo
 BODY_REGIONS = [
     "Chest/Thorax",
@@ -1,63 +1,617 @@
 import json
 import os
+import queue
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from datetime import datetime
 from dotenv import load_dotenv
-from medical_assistants.src.medical_assistants.crew import MedicalAssistants
+from medical_assistants.src.medical_assistants.crew_factory import CREW_TASKS, CrewFactory
+from medical_assistants.src.medical_assistants.report import (
+    normalize_report,
+    parse_report,
+)
+from medical_assistants.gemini_client import GeminiClientManager
+from medical_assistants.blob_store import BlobStore, content_digest, sniff_mime_type
+from medical_assistants.case_store import DEFAULT_PAGE_SIZE, CaseStore
+from medical_assistants.persistence import WriteBehindWriter
+from medical_assistants.diagnosis_cache import DiagnosisCache
+from medical_assistants.findings_cache import FindingsCache
+from medical_assistants.image_preprocessing import ImagePreprocessor
+from medical_assistants.prompt_context import PromptContextManager
+from medical_assistants.prompt_serializer import (
+    dumps as serialize_dumps,
+    merge_counts,
+    placeholder_counts,
+    serialize_inputs,
+    token_report,
+)
+from medical_assistants.report_repair import extract_report
+from medical_assistants.perceptual_hash import (
+    PerceptualHashIndex,
+    find_duplicate,
+    perceptual_hash,
+)
+from medical_assistants.series import DEFAULT_SLICE_COUNT, SeriesSampler
 import re
-import uuid
-from google import genai
 from google.genai import types
-import PIL.Image
+
+IMAGE_ANALYSIS_MODEL = "gemini-1.5-flash"
+
+# Marker the model is asked to put in front of each image's section in batched requests
+BATCH_SECTION_PATTERN = re.compile(
+    r"^[\s#*=_-]*IMAGE\s+(\d+)[\s#*=_:-]*$", re.IGNORECASE | re.MULTILINE
+)
+
+
+DEFAULT_REPORT_RETRIES = 2
+
+# Stands in for the image findings while the symptom analysis runs ahead of them
+PENDING_IMAGE_RESULTS = (
+    "Not available yet; the uploaded images are analyzed separately and "
+    "their findings are merged into the final report."
+)
+
+# Bump when the prompts change so cached findings from older prompts are not reused
+PROMPT_VERSION = 2
+
+
+def image_instruction(image_type):
+    """Build the static instruction for a single image of a given type."""
+    return f"You are an expert in medical imaging with specialization in radiology, cardiology, and general diagnostic imaging. You analyze {image_type} images to identify abnormalities, potential conditions, and provide supporting evidence for diagnoses in the region given with each image. You're precise in your observations and only report findings that are clearly visible in the images. Your analysis includes anatomical descriptions, abnormality characterization, and clinical significance. You always maintain confidentiality and adhere to medical ethics guidelines. Take the extra notes sent with the image into account."
+
+
+def image_notes(image_metadata):
+    """Return the notes sent with an image, including the series context of sampled slices."""
+    notes = image_metadata.get("notes") or ""
+    series = image_metadata.get("series")
+    if series:
+        notes = f"{series['description']}. {notes}".strip()
+    return notes
+
+
+def discard_spooled(path, blob_path):
+    """Remove a spooled upload once the blob holding its bytes is written."""
+    if os.path.exists(blob_path) and os.path.exists(path):
+        os.remove(path)
+
+
+def image_digest(image_metadata, image_bytes):
+    """
+    Return the digest identifying an image's content in caches.
+
+    The digest recorded at upload is used, since a blob store that
+    recompresses images losslessly stores different bytes under it; images
+    saved without one are identified by the hash of their bytes.
+    """
+    return image_metadata.get("digest") or content_digest(image_bytes)
+
+
+def image_request(image_region, image_notes):
+    """Build the variable text sent with a single image."""
+    return f"Region: {image_region}. Some extra notes are {image_notes}."
+
+
+def batch_instruction():
+    """Build the static instruction for a batch of labeled images."""
+    return (
+        "You are an expert in medical imaging with specialization in radiology, cardiology, and general diagnostic imaging. "
+        "You will receive several medical images, each introduced by a label with its number, type, body region and notes. "
+        "Analyze every image on its own to identify abnormalities, potential conditions, and provide supporting evidence for diagnoses in its region. "
+        "You're precise in your observations and only report findings that are clearly visible in the images. "
+        "Your analysis includes anatomical descriptions, abnormality characterization, and clinical significance. "
+        "You always maintain confidentiality and adhere to medical ethics guidelines. "
+        "Answer with one section per image, in order, each starting on its own line with exactly the marker given in the request. "
+        "Do not write anything before the first marker and do not combine images in one section."
+    )
+
+
+def batch_request(labels):
+    """Build the variable text sent in front of a batch of labeled images."""
+    markers = ", ".join(f"=== IMAGE {label} ===" for label in labels)
+    return f"Section markers: {markers}."
+
+
+def split_batch_response(text, labels):
+    """
+    Split a batched response into the findings for each labeled image.
+
+    Args:
+        text (str): The model response
+        labels (list): Labels of the images in the batch, in request order
+
+    Returns:
+        dict: Findings text keyed by label
+
+    Raises:
+        BatchSplitError: If the sections do not match the labels one to one
+    """
+    markers = list(BATCH_SECTION_PATTERN.finditer(text or ""))
+    expected = [str(label) for label in labels]
+    found = [marker.group(1) for marker in markers]
+    if sorted(found) != sorted(expected):
+        raise BatchSplitError(
+            f"Expected sections for images {expected}, found {found or 'none'}"
+        )
+
+    sections = {}
+    for position, marker in enumerate(markers):
+        end = markers[position + 1].start() if position + 1 < len(markers) else len(text)
+        findings = text[marker.end() : end].strip()
+        if not findings:
+            raise BatchSplitError(f"Section for image {marker.group(1)} is empty")
+        sections[marker.group(1)] = findings
+    return sections
+
+
+class BatchSplitError(ValueError):
+    """Raised when a batched response cannot be split into per-image findings."""
 
 
 class ImageAnalyzer:
-    def __init__(self):
-        pass
+    # How often the scheduler wakes up to check running images for timeouts
+    POLL_INTERVAL = 0.25
+
+    def __init__(
+        self,
+        max_concurrency=4,
+        image_timeout=90,
+        client_manager=None,
+        cache=None,
+        model=IMAGE_ANALYSIS_MODEL,
+        preprocessor=None,
+        batch_size=1,
+        prompt_contexts=None,
+        writer=None,
+    ):
+        """
+        Initialize the image analyzer.
+
+        Args:
+            max_concurrency (int): Maximum number of requests running at the same time
+            image_timeout (float): Seconds a single image may run before it is reported as timed out;
+                a batched request gets this much time per image it carries
+            client_manager (GeminiClientManager, optional): Source of the Gemini client,
+                defaults to the process-wide pooled client
+            cache (FindingsCache, optional): Cache of earlier findings, disabled when None
+            model (str): Gemini model used for the analysis
+            preprocessor (ImagePreprocessor, optional): Shrinks images before upload,
+                defaults to one with the standard modality profiles
+            batch_size (int): Maximum number of images sent in one request; 1 sends each image
+                on its own, 0 or None sends all images of a case together
+            prompt_contexts (PromptContextManager, optional): Holds the static instructions
+                as cached contexts, defaults to the process-wide manager
+                (or one bound to `client_manager` when that is given)
+            writer (WriteBehindWriter, optional): The writer saving the image files, so
+                images still queued are read from memory; defaults to the process-wide writer
+        """
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.image_timeout = image_timeout
+        self.client_manager = client_manager or GeminiClientManager.shared()
+        self.cache = cache
+        self.model = model
+        self.preprocessor = preprocessor or ImagePreprocessor()
+        self.batch_size = int(batch_size or 0)
+        if prompt_contexts is None:
+            prompt_contexts = (
+                PromptContextManager.shared()
+                if client_manager is None
+                else PromptContextManager(client_manager=self.client_manager)
+            )
+        self.prompt_contexts = prompt_contexts
+        self.writer = writer or WriteBehindWriter.shared()
 
     def analyze_image(self, image_metadata):
         """
         Analyze a medical image and return insights.
 
         Args:
-            image_path (str): The path to the image file
+            image_metadata (dict): Image metadata, including the path to the image file
 
         Returns:
-            dict: The analysis results
+            dict: The analysis results, with `cache_hit` telling whether they came from the cache
         """
-        image = PIL.Image.open(image_metadata.get("full_path"))
-        image_notes = image_metadata.get("notes", "")
-        image_region = image_metadata.get("region", "")
-        image_type = image_metadata.get("type", "")
-        api_key = os.getenv("GEMINI_API_KEY")
-        client = genai.Client(api_key=api_key)
+        image_bytes, cache_key, cached = self._load(image_metadata)
+        if cached is not None:
+            return cached
+
+        client = self.client_manager.get_client()
         response = client.models.generate_content(
-            model="gemini-1.5-flash",
-            contents=[
-                f"You are an expert in medical imaging with specialization in radiology, cardiology, and general diagnostic imaging. You analyze {image_type} images to identify abnormalities, potential conditions, and provide supporting evidence for diagnoses in the region {image_region}. You're precise in your observations and only report findings that are clearly visible in the images. Your analysis includes anatomical descriptions, abnormality characterization, and clinical significance. You always maintain confidentiality and adhere to medical ethics guidelines. Some extra notes are {image_notes}.",
-                image,
-            ],
+            **self._image_request(image_metadata, image_bytes)
         )
 
-        return {
-            # "image_path": image_metadata.get("path"),
-            "findings": response.text,
-        }
+        return self._finish(image_metadata, cache_key, response.text)
+
+    def stream_image(self, image_metadata):
+        """
+        Analyze a medical image, yielding the findings text as it is generated.
+
+        The chunks join to the same `findings` string `analyze_image` returns,
+        and the joined text is cached the same way. A cache hit is yielded as
+        a single chunk.
+
+        Args:
+            image_metadata (dict): Image metadata, including the path to the image file
+
+        Yields:
+            str: The next piece of the findings text
+
+        Returns:
+            dict: The analysis results, as the value of the final StopIteration
+        """
+        image_bytes, cache_key, cached = self._load(image_metadata)
+        if cached is not None:
+            yield cached["findings"]
+            return cached
+
+        client = self.client_manager.get_client()
+        chunks = []
+        for response in client.models.generate_content_stream(
+            **self._image_request(image_metadata, image_bytes)
+        ):
+            if response.text:
+                chunks.append(response.text)
+                yield response.text
+        return self._finish(image_metadata, cache_key, "".join(chunks))
+
+    def analyze_image_batch(self, image_metadata):
+        """
+        Analyze several medical images in a single request.
+
+        The static instruction travels in a cached context, followed by the
+        section markers and then a label and the image for each entry. The
+        response is split back into findings per image using the section
+        markers the model is asked to write. Images already in the cache are
+        not sent.
+
+        Args:
+            image_metadata (list): List of image metadata dictionaries
+
+        Returns:
+            list: Analysis results for each image, in input order
+
+        Raises:
+            BatchSplitError: If the response cannot be split cleanly
+        """
+        results = [None] * len(image_metadata)
+        misses = []
+        for position, image_metadata_unit in enumerate(image_metadata):
+            image_bytes, cache_key, cached = self._load(image_metadata_unit)
+            if cached is not None:
+                results[position] = cached
+            else:
+                misses.append((position, image_bytes, cache_key))
+        if not misses:
+            return results
+
+        labels = [self._label(image_metadata, position) for position, _, _ in misses]
+        contents = [batch_request(labels)]
+        for label, (position, image_bytes, _) in zip(labels, misses):
+            image_metadata_unit = image_metadata[position]
+            image_type = image_metadata_unit.get("type", "")
+            contents.append(
+                f"=== IMAGE {label} === Type: {image_type}. "
+                f"Region: {image_metadata_unit.get('region', '')}. "
+                f"Notes: {image_notes(image_metadata_unit)}."
+            )
+            contents.append(
+                self._image_part(
+                    image_bytes, image_type, image_digest(image_metadata_unit, image_bytes)
+                )
+            )
+
+        client = self.client_manager.get_client()
+        response = client.models.generate_content(
+            model=self.model,
+            contents=contents,
+            config=self.prompt_contexts.config(self.model, "batch", batch_instruction()),
+        )
+        sections = split_batch_response(response.text, labels)
+
+        for label, (position, _, cache_key) in zip(labels, misses):
+            results[position] = self._finish(
+                image_metadata[position], cache_key, sections[str(label)]
+            )
+        return results
 
     def analyze_multiple_images(self, image_metadata):
         """
-        Analyze multiple medical images and return insights.
+        Analyze multiple medical images concurrently and return insights.
+
+        Images are grouped into requests of up to `batch_size` images and at
+        most `max_concurrency` requests run at once. A batch whose response
+        cannot be split into per-image findings is retried one image per
+        request. An image that fails or runs out of time gets an error entry
+        instead of findings, so the remaining images are still returned.
 
         Args:
-            image_paths (list): List of image file paths
+            image_metadata (list): List of image metadata dictionaries
 
         Returns:
-            list: List of analysis results for each image
+            list: List of analysis results for each image, in input order
         """
-        return [
-            self.analyze_image(image_metadata_unit)
-            for image_metadata_unit in image_metadata
+        if not image_metadata:
+            return []
+
+        unique, copies = self._split_duplicates(image_metadata)
+        if copies:
+            unique_results = self.analyze_multiple_images(
+                [image_metadata[position] for position in unique]
+            )
+            results = [None] * len(image_metadata)
+            for position, result in zip(unique, unique_results):
+                results[position] = result
+                for copy in copies.get(position, []):
+                    results[copy] = self._shared_result(image_metadata[copy], result)
+            return results
+
+        results = [None] * len(image_metadata)
+        started = {}
+
+        def run(unit):
+            started[unit] = time.monotonic()
+            if len(unit) == 1:
+                return [self.analyze_image(image_metadata[unit[0]])]
+            return self.analyze_image_batch([image_metadata[p] for p in unit])
+
+        size = self.batch_size if self.batch_size > 0 else len(image_metadata)
+        units = [
+            tuple(range(first, min(first + size, len(image_metadata))))
+            for first in range(0, len(image_metadata), size)
         ]
 
+        executor = ThreadPoolExecutor(
+            max_workers=min(self.max_concurrency, len(units)),
+            thread_name_prefix="image-analyzer",
+        )
+        futures = {executor.submit(run, unit): unit for unit in units}
+        pending = set(futures)
+
+        try:
+            while pending:
+                done, pending = wait(
+                    pending, timeout=self.POLL_INTERVAL, return_when=FIRST_COMPLETED
+                )
+                for future in done:
+                    unit = futures[future]
+                    try:
+                        for position, result in zip(unit, future.result()):
+                            results[position] = result
+                    except BatchSplitError:
+                        # Fall back to one request per image
+                        for position in unit:
+                            retry = executor.submit(run, (position,))
+                            futures[retry] = (position,)
+                            pending.add(retry)
+                    except Exception as e:
+                        for position in unit:
+                            results[position] = self._error_result(
+                                image_metadata[position], f"Image analysis failed: {e}"
+                            )
+
+                if self.image_timeout is None:
+                    continue
+                now = time.monotonic()
+                for future in list(pending):
+                    unit = futures[future]
+                    if (
+                        unit in started
+                        and now - started[unit] > self.image_timeout * len(unit)
+                    ):
+                        # The worker thread cannot be interrupted; stop waiting for it
+                        pending.discard(future)
+                        for position in unit:
+                            results[position] = self._error_result(
+                                image_metadata[position],
+                                f"Image analysis timed out after {self.image_timeout * len(unit)} seconds",
+                            )
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        return results
+
+    def stream_multiple_images(self, image_metadata):
+        """
+        Analyze multiple medical images concurrently, yielding findings as they arrive.
+
+        Every image gets its own streaming request, at most `max_concurrency`
+        at once; `batch_size` does not apply. Events are yielded from the
+        calling thread, so a UI can render them directly. Each image ends
+        with exactly one "result" event, carrying the same entry
+        `analyze_multiple_images` would return for it.
+
+        Args:
+            image_metadata (list): List of image metadata dictionaries
+
+        Yields:
+            tuple: (position, kind, payload), where kind is "chunk" with a text
+                payload or "result" with the result dictionary as payload
+        """
+        if not image_metadata:
+            return
+
+        unique, copies = self._split_duplicates(image_metadata)
+        if copies:
+            for position, kind, payload in self.stream_multiple_images(
+                [image_metadata[position] for position in unique]
+            ):
+                yield unique[position], kind, payload
+                if kind == "result":
+                    for copy in copies.get(unique[position], []):
+                        yield copy, kind, self._shared_result(
+                            image_metadata[copy], payload
+                        )
+            return
+
+        events = queue.Queue()
+        started = {}
+
+        def run(position):
+            started[position] = time.monotonic()
+            stream = self.stream_image(image_metadata[position])
+            try:
+                while True:
+                    events.put((position, "chunk", next(stream)))
+            except StopIteration as stop:
+                result = stop.value
+            except Exception as e:
+                result = self._error_result(
+                    image_metadata[position], f"Image analysis failed: {e}"
+                )
+            events.put((position, "result", result))
+
+        executor = ThreadPoolExecutor(
+            max_workers=min(self.max_concurrency, len(image_metadata)),
+            thread_name_prefix="image-analyzer",
+        )
+        for position in range(len(image_metadata)):
+            executor.submit(run, position)
+        pending = set(range(len(image_metadata)))
+
+        try:
+            while pending:
+                try:
+                    position, kind, payload = events.get(timeout=self.POLL_INTERVAL)
+                except queue.Empty:
+                    position = None
+                if position is not None and position in pending:
+                    if kind == "result":
+                        pending.discard(position)
+                    yield position, kind, payload
+
+                if self.image_timeout is None:
+                    continue
+                now = time.monotonic()
+                for position in list(pending):
+                    if (
+                        position in started
+                        and now - started[position] > self.image_timeout
+                    ):
+                        # The worker thread cannot be interrupted; ignore its later events
+                        pending.discard(position)
+                        yield position, "result", self._error_result(
+                            image_metadata[position],
+                            f"Image analysis timed out after {self.image_timeout} seconds",
+                        )
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    @staticmethod
+    def _split_duplicates(image_metadata):
+        """
+        Separate images marked as duplicates of another image in the same list.
+
+        Returns:
+            tuple: Positions of the images to analyze, and a dictionary mapping
+                each of those positions to the positions of its duplicates
+        """
+        positions = {m.get("index"): p for p, m in enumerate(image_metadata)}
+        unique, copies = [], {}
+        for position, image_metadata_unit in enumerate(image_metadata):
+            original = positions.get(image_metadata_unit.get("duplicate_of"))
+            if image_metadata_unit.get("duplicate_of") is None or original is None:
+                unique.append(position)
+            else:
+                copies.setdefault(original, []).append(position)
+        return unique, copies
+
+    def _shared_result(self, image_metadata, result):
+        """Build the result entry of a duplicate from the result of its original."""
+        shared = dict(result)
+        shared["index"] = image_metadata.get("index")
+        if "findings" in result:
+            shared["duplicate_of"] = image_metadata.get("duplicate_of")
+        return shared
+
+    def _load(self, image_metadata):
+        """
+        Read an image and look it up in the findings cache.
+
+        Returns:
+            tuple: The image bytes, the cache key (None when caching is disabled)
+                and the cached result (None on a miss)
+        """
+        # Served from memory while the write-behind queue is still saving the file
+        image_bytes = self.writer.read(image_metadata.get("full_path"))
+        if self.cache is None:
+            return image_bytes, None, None
+
+        image_type = image_metadata.get("type", "")
+        cache_key = FindingsCache.make_key(
+            image_digest(image_metadata, image_bytes),
+            image_type,
+            image_metadata.get("region", ""),
+            image_notes(image_metadata),
+            f"{self.model}|{PROMPT_VERSION}|{self.preprocessor.signature(image_type)}",
+        )
+        cached = self.cache.get(cache_key)
+        if cached is None:
+            return image_bytes, cache_key, None
+        return (
+            image_bytes,
+            cache_key,
+            self._result(image_metadata, cached["findings"], cache_hit=True),
+        )
+
+    def _image_request(self, image_metadata, image_bytes):
+        """Build the generate_content arguments for a single image."""
+        image_type = image_metadata.get("type", "")
+        return {
+            "model": self.model,
+            "contents": [
+                image_request(
+                    image_metadata.get("region", ""), image_notes(image_metadata)
+                ),
+                self._image_part(
+                    image_bytes, image_type, image_digest(image_metadata, image_bytes)
+                ),
+            ],
+            "config": self.prompt_contexts.config(
+                self.model, image_type or "Other", image_instruction(image_type)
+            ),
+        }
+
+    def _image_part(self, image_bytes, image_type, digest=None):
+        """Prepare an image and wrap it as a request part."""
+        prepared = self.preprocessor.prepare(image_bytes, image_type, digest)
+        return types.Part.from_bytes(data=prepared.data, mime_type=prepared.mime_type)
+
+    def _finish(self, image_metadata, cache_key, findings):
+        """Cache freshly generated findings and build the result entry."""
+        if cache_key is not None:
+            self.cache.put(cache_key, {"findings": findings})
+
+        return self._result(image_metadata, findings, cache_hit=False)
+
+    def _result(self, image_metadata, findings, cache_hit):
+        """Build the result entry for an analyzed image."""
+        result = {
+            # "image_path": image_metadata.get("path"),
+            "index": image_metadata.get("index"),
+            "findings": findings,
+            "cache_hit": cache_hit,
+        }
+        if image_metadata.get("series"):
+            result["series"] = image_metadata["series"]["description"]
+        return result
+
+    @staticmethod
+    def _label(image_metadata, position):
+        """Label of an image in a batched request: its case index, or its position when indexes are missing or repeated."""
+        indexes = [m.get("index") for m in image_metadata]
+        if None in indexes or len(set(indexes)) != len(indexes):
+            return position
+        return indexes[position]
+
+    def _error_result(self, image_metadata, message):
+        """Build the result entry reported for an image that could not be analyzed."""
+        return {
+            "index": image_metadata.get("index"),
+            "type": image_metadata.get("type"),
+            "region": image_metadata.get("region"),
+            "error": message,
+        }
+
 
 class DiagnosticService:
     """
@@ -66,16 +620,81 @@ class DiagnosticService:
     and any external services like CrewAI.
     """
 
-    def __init__(self, data_dir="diagnostic_data"):
-        """Initialize the diagnostic service with a data directory for storing patient data."""
+    def __init__(
+        self,
+        data_dir="diagnostic_data",
+        series_sampler=None,
+        execution_mode=None,
+        crew_factory=None,
+        report_retries=None,
+        writer=None,
+    ):
+        """
+        Initialize the diagnostic service with a data directory for storing patient data.
+
+        Every image is stored in its original codec in the content-addressed
+        blob store under <data_dir>/blobs, so only byte-identical images
+        share a file. Images that look like another image of the case or of
+        an earlier case are found with the perceptual hash index under
+        <data_dir>/cache and flagged, never substituted; BLOB_RECOMPRESS=1 stores
+        PNGs losslessly recompressed. Case data goes to the case store in <data_dir>;
+        per-case JSON directories of earlier versions are imported into it
+        the first time it is opened.
+
+        Args:
+            data_dir (str): Directory holding case data and caches
+            series_sampler (SeriesSampler, optional): Picks the slices of CT/MRI series
+                that are stored and analyzed, defaults to uniform sampling of
+                SERIES_SLICE_COUNT slices
+            execution_mode (str, optional): "staged" runs the symptom analysis while the
+                images are analyzed and merges the findings in the report stage,
+                "sequential" analyzes the images first and then runs the whole crew;
+                defaults to DIAGNOSIS_MODE or "staged"
+            crew_factory (CrewFactory, optional): Source of the per-case crews,
+                defaults to the process-wide factory
+            report_retries (int, optional): How often only the report stage is re-run
+                when its output cannot be parsed or repaired, defaults to
+                REPORT_RETRIES or 2
+            writer (WriteBehindWriter, optional): Persists case data and image files in
+                the background, defaults to the process-wide writer
+        """
         self.data_dir = data_dir
+        self.crew_factory = crew_factory or CrewFactory.shared()
+        self.report_retries = int(
+            os.getenv("REPORT_RETRIES", DEFAULT_REPORT_RETRIES)
+            if report_retries is None
+            else report_retries
+        )
+        self.diagnosis_cache = DiagnosisCache.for_directory(
+            os.path.join(data_dir, "cache", "diagnoses")
+        )
+        self.execution_mode = execution_mode or os.getenv("DIAGNOSIS_MODE", "staged")
+        self.hash_index = PerceptualHashIndex.for_directory(
+            os.path.join(data_dir, "cache")
+        )
+        self.series_sampler = series_sampler or SeriesSampler(
+            count=int(os.getenv("SERIES_SLICE_COUNT", DEFAULT_SLICE_COUNT)),
+            strategy=os.getenv("SERIES_SAMPLING", "uniform"),
+        )
         # Create the data directory if it doesn't exist
         os.makedirs(data_dir, exist_ok=True)
+        self.case_store = CaseStore.for_directory(data_dir)
+        self.writer = writer or WriteBehindWriter.shared()
+        # Queued case store writes by case, see `case_saved`
+        self._saves = {}
+        self._saves_lock = threading.Lock()
+        self.blob_store = BlobStore.for_directory(
+            os.path.join(data_dir, "blobs"),
+            writer=self.writer,
+            recompress=os.getenv("BLOB_RECOMPRESS", "0") == "1",
+        )
+        self.case_store.migrate_once(data_dir)
 
     def process_output(self, output):
         """
         Process the crew output to ensure it's in the correct format.
-        Removes markdown code blocks and extracts valid JSON.
+        Parses the JSON report, from a ```json block when it is wrapped in one,
+        and normalizes it with the DiagnosticReport model.
 
         Args:
             output (str): The output from the crew
@@ -83,19 +702,7 @@ class DiagnosticService:
         Returns:
             dict: The processed diagnostic report
         """
-
-        match = re.search(r"```json\s*({.*?})\s*```", output, re.DOTALL)
-        if not match:
-            raise ValueError("No JSON content found in the Markdown block.")
-
-        json_string = match.group(1)  # Extract the JSON content
-
-        # Step 2: Parse the JSON string into a Python dictionary
-        try:
-            json_object = json.loads(json_string)
-            return json_object
-        except json.JSONDecodeError as e:
-            raise json.JSONDecodeError(f"Invalid JSON string: {str(e)}", e.doc, e.pos)
+        return parse_report(output)
 
     def process_diagnostic_data(
         self,
@@ -120,8 +727,14 @@ class DiagnosticService:
             onset_info (dict, optional): Information about symptom onset and duration
 
         Returns:
-            dict: The processed diagnostic data and a unique case ID
+            dict: The processed diagnostic data and a unique case ID, with the
+                uploads whose DICOM originals now live in the blob store
         """
+        # Send only representative slices of CT/MRI series; the picked slices
+        # are rendered from the spooled DICOM files before those are moved
+        sampled_images = self.series_sampler.reduce(uploaded_images)
+        sources = self._store_sources(uploaded_images)
+
         # Generate a case ID
         case_id = f"CASE_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{patient_data.get('id', 'UNKNOWN')}"
 
@@ -137,7 +750,7 @@ class DiagnosticService:
                 "onset_info": onset_info,
             },
             "lab_results": lab_results,
-            "image_count": len(uploaded_images) if uploaded_images else 0,
+            "image_count": len(sampled_images) if sampled_images else 0,
         }
 
         # Save the data package to a JSON file (excluding actual image data for now)
@@ -145,113 +758,472 @@ class DiagnosticService:
 
         # In a real implementation, you would process the images separately
         # and perhaps store them in a different way or format
-        image_metadata = self._save_image_metadata(case_id, uploaded_images)
+        image_metadata = self._save_image_metadata(case_id, sampled_images, sources)
 
         return {
             "case_id": case_id,
             "data_package": data_package,
             "image_metadata": image_metadata,
+            "uploaded_images": [
+                (
+                    {
+                        **img_data,
+                        "source_path": self.blob_store.path(sources[img_data["source_path"]]),
+                    }
+                    if img_data.get("source_path") in sources
+                    else img_data
+                )
+                for img_data in uploaded_images or []
+            ],
         }
 
-    def run_diagnosis(self, case_id, data_package, image_metadata):
+    def run_diagnosis(
+        self,
+        case_id,
+        data_package,
+        image_metadata,
+        on_image_event=None,
+        bypass_cache=False,
+    ):
         """
         Run the diagnostic analysis. This is where you would integrate with CrewAI.
 
+        Identical submissions (same patient data, symptoms, labs and images, with
+        the same crew configuration and models) are answered from the diagnosis
+        cache, and concurrent identical submissions share one crew run.
+
         Args:
             case_id (str): The unique case identifier
             data_package (dict): The prepared diagnostic data
+            image_metadata (list): Metadata of the case images
+            on_image_event (callable, optional): Called from the calling thread with
+                (position, kind, payload) for every event of
+                `ImageAnalyzer.stream_multiple_images`; when set, images are streamed.
+                A cached diagnosis replays the "result" event of every image
+            bypass_cache (bool): Run the crew even if a cached diagnosis exists
 
         Returns:
             dict: The diagnostic results
         """
 
         load_dotenv()
+        timings = {}
+        started = time.perf_counter()
+        cache_key = DiagnosisCache.make_key(
+            self._cache_inputs(data_package, image_metadata), self._fingerprint()
+        )
+
+        try:
+            outcome, source = self.diagnosis_cache.get_or_run(
+                cache_key,
+                lambda: self._diagnose(
+                    data_package, image_metadata, on_image_event, timings
+                ),
+                bypass=bypass_cache,
+                cacheable=lambda outcome: "error" not in outcome["diagnosis"],
+            )
+        except Exception as e:
+            # Handle any exceptions
+            error_diagnosis = {
+                "case_id": case_id,
+                "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                "error": f"An error occurred while running the diagnosis: {str(e)}",
+                "timings": self._finish_timings(timings, started),
+            }
+            self._save_diagnostic_results(case_id, error_diagnosis)
+            return error_diagnosis
+
+        if source != "miss" and on_image_event is not None:
+            for position, result in enumerate(outcome["image_results"]):
+                on_image_event(position, "result", result)
+
+        diagnosis = dict(outcome["diagnosis"])
+        # Add case ID and timestamp if not present
+        diagnosis["case_id"] = case_id
+        diagnosis["timestamp"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        diagnosis["cache"] = source
+        diagnosis["timings"] = self._finish_timings(timings, started)
+
+        self._save_diagnostic_results(case_id, diagnosis)
+
+        return diagnosis
+
+    def get_case(self, case_id):
+        """
+        Load a stored case with its data package, image metadata and diagnosis.
+
+        Returns:
+            dict: The case, or None when there is no such case
+        """
+        self.writer.flush()
+        return self.case_store.get_case(case_id)
+
+    def case_saved(self, case_id):
+        """
+        Track the queued case store writes of a case without waiting for them.
+
+        Writes run in the background, so a failed save would otherwise go
+        unnoticed; call this once the diagnosis is queued and check the
+        future later. The writer runs tasks in order, so the case is saved
+        when its last write is done.
+
+        Args:
+            case_id (str): The case identifier
+
+        Returns:
+            Future: Completes once the case's writes are done, with the first
+                error among them when a write failed
+        """
+        with self._saves_lock:
+            futures = self._saves.pop(case_id, [])
+        saved = Future()
+        if not futures:
+            saved.set_result(None)
+            return saved
+
+        def finish(_):
+            # Earlier writes of the case finished before the last one
+            for future in futures:
+                if future.exception() is not None:
+                    saved.set_exception(future.exception())
+                    return
+            saved.set_result(None)
+
+        futures[-1].add_done_callback(finish)
+        return saved
+
+    def _submit_save(self, case_id, fn, *args):
+        """Queue a case store write and remember it for `case_saved`."""
+        future = self.writer.submit(fn, *args)
+        with self._saves_lock:
+            self._saves.setdefault(case_id, []).append(future)
+        return future
+
+    def patient_history(self, patient_id, limit=DEFAULT_PAGE_SIZE, after=None, payloads=()):
+        """
+        Return one page of a patient's cases, newest first.
+
+        Args:
+            patient_id (str): The patient identifier
+            limit (int): Page size
+            after (str, optional): Cursor returned with the previous page
+            payloads (iterable): Payloads to load, see `CaseStore.find_cases`
+
+        Returns:
+            tuple: The cases and the cursor of the next page, or None on the last page
+        """
+        self.writer.flush()
+        return self.case_store.find_cases(
+            patient_id=patient_id, limit=limit, after=after, payloads=payloads
+        )
+
+    def cases_between(self, since, until, limit=DEFAULT_PAGE_SIZE, after=None, payloads=()):
+        """Return one page of the cases created in a date range, newest first."""
+        self.writer.flush()
+        return self.case_store.find_cases(
+            since=since, until=until, limit=limit, after=after, payloads=payloads
+        )
+
+    def cases_with_diagnosis(self, diagnosis, limit=DEFAULT_PAGE_SIZE, after=None, payloads=()):
+        """Return one page of the cases whose primary diagnosis starts with a text, newest first."""
+        self.writer.flush()
+        return self.case_store.find_cases(
+            diagnosis=diagnosis, limit=limit, after=after, payloads=payloads
+        )
+
+    def latest_cases(self, count=DEFAULT_PAGE_SIZE, payloads=()):
+        """Return the `count` most recent cases."""
+        self.writer.flush()
+        cases, _ = self.case_store.find_cases(limit=count, payloads=payloads)
+        return cases
+
+    def iter_cases(self, **filters):
+        """Iterate lazily over all cases matching the filters of `CaseStore.find_cases`."""
+        self.writer.flush()
+        return self.case_store.iter_cases(**filters)
+
+    def _diagnose(self, data_package, image_metadata, on_image_event, timings):
+        """
+        Analyze the images and run the crew.
+
+        Returns:
+            dict: The parsed "diagnosis" and the "image_results" it was based on
+        """
         patient_data = data_package["patient_data"]
         symptoms = data_package["symptoms"]
         lab_results = data_package["lab_results"]
 
-        image_results = ImageAnalyzer().analyze_multiple_images(image_metadata)
+        # Format compact inputs for CrewAI
+        inputs = serialize_inputs(patient_data, symptoms, lab_results)
+        staged = bool(image_metadata) and self.execution_mode == "staged"
 
-        # Format inputs for CrewAI
-        inputs = {
-            "patient_data": json.dumps(patient_data),
-            "symptoms": json.dumps(symptoms),
-            "lab_results": json.dumps(lab_results),
-            "image_results": json.dumps(image_results),
-        }
+        if staged:
+            # The symptom analysis does not need the images, so it runs
+            # while they are analyzed and the findings are merged afterwards
+            with ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="symptom-analysis"
+            ) as executor:
+                text_stage = executor.submit(
+                    self._timed,
+                    timings,
+                    "symptom_analysis",
+                    lambda: self._crew(timings, "symptom")
+                    .kickoff(inputs={**inputs, "image_results": PENDING_IMAGE_RESULTS})
+                    .raw,
+                )
+                image_results = self._timed(
+                    timings,
+                    "image_analysis",
+                    lambda: self._analyze_images(image_metadata, on_image_event),
+                )
+                symptom_analysis = text_stage.result()
+
+            inputs["image_results"] = serialize_dumps(image_results)
+            crew_output = self._timed(
+                timings,
+                "report",
+                lambda: self._crew(timings, "report").kickoff(
+                    inputs={**inputs, "symptom_analysis": symptom_analysis}
+                ),
+            )
+        else:
+            image_results = self._timed(
+                timings,
+                "image_analysis",
+                lambda: self._analyze_images(image_metadata, on_image_event),
+            )
+            inputs["image_results"] = serialize_dumps(image_results)
 
-        try:
             # Run the CrewAI medical assistants
-            crew_result = (MedicalAssistants().crew().kickoff(inputs=inputs)).raw
+            crew_output = self._timed(
+                timings,
+                "crew",
+                lambda: self._crew(timings, "full").kickoff(inputs=inputs),
+            )
+            # Keep the symptom analysis in case only the report has to be redone
+            symptom_analysis = crew_output.tasks_output[0].raw
 
-            # Parse the result
-            if isinstance(crew_result, str):
-                try:
+        # Parse the result
+        diagnosis = self._parse_report(crew_output)
+        attempts = 0
+        while diagnosis is None and attempts < self.report_retries:
+            # Redo only the report stage on the symptom analysis we already have
+            attempts += 1
+            crew_output = self._timed(
+                timings,
+                "report_retry",
+                lambda: self._crew(timings, "report").kickoff(
+                    inputs={**inputs, "symptom_analysis": symptom_analysis}
+                ),
+            )
+            diagnosis = self._parse_report(crew_output)
 
-                    diagnosis = self.process_output(crew_result)
+        if diagnosis is None:
+            diagnosis = {
+                "error": "Could not parse result as JSON",
+                "raw_result": crew_output.raw,
+                "symptom_analysis": symptom_analysis,
+            }
+        diagnosis["report_retries"] = attempts
 
-                except:
-                    diagnosis = {
-                        "case_id": case_id,
-                        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                        "error": "Could not parse result as JSON",
-                        "raw_result": crew_result,
-                    }
-            else:
-                diagnosis = crew_result
+        diagnosis["execution_mode"] = "staged" if staged else "sequential"
+        # Inputs are interpolated into the prompts of every crew that ran
+        crews_run = (["symptom", "report"] if staged else ["full"]) + ["report"] * attempts
+        occurrences = [
+            placeholder_counts(self.crew_factory.config_paths, CREW_TASKS[kind])
+            for kind in crews_run
+        ]
+        if staged:
+            # The symptom stage only got a placeholder for the image results
+            occurrences[0].pop("image_results", None)
+        diagnosis["prompt_tokens"] = token_report(
+            {
+                "patient_data": json.dumps(patient_data),
+                "symptoms": json.dumps(symptoms),
+                "lab_results": json.dumps(lab_results),
+                "image_results": json.dumps(image_results),
+            },
+            inputs,
+            merge_counts(*occurrences),
+        )
+        return {"diagnosis": diagnosis, "image_results": image_results}
 
-            # Add case ID and timestamp if not present
-            diagnosis["case_id"] = case_id
-            diagnosis["timestamp"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    def _parse_report(self, crew_output):
+        """
+        Get the report from crew output.
 
-            self._save_diagnostic_results(case_id, diagnosis)
+        The structured output of the report task is used when the crew
+        produced it. Otherwise the raw text is parsed, and repaired locally
+        when the strict parse fails.
 
-            return diagnosis
-        except Exception as e:
-            # Handle any exceptions
-            error_diagnosis = {
-                "case_id": case_id,
-                "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                "error": f"An error occurred while running the diagnosis: {str(e)}",
-            }
-            self._save_diagnostic_results(case_id, error_diagnosis)
-            return error_diagnosis
+        Returns:
+            dict: The normalized diagnosis, or None when no report could be recovered
+        """
+        if crew_output.pydantic is not None:
+            return normalize_report(crew_output.pydantic.model_dump())
+        try:
+            return self.process_output(crew_output.raw)
+        except ValueError:
+            pass
+        report = extract_report(crew_output.raw)
+        if report is None:
+            return None
+        try:
+            return normalize_report(report)
+        except ValueError:
+            return None
+
+    def _cache_inputs(self, data_package, image_metadata):
+        """
+        Describe a diagnosis request for the diagnosis cache key.
+
+        Images are identified by the SHA-256 digest of their bytes and their
+        prompt metadata rather than by their findings, so the key is known
+        before they are analyzed; the findings themselves are a function of
+        these. The perceptual hash is not used: similar-looking images of
+        different studies must not share a diagnosis.
+        """
+        return {
+            "patient_data": data_package["patient_data"],
+            "symptoms": data_package["symptoms"],
+            "lab_results": data_package["lab_results"],
+            "images": [
+                {
+                    "digest": m.get("digest"),
+                    "type": m.get("type"),
+                    "region": m.get("region"),
+                    "notes": image_notes(m),
+                    "duplicate_of": m.get("duplicate_of"),
+                }
+                for m in image_metadata or []
+            ],
+        }
+
+    def _fingerprint(self):
+        """Identify the crew configuration, models and execution mode a diagnosis depends on."""
+        return "|".join(
+            [
+                self.crew_factory.fingerprint(),
+                IMAGE_ANALYSIS_MODEL,
+                str(PROMPT_VERSION),
+                self.execution_mode,
+            ]
+        )
+
+    def _analyze_images(self, image_metadata, on_image_event=None):
+        """Analyze the case images, streaming them to `on_image_event` when it is set."""
+        image_analyzer = ImageAnalyzer(
+            cache=FindingsCache.for_directory(
+                os.path.join(self.data_dir, "cache", "findings")
+            ),
+            preprocessor=ImagePreprocessor(
+                cache_dir=os.path.join(self.data_dir, "cache", "prepared")
+            ),
+            batch_size=int(os.getenv("IMAGE_BATCH_SIZE", 1)),
+            writer=self.writer,
+        )
+        if on_image_event is None:
+            return image_analyzer.analyze_multiple_images(image_metadata)
+
+        image_results = [None] * len(image_metadata or [])
+        for position, kind, payload in image_analyzer.stream_multiple_images(
+            image_metadata
+        ):
+            if kind == "result":
+                image_results[position] = payload
+            on_image_event(position, kind, payload)
+        return image_results
+
+    def _crew(self, timings, kind):
+        """Get a crew for this case from the factory, adding the setup time to `timings`."""
+        return self._timed(timings, "crew_setup", lambda: self.crew_factory.crew(kind))
+
+    @staticmethod
+    def _timed(timings, stage, fn):
+        """Run a stage and add its wall-clock seconds to `timings`, also when it fails."""
+        start = time.perf_counter()
+        try:
+            return fn()
+        finally:
+            elapsed = time.perf_counter() - start
+            timings[stage] = round(timings.get(stage, 0) + elapsed, 3)
+
+    @staticmethod
+    def _finish_timings(timings, started):
+        """Return the stage timings with the total seconds since `started`."""
+        return {**timings, "total": round(time.perf_counter() - started, 3)}
 
     def _save_diagnostic_data(self, case_id, data_package):
-        """Save the diagnostic data package to a JSON file."""
-        case_dir = os.path.join(self.data_dir, case_id)
-        os.makedirs(case_dir, exist_ok=True)
+        """Queue the diagnostic data package for the case store."""
+        self._submit_save(case_id, self.case_store.save_case, data_package)
 
-        # Save the data package
-        with open(os.path.join(case_dir, "data_package.json"), "w") as f:
-            json.dump(data_package, f, indent=4)
+    def _store_sources(self, uploaded_images):
+        """
+        Store the original DICOM files of the uploads in the blob store.
 
-    def _save_image_metadata(self, case_id, uploaded_images):
-        """Save metadata about uploaded images."""
-        if not uploaded_images:
-            return
-        image_paths = []
-        case_dir = os.path.join(self.data_dir, case_id)
-        os.makedirs(case_dir, exist_ok=True)
+        Each spooled file is removed once its blob is on disk; the removal is
+        queued behind the blob write.
+
+        Returns:
+            dict: The blob digest of every source path
+        """
+        sources = {}
+        for img_data in uploaded_images or []:
+            path = img_data.get("source_path")
+            if not path or path in sources:
+                continue
+            with open(path, "rb") as f:
+                digest = self.blob_store.put(f.read())
+            sources[path] = digest
+            blob_path = self.blob_store.path(digest)
+            if os.path.abspath(path) != os.path.abspath(blob_path):
+                self.writer.submit(discard_spooled, path, blob_path)
+        return sources
 
-        # Create an images directory
-        images_dir = os.path.join(case_dir, "images")
-        os.makedirs(images_dir, exist_ok=True)
+    def _save_image_metadata(self, case_id, uploaded_images, sources=None):
+        """
+        Save metadata about uploaded images.
 
+        Args:
+            case_id (str): The case identifier
+            uploaded_images (list): The images to store and analyze
+            sources (dict, optional): Blob digests of the DICOM originals by
+                source path, from `_store_sources`
+        """
+        sources = sources or {}
+        if not uploaded_images:
+            return
         # Save metadata about each image
         image_metadata = []
 
+        case_hashes = []
+        case_digests = {}
+
         for i, img_data in enumerate(uploaded_images):
-            # Generate a unique filename for the image
-            filename = f"image_{i}_{uuid.uuid4().hex[:8]}.png"
-            file_path = os.path.join(images_dir, filename)
+            image_bytes = img_data.get("file") or b""
+            phash = img_data.get("phash") or perceptual_hash(image_bytes)
 
-            # Save the actual image file
-            with open(file_path, "wb") as img_file:
-                img_file.write(img_data.get("file"))
+            # Every upload is stored under the digest of its own bytes; only
+            # byte-identical images share a blob. The blob is written in the
+            # background and the analysis reads the queued bytes from memory
+            digest = self.blob_store.put(image_bytes)
+            file_path = self.blob_store.path(digest)
 
-            # Store the relative path for use within the application
-            relative_path = os.path.join("images", filename)
+            # The same bytes twice in this case are analyzed once
+            duplicate_of = case_digests.get(digest)
+            similar_to = None
+            earlier = None
+            if duplicate_of is None:
+                case_digests[digest] = i
+                # A perceptual match is only reported: a small change, such as
+                # a lesion, can leave the hash within the threshold
+                similar_to = find_duplicate(phash, case_hashes, self.hash_index.threshold)
+                earlier = self.hash_index.find(phash, exclude_case=case_id)
+                self.hash_index.add(phash, case_id, file_path)
+
+            filename = os.path.basename(file_path)
+            # Store the path relative to the data directory for use within the application
+            relative_path = os.path.relpath(file_path, self.data_dir)
 
             # Extract metadata (excluding the binary file data)
             metadata = {
@@ -260,24 +1232,30 @@ class DiagnosticService:
                 "region": img_data.get("region"),
                 "date": img_data.get("date"),
                 "notes": img_data.get("notes"),
+                "series": img_data.get("series"),
                 "filename": filename,
                 "path": relative_path,
                 "full_path": file_path,
+                "digest": digest,
+                "mime_type": sniff_mime_type(image_bytes),
+                "source_digest": sources.get(img_data.get("source_path")),
+                "source_digests": [
+                    sources.get(path) for path in img_data.get("source_paths") or []
+                ]
+                or None,
+                "phash": phash,
+                "duplicate_of": duplicate_of,
+                "similar_to": similar_to,
+                "similar_to_case": earlier["case_id"] if earlier else None,
             }
             image_metadata.append(metadata)
-            image_paths.append(file_path)
+            case_hashes.append(None if duplicate_of is not None else phash)
 
-        # Save the metadata list
-        with open(os.path.join(images_dir, "image_metadata.json"), "w") as f:
-            json.dump(image_metadata, f, indent=4)
+        # Save the metadata list; the image files are referenced by path
+        self._submit_save(case_id, self.case_store.save_images, case_id, image_metadata)
 
         return image_metadata
 
     def _save_diagnostic_results(self, case_id, diagnosis):
-        """Save the diagnostic results to a JSON file."""
-        case_dir = os.path.join(self.data_dir, case_id)
-        os.makedirs(case_dir, exist_ok=True)
-
-        # Save the diagnosis
-        with open(os.path.join(case_dir, "diagnosis.json"), "w") as f:
-            json.dump(diagnosis, f, indent=4)
+        """Queue the diagnostic results for the case store."""
+        self._submit_save(case_id, self.case_store.save_diagnosis, case_id, diagnosis)
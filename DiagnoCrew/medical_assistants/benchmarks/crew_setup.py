@@ -0,0 +1,69 @@
+"""
+Benchmark the per-case crew setup before and after the crew factory.
+
+"Before" builds MedicalAssistants() and its crew for every case, as
+run_diagnosis used to, which parses both YAML files and creates every agent
+and LLM client. "After" hands out copies from one warm CrewFactory. Nothing
+is sent to the model.
+
+Run from the DiagnoCrew directory:
+
+    python -m medical_assistants.benchmarks.crew_setup [--cases N]
+"""
+
+import argparse
+import statistics
+import time
+
+from dotenv import load_dotenv
+
+from medical_assistants.src.medical_assistants.crew import MedicalAssistants
+from medical_assistants.src.medical_assistants.crew_factory import (
+    CREW_BUILDERS,
+    CrewFactory,
+)
+
+
+def time_cases(build, cases):
+    """Return the milliseconds each of `cases` calls to `build` took."""
+    samples = []
+    for _ in range(cases):
+        start = time.perf_counter()
+        build()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def run(cases):
+    """Print one benchmark row per crew kind and setup strategy."""
+    print(f"{'crew':<8} {'setup':<8} {'mean ms':>9} {'median ms':>10} {'max ms':>8}")
+
+    for kind, builder in CREW_BUILDERS.items():
+        factory = CrewFactory(check_interval=float("inf"))
+        start = time.perf_counter()
+        factory.crew(kind)
+        warmup_ms = (time.perf_counter() - start) * 1000
+
+        rows = [
+            ("before", time_cases(lambda: getattr(MedicalAssistants(), builder)(), cases)),
+            ("after", time_cases(lambda: factory.crew(kind), cases)),
+        ]
+        for name, samples in rows:
+            print(
+                f"{kind:<8} {name:<8} {statistics.mean(samples):>9.1f} "
+                f"{statistics.median(samples):>10.1f} {max(samples):>8.1f}"
+            )
+        print(f"{kind:<8} {'warmup':<8} {warmup_ms:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--cases", type=int, default=20, help="Cases to time per row")
+    args = parser.parse_args()
+
+    load_dotenv()
+    run(args.cases)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Benchmark the image payload sent to Gemini before and after preprocessing.
+
+For every entry of IMAGE_TYPES it compares the full-size PNG that the upload
+page stores with the variant produced by ImagePreprocessor, and reports the
+bytes saved and the time spent preparing the image. With --live it also
+sends both payloads to the model and reports the response latency.
+
+Run from the DiagnoCrew directory:
+
+    python -m medical_assistants.benchmarks.image_payload [IMAGE ...] [--live]
+"""
+
+import argparse
+import io
+import os
+import time
+
+import numpy as np
+import PIL.Image
+from dotenv import load_dotenv
+
+from constants import IMAGE_TYPES
+from medical_assistants.image_preprocessing import DEFAULT_MAX_EDGE, ImagePreprocessor
+
+
+def synthetic_radiograph(width=3000, height=2500, seed=0):
+    """Create a large grayscale-looking RGB image standing in for a radiograph."""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    body = np.exp(-(((x - width / 2) / (width / 3)) ** 2 + ((y - height / 2) / (height / 2.5)) ** 2))
+    pixels = body * 180 + rng.normal(0, 12, size=body.shape)
+    gray = np.clip(pixels, 0, 255).astype(np.uint8)
+    return PIL.Image.fromarray(np.stack([gray] * 3, axis=-1))
+
+
+def as_uploaded_png(image):
+    """Encode an image the way Upload_Images stores it in session state."""
+    buf = io.BytesIO()
+    image.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def model_latency(data, mime_type, image_type):
+    """Return the seconds Gemini takes to answer a short prompt about an image."""
+    from google.genai import types
+    from medical_assistants.backend_services import IMAGE_ANALYSIS_MODEL
+    from medical_assistants.gemini_client import get_gemini_client
+
+    start = time.perf_counter()
+    get_gemini_client().models.generate_content(
+        model=IMAGE_ANALYSIS_MODEL,
+        contents=[
+            f"Describe this {image_type} image in one sentence.",
+            types.Part.from_bytes(data=data, mime_type=mime_type),
+        ],
+    )
+    return time.perf_counter() - start
+
+
+def run(sources, live=False, max_edge=DEFAULT_MAX_EDGE):
+    """Print one benchmark row per image type and source image."""
+    header = f"{'image type':<14} {'source':<24} {'png bytes':>11} {'sent bytes':>11} {'saved':>7} {'prep ms':>8}"
+    if live:
+        header += f" {'png s':>7} {'sent s':>7}"
+    print(header)
+
+    for name, image in sources:
+        original = as_uploaded_png(image)
+        for image_type in IMAGE_TYPES:
+            start = time.perf_counter()
+            # A fresh preprocessor per row so the prepared-variant cache does not hide the cost
+            prepared = ImagePreprocessor(max_edge=max_edge).prepare(original, image_type)
+            prep_ms = (time.perf_counter() - start) * 1000
+            saved = 1 - len(prepared.data) / len(original)
+            row = (
+                f"{image_type:<14} {name[:24]:<24} {len(original):>11,} "
+                f"{len(prepared.data):>11,} {saved:>7.1%} {prep_ms:>8.1f}"
+            )
+            if live:
+                row += f" {model_latency(original, 'image/png', image_type):>7.2f}"
+                row += f" {model_latency(prepared.data, prepared.mime_type, image_type):>7.2f}"
+            print(row)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("images", nargs="*", help="Image files to benchmark")
+    parser.add_argument("--live", action="store_true", help="Also measure Gemini latency")
+    parser.add_argument(
+        "--max-edge", type=int, default=DEFAULT_MAX_EDGE, help="Longest edge of prepared images"
+    )
+    args = parser.parse_args()
+
+    if args.live:
+        load_dotenv()
+    sources = [(os.path.basename(path), PIL.Image.open(path)) for path in args.images]
+    if not sources:
+        sources = [("synthetic 3000x2500", synthetic_radiograph())]
+    run(sources, live=args.live, max_edge=args.max_edge)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Benchmark building, opening and querying the knowledge index.
+
+The index is built into a temporary directory, rebuilt with nothing
+changed, reopened from disk as the workers do at startup, and then queried
+with typical symptom lists.
+
+Run from the DiagnoCrew directory:
+
+    python -m medical_assistants.benchmarks.knowledge_search [--queries N]
+"""
+
+import argparse
+import statistics
+import tempfile
+import time
+
+from medical_assistants.src.medical_assistants.knowledge_index import (
+    DEFAULT_SOURCE,
+    KnowledgeIndex,
+    build,
+)
+
+QUERIES = [
+    "fever cough shortness of breath chest pain",
+    "headache dizziness vomiting",
+    "fatigue loss of appetite abdominal pain",
+    "joint pain rash fever",
+    "sore throat fever",
+]
+
+
+def run(queries, top_k):
+    """Print the build and open times and the query latency."""
+    with tempfile.TemporaryDirectory() as directory:
+        index_dir = f"{directory}/index"
+        start = time.perf_counter()
+        manifest = build(DEFAULT_SOURCE, index_dir)
+        print(f"build   {(time.perf_counter() - start) * 1000:>8.1f} ms  "
+              f"({manifest['documents']} documents, {manifest['shard_count']} shards)")
+
+        start = time.perf_counter()
+        manifest = build(DEFAULT_SOURCE, index_dir)
+        print(f"rebuild {(time.perf_counter() - start) * 1000:>8.1f} ms  "
+              f"({len(manifest['rebuilt'])} shards changed)")
+
+        start = time.perf_counter()
+        index = KnowledgeIndex(index_dir)
+        print(f"open    {(time.perf_counter() - start) * 1000:>8.1f} ms")
+
+        samples = []
+        for i in range(queries):
+            start = time.perf_counter()
+            index.search(QUERIES[i % len(QUERIES)], top_k=top_k)
+            samples.append((time.perf_counter() - start) * 1000)
+        samples.sort()
+        print(f"query   {statistics.mean(samples):>8.3f} ms mean, "
+              f"{samples[int(len(samples) * 0.99) - 1]:.3f} ms p99")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--queries", type=int, default=1000, help="Queries to time")
+    parser.add_argument("--top-k", type=int, default=5, help="Entries per query")
+    args = parser.parse_args()
+    run(args.queries, args.top_k)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+import hashlib
+import io
+import os
+import threading
+
+import PIL.Image
+import PIL.PngImagePlugin
+
+from medical_assistants.persistence import atomic_write
+
+# Leading bytes of the codecs uploads arrive in
+MAGIC_NUMBERS = [
+    (0, b"\xff\xd8\xff", "image/jpeg"),
+    (0, b"\x89PNG\r\n\x1a\n", "image/png"),
+    (8, b"WEBP", "image/webp"),
+    (0, b"GIF8", "image/gif"),
+    (0, b"II*\x00", "image/tiff"),
+    (0, b"MM\x00*", "image/tiff"),
+    (128, b"DICM", "application/dicom"),
+]
+
+
+def content_digest(data):
+    """Return the SHA-256 hex digest that addresses a blob."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def sniff_mime_type(data):
+    """Return the MIME type of encoded image bytes, from their magic number."""
+    for offset, magic, mime_type in MAGIC_NUMBERS:
+        if data[offset : offset + len(magic)] == magic:
+            return mime_type
+    return "application/octet-stream"
+
+
+def recompress_lossless(data):
+    """
+    Re-encode a PNG at the highest compression, keeping every pixel.
+
+    The result is only used when it is smaller and decodes to the same
+    mode, palette and pixels; other codecs are returned unchanged, since
+    JPEG cannot be re-encoded without loss here, and so are PNGs that
+    cannot be decoded: recompression is optional and never fails a write.
+
+    Args:
+        data (bytes): Encoded image
+
+    Returns:
+        bytes: The smaller PNG, or the data as given
+    """
+    if sniff_mime_type(data) != "image/png":
+        return data
+    try:
+        original = PIL.Image.open(io.BytesIO(data))
+        original.load()
+        params = {
+            key: original.info[key]
+            for key in ("transparency", "icc_profile", "dpi")
+            if key in original.info
+        }
+        text = getattr(original, "text", None)
+        if text:
+            params["pnginfo"] = PIL.PngImagePlugin.PngInfo()
+            for key, value in text.items():
+                params["pnginfo"].add_text(key, value)
+        buffer = io.BytesIO()
+        original.save(buffer, format="PNG", optimize=True, **params)
+        recompressed = buffer.getvalue()
+        check = PIL.Image.open(io.BytesIO(recompressed))
+        check.load()
+    except (OSError, ValueError):
+        return data
+    if (
+        len(recompressed) >= len(data)
+        or check.mode != original.mode
+        or check.size != original.size
+        or check.getpalette() != original.getpalette()
+        or check.tobytes() != original.tobytes()
+    ):
+        return data
+    return recompressed
+
+
+class BlobStore:
+    """
+    Content-addressed store for image files.
+
+    Blobs are the original uploaded bytes, kept in their own codec, and are
+    stored under their SHA-256 digest in directories fanned out by the
+    leading digest characters (ab/cd/abcd...), so identical images are
+    stored once across all cases and no directory grows too large.
+
+    With `recompress`, PNGs are written through `recompress_lossless`: the
+    file then holds a smaller encoding of the same pixels, still addressed
+    by the digest of the upload so duplicates are found the same way. The
+    stored bytes may therefore not hash to the address; anything keyed on
+    image content uses the digest recorded with the image instead.
+    """
+
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, root, fanout=2, writer=None, recompress=False):
+        """
+        Initialize the store.
+
+        Args:
+            root (str): Directory holding the blobs
+            fanout (int): Directory levels of two digest characters each
+            writer (WriteBehindWriter, optional): Writes blobs in the background;
+                they are written synchronously when not given
+            recompress (bool): Losslessly recompress PNGs before they are written
+        """
+        self.root = root
+        self.fanout = fanout
+        self.writer = writer
+        self.recompress = recompress
+
+    @classmethod
+    def for_directory(cls, root, **kwargs):
+        """Return the process-wide store of a directory."""
+        key = os.path.abspath(root)
+        with cls._instances_lock:
+            if key not in cls._instances:
+                cls._instances[key] = cls(root, **kwargs)
+            return cls._instances[key]
+
+    def path(self, digest):
+        """Return the file path of a blob."""
+        shards = [digest[2 * i : 2 * i + 2] for i in range(self.fanout)]
+        return os.path.join(self.root, *shards, digest)
+
+    def put(self, data):
+        """
+        Store a blob unless it is already present.
+
+        Returns:
+            str: The digest addressing the blob
+        """
+        digest = content_digest(data)
+        path = self.path(digest)
+        if not os.path.exists(path):
+            transform = recompress_lossless if self.recompress else None
+            if self.writer is not None:
+                # Recompression runs on the writer thread; readers get the
+                # uploaded bytes until the file is written
+                self.writer.write(path, data, transform=transform)
+            else:
+                atomic_write(path, transform(data) if transform else data)
+        return digest
+
+    def get(self, digest):
+        """Return the bytes of a blob."""
+        path = self.path(digest)
+        if self.writer is not None:
+            return self.writer.read(path)
+        with open(path, "rb") as f:
+            return f.read()
+
+    def exists(self, digest):
+        """Check whether a blob is stored."""
+        return os.path.exists(self.path(digest))
+
+    def recompress_all(self):
+        """
+        Losslessly recompress the PNGs already in the store.
+
+        Returns:
+            int: Bytes saved
+        """
+        saved = 0
+        for directory, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if filename.startswith(".tmp-"):
+                    continue
+                path = os.path.join(directory, filename)
+                with open(path, "rb") as f:
+                    data = f.read()
+                recompressed = recompress_lossless(data)
+                if len(recompressed) < len(data):
+                    atomic_write(path, recompressed)
+                    saved += len(data) - len(recompressed)
+        return saved
+
+
+if __name__ == "__main__":
+    import sys
+
+    root = sys.argv[1] if len(sys.argv) > 1 else os.path.join("diagnostic_data", "blobs")
+    print(f"Recompressed {root}, saved {BlobStore(root).recompress_all()} bytes")
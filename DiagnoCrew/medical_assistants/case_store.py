@@ -0,0 +1,618 @@
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import zipfile
+from datetime import datetime, timedelta
+
+from medical_assistants.compression import (
+    DEFAULT_DICTIONARY_SIZE,
+    PayloadCodec,
+    train_dictionary,
+)
+
+DATABASE_NAME = "cases.sqlite3"
+ARCHIVE_DIRECTORY = "archive"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cases (
+    case_id TEXT PRIMARY KEY,
+    patient_id TEXT,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    status TEXT NOT NULL,
+    primary_diagnosis TEXT,
+    data_package BLOB NOT NULL,
+    image_metadata BLOB,
+    diagnosis BLOB,
+    archive TEXT
+);
+CREATE INDEX IF NOT EXISTS cases_patient ON cases (patient_id, created_at, case_id);
+CREATE INDEX IF NOT EXISTS cases_created ON cases (created_at, case_id);
+CREATE INDEX IF NOT EXISTS cases_diagnosis ON cases (primary_diagnosis COLLATE NOCASE);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+
+CREATE TABLE IF NOT EXISTS dictionaries (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    data BLOB NOT NULL,
+    created_at TEXT NOT NULL
+);
+"""
+
+
+# Columns returned for every case; the JSON payloads are only read when asked for
+SUMMARY_COLUMNS = ("case_id", "patient_id", "created_at", "status", "primary_diagnosis")
+PAYLOADS = ("data_package", "image_metadata", "diagnosis")
+DEFAULT_PAGE_SIZE = 20
+DEFAULT_ARCHIVE_DAYS = 365
+# Payloads sampled to train a dictionary; zstd needs a few hundred to learn from
+DICTIONARY_SAMPLES = 2000
+MIN_DICTIONARY_SAMPLES = 100
+
+
+def dumps(value):
+    """Serialize a payload as compact JSON."""
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False)
+
+
+def loads(text):
+    """Parse a JSON payload; None stays None."""
+    return None if text is None else json.loads(text)
+
+
+def now():
+    """Return the current time in the format of case timestamps."""
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def timestamp(value, end_of_day=False):
+    """
+    Bring a date or datetime bound into the format of case timestamps.
+
+    A plain date as upper bound covers the whole day.
+    """
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    value = str(value)
+    if len(value) == 10 and end_of_day:
+        return f"{value} 23:59:59"
+    return value
+
+
+def like_prefix(text):
+    """Build a LIKE pattern matching values that start with `text`, escaping its wildcards."""
+    escaped = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"{escaped}%"
+
+
+def encode_cursor(case):
+    """Return the keyset cursor pointing after a case."""
+    return f"{case['created_at']}|{case['case_id']}"
+
+
+def decode_cursor(cursor):
+    """Split a cursor from `encode_cursor` into its timestamp and case id."""
+    created_at, _, case_id = cursor.partition("|")
+    return created_at, case_id
+
+
+class CaseStore:
+    """
+    Case data in one SQLite database in WAL mode.
+
+    Each case is one row holding the data package, the image metadata and
+    the diagnosis as compressed compact JSON, with the patient id, timestamp
+    and primary diagnosis in indexed columns so lookups do not depend on the
+    number of cases. Image files stay in the blob store, referenced from
+    the image metadata; similar images are found with `PerceptualHashIndex`.
+
+    Payloads are compressed with a dictionary trained on earlier payloads
+    once `train_dictionary` has run. `archive` moves the payloads of old
+    cases into one container per month under <data_dir>/archive; their rows
+    stay in the database, so queries and loading work as before.
+    """
+
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, data_dir, codec=None):
+        """
+        Open or create the store.
+
+        Args:
+            data_dir (str): Directory holding the database file
+            codec (int, optional): Compression of new payloads, see
+                `medical_assistants.compression`; defaults to zstd when
+                zstandard is installed, else zlib
+        """
+        os.makedirs(data_dir, exist_ok=True)
+        self.path = os.path.join(data_dir, DATABASE_NAME)
+        self.archive_dir = os.path.join(data_dir, ARCHIVE_DIRECTORY)
+        self.codec = PayloadCodec(codec)
+        self._local = threading.local()
+        self._archives = {}
+        self._archives_lock = threading.Lock()
+        with self._connection() as connection:
+            connection.executescript(SCHEMA)
+        self._load_dictionaries()
+
+    @classmethod
+    def for_directory(cls, data_dir):
+        """Return the process-wide store of a directory."""
+        key = os.path.abspath(data_dir)
+        with cls._instances_lock:
+            if key not in cls._instances:
+                cls._instances[key] = cls(data_dir)
+            return cls._instances[key]
+
+    def _connection(self):
+        """Return this thread's connection; SQLite connections are not shared between threads."""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("PRAGMA foreign_keys=ON")
+            self._local.connection = connection
+        return connection
+
+    def _load_dictionaries(self):
+        """Register the stored dictionaries with the codec; the newest compresses new payloads."""
+        rows = self._connection().execute("SELECT id, data FROM dictionaries ORDER BY id").fetchall()
+        for row in rows:
+            self.codec.add_dictionary(row["id"], bytes(row["data"]))
+
+    def _encode(self, value):
+        """Serialize and compress a payload; None stays None."""
+        return None if value is None else self.codec.encode(dumps(value))
+
+    def _decode(self, stored):
+        """Decompress and parse a stored payload; None stays None."""
+        if stored is None:
+            return None
+        dictionary_id = int.from_bytes(stored[1:5], "big")
+        if dictionary_id and dictionary_id not in self.codec.dictionaries:
+            # Trained by another process since this store was opened
+            self._load_dictionaries()
+        return loads(self.codec.decode(stored))
+
+    def _payloads(self, row, keys):
+        """
+        Load the payloads of a case row.
+
+        Payloads of archived cases come from their container, unless the
+        row was written again after the case was archived.
+        """
+        archived = self._read_archived(row["archive"], row["case_id"]) if row["archive"] else {}
+        return {
+            key: self._decode(row[key]) if row[key] else archived.get(key)
+            for key in keys
+        }
+
+    def save_case(self, data_package):
+        """Insert or replace the data package of a case."""
+        with self._connection() as connection:
+            connection.execute(
+                """
+                INSERT INTO cases (case_id, patient_id, created_at, updated_at, status, data_package)
+                VALUES (?, ?, ?, ?, 'submitted', ?)
+                ON CONFLICT (case_id) DO UPDATE SET
+                    patient_id = excluded.patient_id,
+                    updated_at = excluded.updated_at,
+                    data_package = excluded.data_package
+                """,
+                (
+                    data_package["case_id"],
+                    (data_package.get("patient_data") or {}).get("id"),
+                    data_package.get("timestamp") or now(),
+                    now(),
+                    self._encode(data_package),
+                ),
+            )
+
+    def save_images(self, case_id, image_metadata):
+        """Store the image metadata of a case."""
+        with self._connection() as connection:
+            connection.execute(
+                "UPDATE cases SET image_metadata = ?, updated_at = ? WHERE case_id = ?",
+                (self._encode(image_metadata), now(), case_id),
+            )
+
+    def save_diagnosis(self, case_id, diagnosis):
+        """Store the diagnosis of a case; a diagnosis with an "error" marks the case as failed."""
+        failed = "error" in diagnosis
+        with self._connection() as connection:
+            connection.execute(
+                """
+                UPDATE cases SET diagnosis = ?, primary_diagnosis = ?, status = ?, updated_at = ?
+                WHERE case_id = ?
+                """,
+                (
+                    self._encode(diagnosis),
+                    None if failed else diagnosis.get("primary_diagnosis"),
+                    "failed" if failed else "diagnosed",
+                    now(),
+                    case_id,
+                ),
+            )
+
+    def get_case(self, case_id):
+        """
+        Load a case.
+
+        Returns:
+            dict: "case_id", "patient_id", "created_at", "status", "primary_diagnosis",
+                "data_package", "image_metadata" and "diagnosis"; None when there is no such case
+        """
+        row = self._connection().execute(
+            "SELECT * FROM cases WHERE case_id = ?", (case_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        case = dict(row)
+        del case["archive"]
+        case.update(self._payloads(row, PAYLOADS))
+        return case
+
+    def find_cases(
+        self,
+        patient_id=None,
+        since=None,
+        until=None,
+        diagnosis=None,
+        limit=DEFAULT_PAGE_SIZE,
+        after=None,
+        payloads=(),
+    ):
+        """
+        Return one page of cases, newest first.
+
+        Pages are cut by keyset pagination on (created_at, case_id), so the
+        cost of a page does not grow with how far into the results it is.
+
+        Args:
+            patient_id (str, optional): Only cases of this patient
+            since (str | datetime, optional): Only cases created at or after this time
+            until (str | datetime, optional): Only cases created at or before this time;
+                a plain date includes the whole day
+            diagnosis (str, optional): Only cases whose primary diagnosis starts with
+                this text, ignoring case; a prefix match can use the diagnosis index
+            limit (int): Page size
+            after (str, optional): Cursor of the previous page
+            payloads (iterable): Which of "data_package", "image_metadata" and
+                "diagnosis" to load with each case
+
+        Returns:
+            tuple: The cases, as dictionaries with the summary columns and the
+                requested payloads, and the cursor of the next page or None
+        """
+        payloads = [p for p in PAYLOADS if p in set(payloads)]
+        conditions, params = [], []
+        if patient_id is not None:
+            conditions.append("patient_id = ?")
+            params.append(patient_id)
+        if since is not None:
+            conditions.append("created_at >= ?")
+            params.append(timestamp(since))
+        if until is not None:
+            conditions.append("created_at <= ?")
+            params.append(timestamp(until, end_of_day=True))
+        if diagnosis:
+            conditions.append("primary_diagnosis LIKE ? ESCAPE '\\'")
+            params.append(like_prefix(diagnosis))
+        if after:
+            created_at, case_id = decode_cursor(after)
+            conditions.append("(created_at < ? OR (created_at = ? AND case_id < ?))")
+            params.extend([created_at, created_at, case_id])
+
+        columns = SUMMARY_COLUMNS + (tuple(payloads) + ("archive",) if payloads else ())
+        query = f"SELECT {', '.join(columns)} FROM cases"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY created_at DESC, case_id DESC LIMIT ?"
+        rows = self._connection().execute(query, params + [limit]).fetchall()
+
+        cases = []
+        for row in rows:
+            case = {key: row[key] for key in SUMMARY_COLUMNS}
+            if payloads:
+                case.update(self._payloads(row, payloads))
+            cases.append(case)
+        cursor = encode_cursor(cases[-1]) if len(cases) == limit else None
+        return cases, cursor
+
+    def iter_cases(self, page_size=500, **filters):
+        """
+        Iterate lazily over all cases matching the filters of `find_cases`, newest first.
+
+        Only one page is held in memory at a time, so audits can walk any
+        number of cases.
+        """
+        after = filters.pop("after", None)
+        while True:
+            cases, after = self.find_cases(limit=page_size, after=after, **filters)
+            yield from cases
+            if after is None:
+                return
+
+    def train_dictionary(self, samples=DICTIONARY_SAMPLES, size=DEFAULT_DICTIONARY_SIZE):
+        """
+        Train a compression dictionary on the payloads of the latest cases.
+
+        New payloads are compressed with it from then on; payloads written
+        with earlier dictionaries stay readable. Run `recompress` to rewrite
+        them with the new one.
+
+        Args:
+            samples (int): Cases to sample
+            size (int): Dictionary size in bytes
+
+        Returns:
+            int: Id of the new dictionary
+
+        Raises:
+            ValueError: If there are too few payloads to learn from
+        """
+        rows = self._connection().execute(
+            f"""
+            SELECT case_id, archive, {', '.join(PAYLOADS)} FROM cases
+            WHERE archive IS NULL ORDER BY created_at DESC LIMIT ?
+            """,
+            (samples,),
+        ).fetchall()
+        payloads = [
+            dumps(value).encode("utf-8")
+            for row in rows
+            for value in self._payloads(row, PAYLOADS).values()
+            if value is not None
+        ]
+        if len(payloads) < MIN_DICTIONARY_SAMPLES:
+            raise ValueError(
+                f"Need at least {MIN_DICTIONARY_SAMPLES} payloads to train a dictionary, found {len(payloads)}"
+            )
+        data = train_dictionary(payloads, self.codec.codec, size)
+        with self._connection() as connection:
+            dictionary_id = connection.execute(
+                "INSERT INTO dictionaries (data, created_at) VALUES (?, ?)", (data, now())
+            ).lastrowid
+        self.codec.add_dictionary(dictionary_id, data)
+        return dictionary_id
+
+    def recompress(self, batch_size=500):
+        """
+        Rewrite payloads that use another codec or dictionary.
+
+        Returns:
+            int: Number of cases rewritten
+        """
+        header = bytes([self.codec.codec]) + (
+            self.codec.dictionary_id if self.codec.dictionary_id in self.codec.dictionaries else 0
+        ).to_bytes(4, "big")
+        rewritten, last = 0, 0
+        while True:
+            rows = self._connection().execute(
+                f"""
+                SELECT rowid, {', '.join(PAYLOADS)} FROM cases
+                WHERE rowid > ? AND archive IS NULL ORDER BY rowid LIMIT ?
+                """,
+                (last, batch_size),
+            ).fetchall()
+            if not rows:
+                return rewritten
+            updates = []
+            for row in rows:
+                stale = [
+                    key for key in PAYLOADS
+                    if row[key] is not None and bytes(row[key][:5]) != header
+                ]
+                if stale:
+                    values = {key: self._encode(self._decode(row[key])) for key in stale}
+                    updates.append((values, row["rowid"]))
+            with self._connection() as connection:
+                for values, rowid in updates:
+                    assignments = ", ".join(f"{key} = ?" for key in values)
+                    connection.execute(
+                        f"UPDATE cases SET {assignments} WHERE rowid = ?",
+                        list(values.values()) + [rowid],
+                    )
+            rewritten += len(updates)
+            last = rows[-1]["rowid"]
+
+    def archive(self, older_than_days=DEFAULT_ARCHIVE_DAYS):
+        """
+        Move the payloads of old cases into one container per month.
+
+        A container is a zip file of the compressed payloads of each case,
+        rewritten as a whole and swapped in atomically, then the rows are
+        pointed at it. Cases stay queryable by their indexed columns and
+        `get_case` and `find_cases` load their payloads from the container.
+
+        Args:
+            older_than_days (int): Archive cases created more than this many days ago
+
+        Returns:
+            int: Number of cases archived
+        """
+        cutoff = (datetime.now() - timedelta(days=older_than_days)).strftime("%Y-%m-%d %H:%M:%S")
+        months = [
+            row["month"]
+            for row in self._connection().execute(
+                """
+                SELECT DISTINCT substr(created_at, 1, 7) AS month FROM cases
+                WHERE archive IS NULL AND created_at < ? ORDER BY month
+                """,
+                (cutoff,),
+            )
+        ]
+        archived = 0
+        for month in months:
+            archived += self._archive_month(month, cutoff)
+        return archived
+
+    def _archive_month(self, month, cutoff):
+        """Add the unarchived cases of one month, created before the cutoff, to its container."""
+        rows = self._connection().execute(
+            f"""
+            SELECT case_id, archive, {', '.join(PAYLOADS)} FROM cases
+            WHERE archive IS NULL AND created_at < ? AND created_at >= ? AND created_at < ?
+            """,
+            (cutoff, f"{month}-01", f"{month}-99"),
+        )
+        name = f"cases-{month}.zip"
+        path = os.path.join(self.archive_dir, name)
+        os.makedirs(self.archive_dir, exist_ok=True)
+        fd, temporary = tempfile.mkstemp(dir=self.archive_dir, prefix=".tmp-")
+        os.close(fd)
+        case_ids = []
+        try:
+            # Members are compressed already, so the container only stores them
+            with zipfile.ZipFile(temporary, "w", zipfile.ZIP_STORED) as container:
+                for row in rows:
+                    container.writestr(
+                        row["case_id"], self.codec.encode(dumps(self._payloads(row, PAYLOADS)))
+                    )
+                    case_ids.append(row["case_id"])
+                if os.path.exists(path):
+                    with zipfile.ZipFile(path) as previous:
+                        for member in previous.namelist():
+                            if member not in case_ids:
+                                container.writestr(member, previous.read(member))
+            os.replace(temporary, path)
+        except BaseException:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+
+        with self._connection() as connection:
+            connection.executemany(
+                """
+                UPDATE cases SET archive = ?, data_package = X'', image_metadata = NULL, diagnosis = NULL
+                WHERE case_id = ? AND archive IS NULL
+                """,
+                [(name, case_id) for case_id in case_ids],
+            )
+        return len(case_ids)
+
+    def _read_archived(self, name, case_id):
+        """Return the payloads of an archived case from its container."""
+        path = os.path.join(self.archive_dir, name)
+        modified = os.stat(path).st_mtime_ns
+        with self._archives_lock:
+            opened = self._archives.get(name)
+            if opened is None or opened[0] != modified:
+                if opened is not None:
+                    opened[1].close()
+                opened = (modified, zipfile.ZipFile(path))
+                self._archives[name] = opened
+            member = opened[1].read(case_id)
+        return self._decode(member)
+
+    def vacuum(self):
+        """Return the space freed by `recompress` and `archive` to the file system."""
+        self._connection().execute("VACUUM")
+
+    def migrate(self, data_dir):
+        """
+        Import the per-case directories of JSON files the service used to write.
+
+        Cases already in the store are skipped and the directories are left
+        in place; image files keep their paths.
+
+        Args:
+            data_dir (str): Directory holding one directory per case
+
+        Returns:
+            tuple: Number of cases imported, and the error of every case that
+                could not be read, by case id
+        """
+        imported, skipped = 0, {}
+        for case_id in sorted(os.listdir(data_dir)):
+            case_dir = os.path.join(data_dir, case_id)
+            package_path = os.path.join(case_dir, "data_package.json")
+            if not os.path.isfile(package_path):
+                continue
+            exists = self._connection().execute(
+                "SELECT 1 FROM cases WHERE case_id = ?", (case_id,)
+            ).fetchone()
+            if exists:
+                continue
+
+            try:
+                with open(package_path, "r") as f:
+                    data_package = json.load(f)
+                case_id = data_package.setdefault("case_id", case_id)
+                self.save_case(data_package)
+
+                metadata_path = os.path.join(case_dir, "images", "image_metadata.json")
+                if os.path.isfile(metadata_path):
+                    with open(metadata_path, "r") as f:
+                        self.save_images(case_id, json.load(f))
+
+                diagnosis_path = os.path.join(case_dir, "diagnosis.json")
+                if os.path.isfile(diagnosis_path):
+                    with open(diagnosis_path, "r") as f:
+                        self.save_diagnosis(case_id, json.load(f))
+            except (OSError, ValueError, KeyError) as e:
+                skipped[case_id] = str(e)
+                continue
+            imported += 1
+        return imported, skipped
+
+    def migrate_once(self, data_dir):
+        """
+        Run `migrate` the first time a store is opened for a data directory.
+
+        Returns:
+            tuple: The result of `migrate`, (0, {}) when it ran before
+        """
+        with self._connection() as connection:
+            done = connection.execute(
+                "SELECT value FROM meta WHERE key = 'migrated_at'"
+            ).fetchone()
+        if done:
+            return 0, {}
+        result = self.migrate(data_dir)
+        with self._connection() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('migrated_at', ?)", (now(),)
+            )
+        return result
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Maintain the case store")
+    parser.add_argument(
+        "command",
+        choices=["migrate", "train", "recompress", "archive"],
+        help="migrate: import per-case JSON directories; train: train a compression "
+        "dictionary; recompress: rewrite payloads with the current dictionary; "
+        "archive: move old cases into monthly containers",
+    )
+    parser.add_argument("data_dir", nargs="?", default="diagnostic_data")
+    parser.add_argument("--days", type=int, default=DEFAULT_ARCHIVE_DAYS, help="Age of cases to archive")
+    args = parser.parse_args()
+
+    store = CaseStore(args.data_dir)
+    if args.command == "migrate":
+        count, skipped = store.migrate(args.data_dir)
+        print(f"Imported {count} cases into {store.path}")
+        for case_id, error in skipped.items():
+            print(f"Skipped case {case_id}: {error}")
+    elif args.command == "train":
+        print(f"Trained dictionary {store.train_dictionary()}")
+    elif args.command == "recompress":
+        print(f"Recompressed {store.recompress()} cases")
+        store.vacuum()
+    else:
+        print(f"Archived {store.archive(args.days)} cases into {store.archive_dir}")
+        store.vacuum()
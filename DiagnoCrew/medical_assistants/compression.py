@@ -0,0 +1,147 @@
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Codec tags; every encoded payload starts with the tag and a 4-byte dictionary id
+RAW = 0
+ZLIB = 1
+ZSTD = 2
+
+ZSTD_LEVEL = 10
+ZLIB_LEVEL = 9
+# zlib only looks back 32 KB, so a longer dictionary would be wasted
+ZLIB_DICTIONARY_SIZE = 32 * 1024
+DEFAULT_DICTIONARY_SIZE = 16 * 1024
+
+
+def default_codec():
+    """Return the best codec available: zstd when zstandard is installed, else zlib."""
+    return ZSTD if zstandard is not None else ZLIB
+
+
+def train_dictionary(samples, codec=None, size=DEFAULT_DICTIONARY_SIZE):
+    """
+    Build a shared compression dictionary from sample payloads.
+
+    Small JSON payloads share most of their keys and phrasing, which a
+    dictionary lets each payload reference instead of repeating.
+
+    Args:
+        samples (list): Encoded sample payloads (bytes)
+        codec (int, optional): ZSTD or ZLIB, defaults to `default_codec()`
+        size (int): Dictionary size in bytes
+
+    Returns:
+        bytes: The dictionary
+    """
+    codec = codec or default_codec()
+    if codec == ZSTD:
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to train zstd dictionaries")
+        return zstandard.train_dictionary(size, samples).as_bytes()
+    # zlib has no trainer: the most recent samples make a good dictionary,
+    # with the most common content last where matches are cheapest
+    return b"".join(samples)[-min(size, ZLIB_DICTIONARY_SIZE) :]
+
+
+class PayloadCodec:
+    """
+    Compresses stored payloads, optionally with a shared dictionary.
+
+    Encoded payloads are self-describing: a codec tag and the id of the
+    dictionary they were compressed with, followed by the compressed bytes.
+    Any payload can be decoded as long as its dictionary is registered, so
+    dictionaries can be retrained without rewriting old rows.
+    """
+
+    def __init__(self, codec=None, dictionaries=None, dictionary_id=0):
+        """
+        Initialize the codec.
+
+        Args:
+            codec (int, optional): Codec for new payloads, defaults to `default_codec()`
+            dictionaries (dict, optional): Dictionary bytes by id, for decoding
+            dictionary_id (int): Dictionary for new payloads, 0 for none
+        """
+        self.codec = codec or default_codec()
+        self.dictionaries = dict(dictionaries or {})
+        self.dictionary_id = dictionary_id
+
+    def add_dictionary(self, dictionary_id, data, active=True):
+        """Register a dictionary, and use it for new payloads when `active`."""
+        self.dictionaries[dictionary_id] = data
+        if active:
+            self.dictionary_id = dictionary_id
+
+    def encode(self, data):
+        """
+        Compress a payload.
+
+        Args:
+            data (bytes | str): The payload; text is encoded as UTF-8
+
+        Returns:
+            bytes: The tagged, compressed payload
+        """
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        dictionary_id = self.dictionary_id
+        dictionary = self.dictionaries.get(dictionary_id)
+        if dictionary is None:
+            dictionary_id = 0
+
+        if self.codec == ZSTD:
+            compressor = zstandard.ZstdCompressor(
+                level=ZSTD_LEVEL,
+                dict_data=zstandard.ZstdCompressionDict(dictionary) if dictionary else None,
+            )
+            body = compressor.compress(data)
+        elif self.codec == ZLIB:
+            compressor = (
+                zlib.compressobj(ZLIB_LEVEL, zdict=dictionary)
+                if dictionary
+                else zlib.compressobj(ZLIB_LEVEL)
+            )
+            body = compressor.compress(data) + compressor.flush()
+        else:
+            dictionary_id, body = 0, data
+        return bytes([self.codec]) + dictionary_id.to_bytes(4, "big") + body
+
+    def decode(self, payload):
+        """
+        Decompress a payload from `encode`.
+
+        Returns:
+            bytes: The original payload
+
+        Raises:
+            ValueError: If the payload's dictionary is not registered or its codec
+                is not available
+        """
+        codec = payload[0]
+        dictionary_id = int.from_bytes(payload[1:5], "big")
+        body = payload[5:]
+        dictionary = None
+        if dictionary_id:
+            dictionary = self.dictionaries.get(dictionary_id)
+            if dictionary is None:
+                raise ValueError(f"Unknown compression dictionary {dictionary_id}")
+
+        if codec == RAW:
+            return bytes(body)
+        if codec == ZLIB:
+            decompressor = (
+                zlib.decompressobj(zdict=dictionary) if dictionary else zlib.decompressobj()
+            )
+            return decompressor.decompress(body) + decompressor.flush()
+        if codec == ZSTD:
+            if zstandard is None:
+                raise ValueError("zstandard is required to read zstd-compressed payloads")
+            decompressor = zstandard.ZstdDecompressor(
+                dict_data=zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+            )
+            return decompressor.decompress(body)
+        raise ValueError(f"Unknown compression codec {codec}")
@@ -0,0 +1,143 @@
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import Future
+
+from medical_assistants.findings_cache import FindingsCache
+
+DEFAULT_MAX_ENTRIES = 128
+DEFAULT_TTL = 24 * 60 * 60  # seconds
+
+
+def canonicalize(value):
+    """
+    Bring a value into a canonical, order-independent form.
+
+    Strings holding JSON documents are parsed, dictionary keys are sorted by
+    `json.dumps`, and lists of plain values (symptoms, medications, ...) are
+    sorted. Lists of dictionaries keep their order, since their position
+    carries meaning (e.g. the image index).
+    """
+    if isinstance(value, str):
+        stripped = value.strip()
+        if stripped[:1] in ("{", "["):
+            try:
+                return canonicalize(json.loads(stripped))
+            except ValueError:
+                pass
+        return stripped
+    if isinstance(value, dict):
+        return {str(k): canonicalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        items = [canonicalize(v) for v in value]
+        if all(not isinstance(v, (dict, list)) for v in items):
+            return sorted(items, key=lambda v: json.dumps(v, sort_keys=True))
+        return items
+    return value
+
+
+class DiagnosisCache:
+    """
+    Cache of finished diagnoses with single-flight de-duplication.
+
+    Entries are keyed by a hash of the canonicalized crew inputs and a
+    fingerprint of the agent/task configuration and model versions, so a
+    double click, a Streamlit rerun or a resubmitted case returns the stored
+    diagnosis instead of running the crew again. Storage goes through a
+    FindingsCache, which provides the LRU memory tier, the disk tier and TTL
+    expiry. While a diagnosis is being computed, identical submissions wait
+    for that run instead of starting their own.
+    """
+
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, cache_dir, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL):
+        """
+        Initialize the cache.
+
+        Args:
+            cache_dir (str): Directory holding the on-disk tier
+            max_entries (int): Number of diagnoses kept in memory
+            ttl (float): Seconds after which a diagnosis is recomputed
+        """
+        self.store = FindingsCache(cache_dir, max_entries=max_entries, ttl=ttl)
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_directory(cls, cache_dir, **kwargs):
+        """Return the process-wide cache for a directory so the memory tier survives between cases."""
+        key = os.path.abspath(cache_dir)
+        with cls._instances_lock:
+            if key not in cls._instances:
+                cls._instances[key] = cls(cache_dir, **kwargs)
+            return cls._instances[key]
+
+    @staticmethod
+    def make_key(inputs, fingerprint):
+        """
+        Build the cache key for a diagnosis request.
+
+        Args:
+            inputs (dict): Crew inputs; JSON string values are parsed before hashing
+            fingerprint (str): Identifies the agent/task configuration and model versions
+
+        Returns:
+            str: Hex digest identifying the request
+        """
+        payload = json.dumps(
+            {"inputs": canonicalize(inputs), "fingerprint": fingerprint},
+            sort_keys=True,
+            separators=(",", ":"),
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get_or_run(self, key, compute, bypass=False, cacheable=None):
+        """
+        Return the cached value for a key, computing it at most once at a time.
+
+        Args:
+            key (str): Cache key from `make_key`
+            compute (callable): Produces the value on a miss
+            bypass (bool): Skip the cache lookup and any identical run in flight and
+                recompute; the fresh value is stored
+            cacheable (callable, optional): Decides whether a computed value is stored
+
+        Returns:
+            tuple: The value and where it came from: "hit" for the cache,
+                "shared" for an identical run that was already in flight,
+                "miss" for a fresh computation
+        """
+        if bypass:
+            value = compute()
+            if cacheable is None or cacheable(value):
+                self.store.put(key, value)
+            return value, "miss"
+
+        cached = self.store.get(key)
+        if cached is not None:
+            return cached, "hit"
+
+        with self._lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._in_flight[key] = future
+        if not leader:
+            return future.result(), "shared"
+
+        try:
+            value = compute()
+            if cacheable is None or cacheable(value):
+                self.store.put(key, value)
+            future.set_result(value)
+            return value, "miss"
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
@@ -0,0 +1,238 @@
+import io
+import mmap
+import os
+import shutil
+import uuid
+from datetime import datetime
+
+import numpy as np
+import PIL.Image
+import pydicom
+
+try:
+    from pydicom.pixels import apply_modality_lut
+except ImportError:  # pydicom < 3
+    from pydicom.pixel_data_handlers.util import apply_modality_lut
+
+# DICOM Modality codes and the image types they map to, by body part
+MODALITY_IMAGE_TYPES = {
+    "CR": {"CHEST": "Chest X-ray", None: "Bone X-ray"},
+    "DX": {"CHEST": "Chest X-ray", None: "Bone X-ray"},
+    "MR": {"HEAD": "Brain MRI", "BRAIN": "Brain MRI", None: "Other"},
+    "CT": {"ABDOMEN": "Abdominal CT", "PELVIS": "Abdominal CT", None: "Other"},
+    "US": {None: "Ultrasound"},
+}
+
+# DICOM BodyPartExamined values and the body regions they map to
+BODY_PART_REGIONS = {
+    "CHEST": "Chest/Thorax",
+    "THORAX": "Chest/Thorax",
+    "LUNG": "Chest/Thorax",
+    "HEART": "Chest/Thorax",
+    "ABDOMEN": "Abdomen",
+    "PELVIS": "Abdomen",
+    "LIVER": "Abdomen",
+    "KIDNEY": "Abdomen",
+    "HEAD": "Head/Brain",
+    "BRAIN": "Head/Brain",
+    "SKULL": "Head/Brain",
+    "SPINE": "Spine",
+    "CSPINE": "Spine",
+    "TSPINE": "Spine",
+    "LSPINE": "Spine",
+    "HAND": "Extremities",
+    "FOOT": "Extremities",
+    "KNEE": "Extremities",
+    "ANKLE": "Extremities",
+    "ELBOW": "Extremities",
+    "SHOULDER": "Extremities",
+    "HIP": "Extremities",
+    "ARM": "Extremities",
+    "LEG": "Extremities",
+}
+
+# Chunk size used when spooling uploads to disk
+SPOOL_CHUNK_SIZE = 1024 * 1024
+
+
+def is_dicom_upload(filename):
+    """Return True if an uploaded file name looks like a DICOM file."""
+    return (filename or "").lower().endswith((".dcm", ".dicom"))
+
+
+def spool_upload(uploaded_file, directory):
+    """
+    Copy an uploaded file to disk in chunks.
+
+    Args:
+        uploaded_file (file-like): The uploaded file
+        directory (str): Directory the copy is written to
+
+    Returns:
+        str: Path of the copy
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"upload_{uuid.uuid4().hex}.dcm")
+    uploaded_file.seek(0)
+    with open(path, "wb") as f:
+        shutil.copyfileobj(uploaded_file, f, SPOOL_CHUNK_SIZE)
+    return path
+
+
+class DicomImage:
+    """
+    A DICOM file whose pixel data is decoded only when it is needed.
+
+    The header is parsed without the pixel data on construction. The file is
+    memory-mapped, so the pixel data is read straight from the page cache when
+    `pixels` or `render` is first used instead of being copied into memory up
+    front.
+    """
+
+    def __init__(self, path):
+        """
+        Parse the header of a DICOM file.
+
+        Args:
+            path (str): Path of the DICOM file
+        """
+        self.path = path
+        with open(path, "rb") as f:
+            self.header = pydicom.dcmread(f, stop_before_pixels=True)
+        self._pixels = None
+
+    @property
+    def modality(self):
+        return str(self.header.get("Modality", "") or "").upper()
+
+    @property
+    def body_part(self):
+        return str(self.header.get("BodyPartExamined", "") or "").upper().replace(" ", "")
+
+    @property
+    def series_uid(self):
+        return str(self.header.get("SeriesInstanceUID", "") or "") or None
+
+    @property
+    def slice_position(self):
+        """Return the position of the slice along the scan axis, or None when it is unknown."""
+        position = self.header.get("ImagePositionPatient")
+        if position is not None and len(position) == 3:
+            return float(position[2])
+        for tag in ("SliceLocation", "InstanceNumber"):
+            value = first_value(self.header.get(tag))
+            if value is not None:
+                return value
+        return None
+
+    @property
+    def study_date(self):
+        """Return the study (or acquisition) date as a date, or None when it is missing."""
+        for tag in ("StudyDate", "SeriesDate", "AcquisitionDate"):
+            value = str(self.header.get(tag, "") or "")
+            try:
+                return datetime.strptime(value[:8], "%Y%m%d").date()
+            except ValueError:
+                continue
+        return None
+
+    def image_type(self):
+        """Return the IMAGE_TYPES entry matching the modality and body part."""
+        by_body_part = MODALITY_IMAGE_TYPES.get(self.modality)
+        if by_body_part is None:
+            return "Other"
+        return by_body_part.get(self.body_part, by_body_part[None])
+
+    def region(self):
+        """Return the BODY_REGIONS entry matching the body part."""
+        return BODY_PART_REGIONS.get(self.body_part, "Other")
+
+    def metadata(self):
+        """Return the values used to prefill the upload form."""
+        return {
+            "type": self.image_type(),
+            "region": self.region(),
+            "date": self.study_date,
+            "modality": self.modality,
+            "body_part": self.body_part,
+            "series_uid": self.series_uid,
+            "slice_position": self.slice_position,
+        }
+
+    @property
+    def pixels(self):
+        """Decode the pixel data on first access and apply the modality LUT."""
+        if self._pixels is None:
+            with open(self.path, "rb") as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    dataset = pydicom.dcmread(mapped)
+                    pixels = dataset.pixel_array
+            if self.header.get("PhotometricInterpretation", "").startswith("MONO"):
+                pixels = apply_modality_lut(pixels, self.header)
+            self._pixels = pixels
+        return self._pixels
+
+    def render(self, frame=None):
+        """
+        Render the image as an 8-bit PIL image.
+
+        Grayscale images are windowed with the file's window center and width,
+        or with the full value range when the file has none. MONOCHROME1
+        images are inverted so that higher values are brighter.
+
+        Args:
+            frame (int, optional): Frame of a multi-frame file, defaults to the middle one
+
+        Returns:
+            PIL.Image.Image: An "L" image for grayscale data, "RGB" otherwise
+        """
+        pixels = self.pixels
+        photometric = str(self.header.get("PhotometricInterpretation", ""))
+        frames = int(self.header.get("NumberOfFrames", 1) or 1)
+        if frames > 1:
+            pixels = pixels[frame if frame is not None else frames // 2]
+
+        if not photometric.startswith("MONO"):
+            return PIL.Image.fromarray(np.asarray(pixels, dtype=np.uint8)).convert("RGB")
+
+        pixels = window(pixels, *self.window())
+        if photometric == "MONOCHROME1":
+            pixels = 255 - pixels
+        return PIL.Image.fromarray(pixels)
+
+    def render_png(self, frame=None):
+        """Render the image and encode it as PNG bytes."""
+        buf = io.BytesIO()
+        self.render(frame).save(buf, format="PNG")
+        return buf.getvalue()
+
+    def window(self):
+        """Return the (center, width) to display the image with."""
+        center = first_value(self.header.get("WindowCenter"))
+        width = first_value(self.header.get("WindowWidth"))
+        if center is not None and width is not None and width > 0:
+            return center, width
+        pixels = self.pixels
+        low, high = float(np.min(pixels)), float(np.max(pixels))
+        return (low + high) / 2, max(high - low, 1.0)
+
+
+def window(pixels, center, width):
+    """Map values inside the window linearly to 0-255 and clip the rest."""
+    low = center - width / 2
+    scaled = (np.asarray(pixels, dtype=np.float32) - low) * (255.0 / width)
+    return np.clip(scaled, 0, 255).astype(np.uint8)
+
+
+def first_value(value):
+    """Return the first number of a possibly multi-valued DICOM element, or None."""
+    if value is None:
+        return None
+    if isinstance(value, pydicom.dataelem.DataElement):
+        value = value.value
+    if isinstance(value, (list, tuple, pydicom.multival.MultiValue)):
+        value = value[0] if len(value) else None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,199 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_MAX_ENTRIES = 512
+DEFAULT_MAX_DISK_BYTES = 256 * 1024 * 1024
+DEFAULT_TTL = 30 * 24 * 60 * 60  # seconds
+
+
+class FindingsCache:
+    """
+    Content-addressed cache of image findings.
+
+    Entries are keyed by a hash of the image bytes, the image metadata that
+    goes into the prompt and the model name, so re-running a case or
+    attaching the same study to a follow-up case does not call the model
+    again. Lookups go through an in-memory LRU tier first and then an
+    on-disk tier of small JSON files. Both tiers expire entries after `ttl`
+    seconds; the disk tier also evicts the oldest files once it grows past
+    `max_disk_bytes`.
+    """
+
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(
+        self,
+        cache_dir,
+        max_entries=DEFAULT_MAX_ENTRIES,
+        max_disk_bytes=DEFAULT_MAX_DISK_BYTES,
+        ttl=DEFAULT_TTL,
+    ):
+        """
+        Initialize the cache.
+
+        Args:
+            cache_dir (str): Directory holding the on-disk tier
+            max_entries (int): Number of entries kept in memory
+            max_disk_bytes (int): Size budget of the on-disk tier
+            ttl (float): Seconds after which an entry is considered stale
+        """
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.ttl = ttl
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_bytes = None
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @classmethod
+    def for_directory(cls, cache_dir, **kwargs):
+        """Return the process-wide cache for a directory so the memory tier survives between cases."""
+        key = os.path.abspath(cache_dir)
+        with cls._instances_lock:
+            if key not in cls._instances:
+                cls._instances[key] = cls(cache_dir, **kwargs)
+            return cls._instances[key]
+
+    @staticmethod
+    def make_key(image_digest, image_type, image_region, image_notes, model):
+        """
+        Build the cache key for an image analysis request.
+
+        Args:
+            image_digest (str): SHA-256 hex digest of the uploaded image content
+            image_type (str): Image type, e.g. "Chest X-ray"
+            image_region (str): Body region
+            image_notes (str): Clinician notes sent with the image
+            model (str): Model name used for the analysis
+
+        Returns:
+            str: Hex digest identifying the request
+        """
+        digest = hashlib.sha256(image_digest.encode("ascii"))
+        for part in (image_type, image_region, image_notes, model):
+            digest.update(b"\0")
+            digest.update((part or "").encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, key):
+        """Return the cached findings for a key, or None on a miss."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                created, value = entry
+                if now - created <= self.ttl:
+                    self._memory.move_to_end(key)
+                    self._stats["memory_hits"] += 1
+                    return dict(value)
+                del self._memory[key]
+
+        entry = self._read_disk(key, now)
+        with self._lock:
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            self._stats["disk_hits"] += 1
+            self._remember(key, *entry)
+        return dict(entry[1])
+
+    def put(self, key, value):
+        """Store findings for a key in both tiers."""
+        created = time.time()
+        with self._lock:
+            self._remember(key, created, dict(value))
+        self._write_disk(key, created, value)
+
+    def stats(self):
+        """Return hit and miss counters along with the overall hit rate."""
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        hits = stats["memory_hits"] + stats["disk_hits"]
+        stats["hit_rate"] = hits / lookups if lookups else 0.0
+        return stats
+
+    def _remember(self, key, created, value):
+        """Insert into the memory tier, evicting the least recently used entries. Caller holds the lock."""
+        self._memory[key] = (created, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def _read_disk(self, key, now):
+        """Read an entry from the disk tier, dropping it if it has expired."""
+        path = self._path(key)
+        try:
+            with open(path, "r") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if now - entry.get("created", 0) > self.ttl:
+            self._remove(path)
+            return None
+        return entry["created"], entry["value"]
+
+    def _write_disk(self, key, created, value):
+        """Atomically write an entry to the disk tier and enforce the size budget."""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        payload = json.dumps({"created": created, "value": value}).encode("utf-8")
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(payload)
+            os.replace(tmp_path, path)
+        except OSError:
+            self._remove(tmp_path)
+            return
+
+        with self._lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = sum(size for _, _, size in self._disk_entries())
+            else:
+                self._disk_bytes += len(payload)
+            over_budget = self._disk_bytes > self.max_disk_bytes
+        if over_budget:
+            self._evict_disk()
+
+    def _disk_entries(self):
+        """Yield (mtime, path, size) for every entry file in the disk tier."""
+        for shard in os.scandir(self.cache_dir):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith(".json"):
+                    stat = entry.stat()
+                    yield stat.st_mtime, entry.path, stat.st_size
+
+    def _evict_disk(self):
+        """Remove expired entries, then the oldest ones until the tier is under 90% of its budget."""
+        now = time.time()
+        entries = sorted(self._disk_entries())
+        total = sum(size for _, _, size in entries)
+        target = self.max_disk_bytes * 0.9
+        for mtime, path, size in entries:
+            if total <= target and now - mtime <= self.ttl:
+                continue
+            self._remove(path)
+            total -= size
+        with self._lock:
+            self._disk_bytes = total
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
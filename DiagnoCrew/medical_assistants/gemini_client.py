@@ -0,0 +1,107 @@
+import os
+import threading
+
+import httpx
+from google import genai
+from google.genai import types
+
+# Defaults, overridable with GEMINI_POOL_SIZE, GEMINI_TIMEOUT and GEMINI_CONNECT_TIMEOUT
+DEFAULT_POOL_SIZE = 10
+DEFAULT_TIMEOUT = 120  # seconds for a whole request
+DEFAULT_CONNECT_TIMEOUT = 10  # seconds to open a connection
+DEFAULT_KEEPALIVE_EXPIRY = 60  # seconds an idle connection stays in the pool
+
+
+class GeminiClientManager:
+    """
+    Holds a single Gemini client shared by the whole process.
+
+    The client is created lazily on first use and then reused, so every
+    request goes through the same HTTP connection pool and keep-alive
+    connections instead of paying client setup and a TLS handshake per image.
+    Creation is guarded by a lock, and the underlying httpx clients are
+    thread-safe, so the client can be used from worker threads. `client.aio`
+    shares the async pool between asyncio tasks of the same event loop.
+    """
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(
+        self,
+        api_key=None,
+        pool_size=None,
+        timeout=None,
+        connect_timeout=None,
+        keepalive_expiry=None,
+    ):
+        """
+        Configure the manager. Nothing is created until `get_client` is called.
+
+        Args:
+            api_key (str, optional): Gemini API key, defaults to GEMINI_API_KEY
+            pool_size (int, optional): Maximum number of pooled connections
+            timeout (float, optional): Request timeout in seconds
+            connect_timeout (float, optional): Connection timeout in seconds
+            keepalive_expiry (float, optional): Seconds an idle connection is kept open
+        """
+        self.api_key = api_key
+        self.pool_size = int(
+            pool_size or os.getenv("GEMINI_POOL_SIZE", DEFAULT_POOL_SIZE)
+        )
+        self.timeout = float(timeout or os.getenv("GEMINI_TIMEOUT", DEFAULT_TIMEOUT))
+        self.connect_timeout = float(
+            connect_timeout
+            or os.getenv("GEMINI_CONNECT_TIMEOUT", DEFAULT_CONNECT_TIMEOUT)
+        )
+        self.keepalive_expiry = float(keepalive_expiry or DEFAULT_KEEPALIVE_EXPIRY)
+        self._client = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def shared(cls):
+        """Return the process-wide manager, creating it on first use."""
+        if cls._shared is None:
+            with cls._shared_lock:
+                if cls._shared is None:
+                    cls._shared = cls()
+        return cls._shared
+
+    def get_client(self):
+        """Return the pooled client, creating it on first use."""
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._create_client()
+        return self._client
+
+    def reset(self):
+        """Close the pooled client so the next call creates a fresh one."""
+        with self._lock:
+            client, self._client = self._client, None
+        if client is not None and hasattr(client, "close"):
+            client.close()
+
+    def _create_client(self):
+        """Create a Gemini client backed by a bounded keep-alive connection pool."""
+        limits = httpx.Limits(
+            max_connections=self.pool_size,
+            max_keepalive_connections=self.pool_size,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+        http_timeout = httpx.Timeout(self.timeout, connect=self.connect_timeout)
+        http_options = types.HttpOptions(
+            # The SDK expects the request timeout in milliseconds
+            timeout=int(self.timeout * 1000),
+            client_args={"limits": limits, "timeout": http_timeout},
+            async_client_args={"limits": limits, "timeout": http_timeout},
+        )
+        return genai.Client(
+            api_key=self.api_key or os.getenv("GEMINI_API_KEY"),
+            http_options=http_options,
+        )
+
+
+def get_gemini_client():
+    """Return the process-wide pooled Gemini client."""
+    return GeminiClientManager.shared().get_client()
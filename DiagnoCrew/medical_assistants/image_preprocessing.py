@@ -0,0 +1,178 @@
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+import PIL.Image
+
+DEFAULT_MAX_EDGE = 2048
+DEFAULT_MAX_CACHED = 64
+
+# Per-modality encoding. X-ray, CT and MRI are grayscale acquisitions, so the
+# colour channels of the uploaded PNG only carry the same values three times.
+MODALITY_PROFILES = {
+    "Chest X-ray": {"grayscale": True, "format": "JPEG", "quality": 92},
+    "Bone X-ray": {"grayscale": True, "format": "JPEG", "quality": 92},
+    "Brain MRI": {"grayscale": True, "format": "WEBP", "quality": 90},
+    "Abdominal CT": {"grayscale": True, "format": "WEBP", "quality": 90},
+    "Ultrasound": {"grayscale": False, "format": "JPEG", "quality": 90},
+    "Other": {"grayscale": False, "format": "JPEG", "quality": 90},
+}
+
+MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+EXTENSIONS = {"JPEG": "jpg", "WEBP": "webp", "PNG": "png"}
+
+PreparedImage = namedtuple(
+    "PreparedImage", ["data", "mime_type", "width", "height", "source_bytes"]
+)
+
+
+class ImagePreprocessor:
+    """
+    Shrinks images before they are uploaded to the model.
+
+    Images are downscaled so their longest edge is at most `max_edge`,
+    converted to grayscale for grayscale modalities and re-encoded with the
+    codec and quality of their modality profile. Prepared variants are kept
+    in a small in-memory LRU and, when `cache_dir` is set, on disk.
+    """
+
+    def __init__(
+        self,
+        max_edge=DEFAULT_MAX_EDGE,
+        profiles=None,
+        cache_dir=None,
+        max_cached=DEFAULT_MAX_CACHED,
+    ):
+        """
+        Initialize the preprocessor.
+
+        Args:
+            max_edge (int): Longest edge in pixels of the prepared image
+            profiles (dict, optional): Per image type encoding profiles, defaults to MODALITY_PROFILES
+            cache_dir (str, optional): Directory for prepared variants on disk
+            max_cached (int): Number of prepared variants kept in memory
+        """
+        self.max_edge = max_edge
+        self.profiles = profiles or MODALITY_PROFILES
+        self.cache_dir = cache_dir
+        self.max_cached = max_cached
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def profile(self, image_type):
+        """Return the encoding profile for an image type."""
+        return self.profiles.get(image_type) or self.profiles["Other"]
+
+    def signature(self, image_type):
+        """Describe the preprocessing applied to an image type, for use in cache keys."""
+        profile = self.profile(image_type)
+        mode = "L" if profile["grayscale"] else "RGB"
+        return f"{self.max_edge}:{mode}:{profile['format']}:{profile['quality']}"
+
+    def prepare(self, image_bytes, image_type, digest=None):
+        """
+        Prepare an image for upload.
+
+        Args:
+            image_bytes (bytes): The original encoded image
+            image_type (str): Image type, selecting the encoding profile
+            digest (str, optional): Content digest identifying the image in the
+                cache, defaults to the SHA-256 of `image_bytes`
+
+        Returns:
+            PreparedImage: The encoded payload with its MIME type and dimensions
+        """
+        profile = self.profile(image_type)
+        digest = digest or hashlib.sha256(image_bytes).hexdigest()
+        key = digest + ":" + self.signature(image_type)
+
+        with self._lock:
+            cached = self._memory.get(key)
+            if cached is not None:
+                self._memory.move_to_end(key)
+                return cached
+
+        prepared = self._read_disk(key, profile, image_bytes)
+        if prepared is None:
+            prepared = self._encode(image_bytes, profile)
+            self._write_disk(key, profile, prepared.data)
+
+        with self._lock:
+            self._memory[key] = prepared
+            while len(self._memory) > self.max_cached:
+                self._memory.popitem(last=False)
+        return prepared
+
+    def _encode(self, image_bytes, profile):
+        """Resize, convert and re-encode an image according to a profile."""
+        image = PIL.Image.open(io.BytesIO(image_bytes))
+        image = to_8bit(image)
+
+        if profile["grayscale"]:
+            image = image.convert("L")
+        elif image.mode != "RGB":
+            image = image.convert("RGB")
+
+        if max(image.size) > self.max_edge:
+            image.thumbnail((self.max_edge, self.max_edge), PIL.Image.LANCZOS)
+
+        buf = io.BytesIO()
+        image.save(buf, format=profile["format"], quality=profile["quality"])
+        return PreparedImage(
+            data=buf.getvalue(),
+            mime_type=MIME_TYPES[profile["format"]],
+            width=image.width,
+            height=image.height,
+            source_bytes=len(image_bytes),
+        )
+
+    def _disk_path(self, key, profile):
+        name = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, f"{name}.{EXTENSIONS[profile['format']]}")
+
+    def _read_disk(self, key, profile, image_bytes):
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._disk_path(key, profile), "rb") as f:
+                data = f.read()
+            width, height = PIL.Image.open(io.BytesIO(data)).size
+        except (OSError, PIL.UnidentifiedImageError):
+            return None
+        return PreparedImage(
+            data=data,
+            mime_type=MIME_TYPES[profile["format"]],
+            width=width,
+            height=height,
+            source_bytes=len(image_bytes),
+        )
+
+    def _write_disk(self, key, profile, data):
+        if not self.cache_dir:
+            return
+        path = self._disk_path(key, profile)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            pass
+
+
+def to_8bit(image):
+    """Rescale 16-bit and floating point images to the 8-bit range the encoders expect."""
+    if image.mode not in ("I", "I;16", "I;16B", "I;16L", "F"):
+        return image
+    pixels = np.asarray(image, dtype=np.float32)
+    low, high = float(pixels.min()), float(pixels.max())
+    if high > low:
+        pixels = (pixels - low) * (255.0 / (high - low))
+    else:
+        pixels = np.zeros_like(pixels)
+    return PIL.Image.fromarray(pixels.astype(np.uint8))
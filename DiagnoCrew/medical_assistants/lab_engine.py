@@ -0,0 +1,307 @@
+import re
+
+import numpy as np
+
+# Reference ranges in conventional US units for every LAB_TESTS analyte.
+# Rows: (analyte, unit, sex, min age, max age, low, high, critical low, critical high).
+# sex is "male", "female" or None for both; NaN means no bound. When several
+# rows match a patient the sex-specific one wins.
+NAN = float("nan")
+REFERENCE_RANGES = [
+    ("WBC", "x10^3/uL", None, 18, 200, 4.5, 11.0, 2.0, 30.0),
+    ("WBC", "x10^3/uL", None, 0, 18, 5.0, 14.5, 2.0, 30.0),
+    ("RBC", "x10^6/uL", "male", 18, 200, 4.7, 6.1, NAN, NAN),
+    ("RBC", "x10^6/uL", "female", 18, 200, 4.2, 5.4, NAN, NAN),
+    ("RBC", "x10^6/uL", None, 0, 18, 4.0, 5.5, NAN, NAN),
+    ("Hemoglobin", "g/dL", "male", 18, 200, 13.8, 17.2, 7.0, 20.0),
+    ("Hemoglobin", "g/dL", "female", 18, 200, 12.1, 15.1, 7.0, 20.0),
+    ("Hemoglobin", "g/dL", None, 0, 18, 11.0, 16.0, 7.0, 20.0),
+    ("Hematocrit", "%", "male", 18, 200, 40.7, 50.3, 20.0, 60.0),
+    ("Hematocrit", "%", "female", 18, 200, 36.1, 44.3, 20.0, 60.0),
+    ("Hematocrit", "%", None, 0, 18, 33.0, 45.0, 20.0, 60.0),
+    ("Platelets", "x10^3/uL", None, 0, 200, 150, 450, 50, 1000),
+    ("Sodium", "mmol/L", None, 0, 200, 135, 145, 120, 160),
+    ("Potassium", "mmol/L", None, 0, 200, 3.5, 5.0, 2.5, 6.5),
+    ("Chloride", "mmol/L", None, 0, 200, 98, 106, 80, 120),
+    ("CO2", "mmol/L", None, 0, 200, 23, 29, 10, 40),
+    ("Glucose", "mg/dL", None, 0, 200, 70, 99, 40, 500),
+    ("BUN", "mg/dL", None, 0, 200, 7, 20, NAN, 100),
+    ("Creatinine", "mg/dL", "male", 18, 200, 0.74, 1.35, NAN, 4.0),
+    ("Creatinine", "mg/dL", "female", 18, 200, 0.59, 1.04, NAN, 4.0),
+    ("Creatinine", "mg/dL", None, 0, 18, 0.3, 0.7, NAN, 4.0),
+    ("ALT", "U/L", None, 0, 200, 7, 56, NAN, 1000),
+    ("AST", "U/L", None, 0, 200, 10, 40, NAN, 1000),
+    ("ALP", "U/L", None, 18, 200, 44, 147, NAN, NAN),
+    ("ALP", "U/L", None, 0, 18, 100, 390, NAN, NAN),
+    ("Bilirubin", "mg/dL", None, 0, 200, 0.1, 1.2, NAN, 15.0),
+    ("Albumin", "g/dL", None, 0, 200, 3.4, 5.4, 1.5, NAN),
+    ("Total Cholesterol", "mg/dL", None, 0, 200, NAN, 200, NAN, NAN),
+    ("HDL", "mg/dL", "male", 0, 200, 40, NAN, NAN, NAN),
+    ("HDL", "mg/dL", "female", 0, 200, 50, NAN, NAN, NAN),
+    ("LDL", "mg/dL", None, 0, 200, NAN, 100, NAN, NAN),
+    ("Triglycerides", "mg/dL", None, 0, 200, NAN, 150, NAN, 1000),
+]
+
+# Factors converting other common units to the reference unit, by analyte.
+# Units are matched after `normalize_unit`; a unit that is neither listed
+# nor the reference unit leaves the value unverifiable.
+COUNT_UNITS = {"10^3/ul": 1, "k/ul": 1, "x10^9/l": 1, "10^9/l": 1, "/ul": 0.001, "cells/ul": 0.001}
+ELECTROLYTE_UNITS = {"meq/l": 1}
+ENZYME_UNITS = {"iu/l": 1, "u/l": 1}
+UNIT_CONVERSIONS = {
+    "WBC": COUNT_UNITS,
+    "Platelets": COUNT_UNITS,
+    "RBC": {"10^6/ul": 1, "m/ul": 1, "x10^12/l": 1, "10^12/l": 1},
+    "Sodium": ELECTROLYTE_UNITS,
+    "Potassium": ELECTROLYTE_UNITS,
+    "Chloride": ELECTROLYTE_UNITS,
+    "CO2": ELECTROLYTE_UNITS,
+    "Glucose": {"mmol/l": 18.016},
+    "Total Cholesterol": {"mmol/l": 38.67},
+    "HDL": {"mmol/l": 38.67},
+    "LDL": {"mmol/l": 38.67},
+    "Triglycerides": {"mmol/l": 88.57},
+    "Creatinine": {"umol/l": 1 / 88.4},
+    "BUN": {"mmol/l": 2.801},
+    "Hemoglobin": {"g/l": 0.1},
+    "Hematocrit": {"l/l": 100},
+    "Albumin": {"g/l": 0.1},
+    "Bilirubin": {"umol/l": 1 / 17.1},
+    "ALT": ENZYME_UNITS,
+    "AST": ENZYME_UNITS,
+    "ALP": ENZYME_UNITS,
+}
+
+# Values a patient can have at all, in the reference unit. A value typed
+# without a unit is only read in the reference unit when it falls in here;
+# e.g. WBC "7500" is a count per uL, not 7500 x10^3/uL.
+PLAUSIBLE_RANGES = {
+    "WBC": (0.1, 500),
+    "RBC": (0.5, 10),
+    "Hemoglobin": (2, 25),
+    "Hematocrit": (5, 80),
+    "Platelets": (1, 3000),
+    "Sodium": (90, 200),
+    "Potassium": (1, 12),
+    "Chloride": (50, 160),
+    "CO2": (2, 60),
+    "Glucose": (10, 2000),
+    "BUN": (1, 300),
+    "Creatinine": (0.1, 30),
+    "ALT": (1, 20000),
+    "AST": (1, 20000),
+    "ALP": (5, 5000),
+    "Bilirubin": (0.05, 60),
+    "Albumin": (0.5, 8),
+    "Total Cholesterol": (30, 1500),
+    "HDL": (5, 200),
+    "LDL": (5, 1000),
+    "Triglycerides": (10, 10000),
+}
+
+VALUE_PATTERN = re.compile(r"^\s*([<>]=?)?\s*(-?\d+(?:[.,]\d+)?)\s*(.*?)\s*$")
+
+
+def parse_value(text):
+    """
+    Split a free-text lab value into number and unit.
+
+    Args:
+        text (str): The value as typed, e.g. "11.2", "5.4 mmol/L" or "<0.1"
+
+    Returns:
+        tuple: (value, unit); value is NaN when the text holds no number
+    """
+    match = VALUE_PATTERN.match(str(text))
+    if not match:
+        return NAN, ""
+    return float(match.group(2).replace(",", ".")), match.group(3)
+
+
+def normalize_unit(unit):
+    """Bring a unit into the form used by UNIT_CONVERSIONS, e.g. "x10^3/µL" -> "10^3/ul"."""
+    unit = unit.lower().replace(" ", "").replace("µ", "u").replace("μ", "u")
+    if unit.startswith("x10^") and unit[1:] in ("10^3/ul", "10^6/ul"):
+        unit = unit[1:]
+    return unit
+
+
+def to_reference_unit(test, value, unit, reference_unit):
+    """
+    Convert a parsed value into the reference unit of its analyte.
+
+    Units are never guessed: a value without a unit is only taken to be in
+    the reference unit when it is plausible there, and an unknown unit
+    makes the value unverifiable.
+
+    Returns:
+        tuple: (value, unit) in the reference unit, or (NaN, "") when the
+            value cannot be verified; the raw text keeps what was typed
+    """
+    if np.isnan(value):
+        return NAN, ""
+    if not unit:
+        factor = 1.0
+    elif normalize_unit(unit) == normalize_unit(reference_unit):
+        factor = 1.0
+    else:
+        factor = UNIT_CONVERSIONS.get(test, {}).get(normalize_unit(unit))
+        if factor is None:
+            return NAN, ""
+    converted = value * factor
+    low, high = PLAUSIBLE_RANGES.get(test, (-np.inf, np.inf))
+    if not low <= converted <= high:
+        return NAN, ""
+    return converted, reference_unit
+
+
+class LabTable:
+    """
+    Lab results of one patient as parallel NumPy arrays.
+
+    Each row is one analyte with its parsed value in the reference unit and
+    the reference and critical bounds for the patient's age and sex, so all
+    results are flagged in a single vectorized comparison. Values in an
+    unknown unit, or without a unit and implausible in the reference unit,
+    are kept as NaN and flagged "?".
+    """
+
+    def __init__(self, lab_results, age=None, gender=None):
+        """
+        Parse the lab results and look up their reference ranges.
+
+        Args:
+            lab_results (dict): Raw values by panel and test, as entered on the lab tab
+            age (int, optional): Patient age in years, adults are assumed when missing
+            gender (str, optional): Patient sex; ranges for both sexes are used when missing
+        """
+        rows = [
+            (panel, test, str(raw).strip())
+            for panel, tests in (lab_results or {}).items()
+            if isinstance(tests, dict)
+            for test, raw in tests.items()
+            if str(raw).strip()
+        ]
+        self.panels = np.array([row[0] for row in rows], dtype=object)
+        self.tests = np.array([row[1] for row in rows], dtype=object)
+        self.raw = np.array([row[2] for row in rows], dtype=object)
+
+        ranges = reference_ranges(age, gender)
+        count = len(rows)
+        self.values = np.full(count, np.nan)
+        self.units = np.empty(count, dtype=object)
+        bounds = np.full((count, 4), np.nan)
+        for i, (_, test, raw) in enumerate(rows):
+            value, unit = parse_value(raw)
+            reference = ranges.get(test)
+            if reference is not None:
+                value, unit = to_reference_unit(test, value, unit, reference[0])
+                bounds[i] = reference[1:]
+            self.values[i] = value
+            self.units[i] = unit
+        self.low, self.high, self.critical_low, self.critical_high = bounds.T
+
+    def __len__(self):
+        return len(self.values)
+
+    def flags(self):
+        """
+        Flag every result against its range.
+
+        Returns:
+            np.ndarray: "LL"/"HH" for critical, "L"/"H" for out of range, "" for normal
+                and "?" for values that could not be parsed or verified
+        """
+        values = self.values
+        with np.errstate(invalid="ignore"):
+            flags = np.select(
+                [
+                    np.isnan(values),
+                    values < self.critical_low,
+                    values > self.critical_high,
+                    values < self.low,
+                    values > self.high,
+                ],
+                ["?", "LL", "HH", "L", "H"],
+                default="",
+            )
+        return flags
+
+    def records(self):
+        """Return one dictionary per result, for display."""
+        flags = self.flags()
+        return [
+            {
+                "panel": self.panels[i],
+                "test": self.tests[i],
+                "value": self.raw[i] if np.isnan(self.values[i]) else round(float(self.values[i]), 2),
+                "unit": self.units[i],
+                "reference": format_range(self.low[i], self.high[i]),
+                "flag": str(flags[i]),
+            }
+            for i in range(len(self))
+        ]
+
+    def abnormal(self):
+        """Return the records of results outside their reference range or critical."""
+        return [record for record in self.records() if record["flag"] not in ("", "?")]
+
+    def to_prompt(self, panel_names=None):
+        """
+        Write the table as one dense line per panel, e.g. "CBC: WBC 13.1 x10^3/uL H (4.5-11)".
+
+        Args:
+            panel_names (dict, optional): Short names to use for the panels
+        """
+        lines = {}
+        for record in self.records():
+            value = record["value"]
+            entry = f"{record['test']} {value if isinstance(value, str) else format(value, 'g')}"
+            if record["unit"]:
+                entry += f" {record['unit']}"
+            if record["flag"]:
+                entry += f" {record['flag']}"
+            if record["reference"]:
+                entry += f" ({record['reference']})"
+            panel = (panel_names or {}).get(record["panel"], record["panel"])
+            lines.setdefault(panel, []).append(entry)
+        return "\n".join(f"{panel}: {'; '.join(entries)}" for panel, entries in lines.items())
+
+
+def reference_ranges(age=None, gender=None):
+    """
+    Pick the reference range of every analyte for a patient.
+
+    Returns:
+        dict: (unit, low, high, critical low, critical high) by analyte
+    """
+    try:
+        age = float(age)
+    except (TypeError, ValueError):
+        age = 40.0
+    sex = str(gender or "").strip().lower()
+    ranges = {}
+    specific = set()
+    for analyte, unit, row_sex, min_age, max_age, *bounds in REFERENCE_RANGES:
+        if not min_age <= age < max_age:
+            continue
+        if row_sex is None and analyte not in specific:
+            ranges.setdefault(analyte, (unit, *bounds))
+        elif row_sex == sex:
+            ranges[analyte] = (unit, *bounds)
+            specific.add(analyte)
+        elif sex not in ("male", "female") and analyte not in ranges:
+            # Sex unknown: use the first sex-specific range for the analyte
+            ranges[analyte] = (unit, *bounds)
+    return ranges
+
+
+def format_range(low, high):
+    """Format a reference range, with "<" or ">" for one-sided ones."""
+    if np.isnan(low) and np.isnan(high):
+        return ""
+    if np.isnan(low):
+        return f"<{high:g}"
+    if np.isnan(high):
+        return f">{low:g}"
+    return f"{low:g}-{high:g}"
@@ -0,0 +1,206 @@
+import io
+import itertools
+import os
+import sqlite3
+import threading
+
+import numpy as np
+import PIL.Image
+
+# Largest Hamming distance between two 64-bit hashes that still counts as a duplicate,
+# overridable with DUPLICATE_THRESHOLD
+DEFAULT_THRESHOLD = 6
+INDEX_FILENAME = "phash_index.sqlite3"
+# The 64-bit hash is indexed as four 16-bit bands
+BANDS = 4
+BAND_BITS = 16
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS hashes (
+    hash TEXT NOT NULL,
+    case_id TEXT,
+    full_path TEXT NOT NULL,
+    band0 INTEGER NOT NULL,
+    band1 INTEGER NOT NULL,
+    band2 INTEGER NOT NULL,
+    band3 INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS hashes_band0 ON hashes (band0);
+CREATE INDEX IF NOT EXISTS hashes_band1 ON hashes (band1);
+CREATE INDEX IF NOT EXISTS hashes_band2 ON hashes (band2);
+CREATE INDEX IF NOT EXISTS hashes_band3 ON hashes (band3);
+"""
+
+
+def perceptual_hash(image_bytes):
+    """
+    Compute the 64-bit difference hash of an encoded image.
+
+    The image is reduced to a 9x8 grayscale thumbnail and each bit records
+    whether a pixel is brighter than its right neighbour, so re-encoding,
+    resizing and small intensity changes leave the hash (nearly) unchanged.
+
+    Args:
+        image_bytes (bytes): The encoded image
+
+    Returns:
+        str: The hash as 16 hex digits
+    """
+    image = PIL.Image.open(io.BytesIO(image_bytes)).convert("L")
+    pixels = np.asarray(image.resize((9, 8), PIL.Image.LANCZOS), dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    return f"{value:016x}"
+
+
+def hash_distance(first, second):
+    """Return the number of differing bits between two hashes."""
+    return bin(int(first, 16) ^ int(second, 16)).count("1")
+
+
+def find_duplicate(phash, candidates, threshold=DEFAULT_THRESHOLD):
+    """
+    Return the position of the closest candidate hash within the threshold.
+
+    Args:
+        phash (str): Hash to look up
+        candidates (list): Hashes to compare against, None entries are skipped
+        threshold (int): Largest distance that counts as a duplicate
+
+    Returns:
+        int: Position of the closest match, or None when nothing is close enough
+    """
+    best, best_distance = None, threshold + 1
+    for position, candidate in enumerate(candidates):
+        if candidate is None:
+            continue
+        distance = hash_distance(phash, candidate)
+        if distance < best_distance:
+            best, best_distance = position, distance
+    return best
+
+
+def hash_bands(phash):
+    """Split a hash into its BANDS integer bands, most significant first."""
+    value = int(phash, 16)
+    mask = (1 << BAND_BITS) - 1
+    return [(value >> (BAND_BITS * (BANDS - 1 - band))) & mask for band in range(BANDS)]
+
+
+def band_neighbours(value, radius):
+    """Return every band value within `radius` differing bits of a band."""
+    neighbours = [value]
+    for flipped in range(1, radius + 1):
+        for bits in itertools.combinations(range(BAND_BITS), flipped):
+            neighbours.append(value ^ sum(1 << bit for bit in bits))
+    return neighbours
+
+
+class PerceptualHashIndex:
+    """
+    Perceptual hashes of every image stored so far, across cases.
+
+    Each entry records the case and file of an image, so a new upload that
+    looks like an earlier one can be pointed out to the user. A match is
+    only a hint: images a few bits apart can differ in what matters, so
+    the index never decides which file is stored or analyzed.
+
+    The entries are rows of a SQLite database next to the other caches, so
+    adding an image is one insert. Lookups use multi-index hashing: when two
+    hashes are within the threshold, one of their BANDS bands differs in at
+    most threshold // BANDS bits, so only rows sharing a band with one of
+    those few neighbouring values are compared.
+    """
+
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, index_dir, threshold=None):
+        """
+        Open or create the index.
+
+        Args:
+            index_dir (str): Directory holding the index file
+            threshold (int, optional): Largest Hamming distance that counts as a duplicate
+        """
+        self.path = os.path.join(index_dir, INDEX_FILENAME)
+        self.threshold = int(
+            threshold
+            if threshold is not None
+            else os.getenv("DUPLICATE_THRESHOLD", DEFAULT_THRESHOLD)
+        )
+        self._local = threading.local()
+        os.makedirs(index_dir, exist_ok=True)
+        with self._connection() as connection:
+            connection.executescript(SCHEMA)
+
+    @classmethod
+    def for_directory(cls, index_dir, **kwargs):
+        """Return the process-wide index for a directory."""
+        key = os.path.abspath(index_dir)
+        with cls._instances_lock:
+            if key not in cls._instances:
+                cls._instances[key] = cls(index_dir, **kwargs)
+            return cls._instances[key]
+
+    def _connection(self):
+        """Return this thread's connection; SQLite connections are not shared between threads."""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def find(self, phash, exclude_case=None):
+        """
+        Find an earlier image close to a hash whose file still exists.
+
+        Args:
+            phash (str): Hash to look up
+            exclude_case (str, optional): Ignore the images of this case
+
+        Returns:
+            dict: The stored entry with "hash", "case_id" and "full_path", or None
+        """
+        radius = self.threshold // BANDS
+        candidates = {}
+        for band, value in enumerate(hash_bands(phash)):
+            neighbours = band_neighbours(value, radius)
+            rows = self._connection().execute(
+                f"""
+                SELECT rowid, hash, case_id, full_path FROM hashes
+                WHERE band{band} IN ({', '.join('?' * len(neighbours))})
+                """,
+                neighbours,
+            )
+            for row in rows:
+                candidates[row["rowid"]] = row
+
+        matches = sorted(
+            (hash_distance(phash, row["hash"]), row["rowid"], row)
+            for row in candidates.values()
+            if row["case_id"] != exclude_case
+        )
+        for distance, _, row in matches:
+            if distance > self.threshold:
+                break
+            # Only the closest matches are checked against the file system
+            if os.path.exists(row["full_path"]):
+                return {key: row[key] for key in ("hash", "case_id", "full_path")}
+        return None
+
+    def add(self, phash, case_id, full_path):
+        """Record where an image with a given hash was stored."""
+        with self._connection() as connection:
+            connection.execute(
+                """
+                INSERT INTO hashes (hash, case_id, full_path, band0, band1, band2, band3)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                [phash, case_id, full_path, *hash_bands(phash)],
+            )
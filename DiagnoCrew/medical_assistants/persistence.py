@@ -0,0 +1,179 @@
+import atexit
+import os
+import queue
+import tempfile
+import threading
+from concurrent.futures import Future
+
+DEFAULT_MAX_PENDING = 256
+
+
+def atomic_write(path, data, fsync=False):
+    """
+    Write a file so readers see either the old or the complete new content.
+
+    The data goes to a temporary file in the same directory, which is then
+    renamed over the target.
+
+    Args:
+        path (str): Target file
+        data (bytes | str): Content; text is written as UTF-8
+        fsync (bool): Flush the file and the directory entry to disk before returning
+    """
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, temporary = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(temporary, path)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+    if fsync:
+        directory_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(directory_fd)
+        finally:
+            os.close(directory_fd)
+
+
+class WriteBehindWriter:
+    """
+    Background writer for case artifacts.
+
+    Writes and other persistence tasks are queued and run in order on one
+    thread, so the request path does not wait for the disk and tasks that
+    depend on each other (a case row before its diagnosis) stay ordered.
+    Files are committed with `atomic_write`. Until a file is written its
+    bytes are served from memory by `read`, so image analysis can start
+    right away. Queued work is flushed when the process exits.
+
+    A failed task sets the exception on the future `submit` returned and is
+    passed to `on_error`, so callers that need a write to have happened can
+    check its future.
+    """
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, fsync=False, max_pending=DEFAULT_MAX_PENDING, on_error=None):
+        """
+        Start the writer thread.
+
+        Args:
+            fsync (bool): fsync every file written, for volumes where a crash
+                must not lose acknowledged writes
+            max_pending (int): Queued tasks after which submitting blocks
+            on_error (callable, optional): Called on the writer thread with the
+                exception and the task function whenever a task fails
+        """
+        self.fsync = fsync
+        self.on_error = on_error
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    @classmethod
+    def shared(cls):
+        """Return the process-wide writer; PERSIST_FSYNC=1 turns on fsync."""
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls(fsync=os.getenv("PERSIST_FSYNC", "0") == "1")
+            return cls._shared
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Queue a task.
+
+        After `close`, tasks run synchronously so nothing is lost.
+
+        Returns:
+            Future: Resolves to the task's return value
+        """
+        future = Future()
+        if self._closed:
+            self._execute(future, fn, args, kwargs)
+        else:
+            self._queue.put((future, fn, args, kwargs))
+        return future
+
+    def write(self, path, data, transform=None):
+        """
+        Queue an atomic file write; `read` returns the data until it is on disk.
+
+        Args:
+            path (str): Target file
+            data (bytes): Content
+            transform (callable, optional): Applied to the data on the writer
+                thread before it is written, for work like recompression that
+                should not hold up the caller
+
+        Returns:
+            Future: Resolves when the file is written
+        """
+        with self._lock:
+            self._pending[path] = data
+        return self.submit(self._write_file, path, data, transform)
+
+    def read(self, path):
+        """Return the content of a file, from memory while its write is still queued."""
+        with self._lock:
+            data = self._pending.get(path)
+        if data is not None:
+            return data
+        with open(path, "rb") as f:
+            return f.read()
+
+    def flush(self, timeout=None):
+        """Wait until every task queued so far has run."""
+        if not self._closed:
+            self.submit(lambda: None).result(timeout)
+
+    def close(self):
+        """Flush the queue and stop the writer thread."""
+        if self._closed:
+            return
+        self.flush()
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+
+    def _write_file(self, path, data, transform=None):
+        atomic_write(path, transform(data) if transform else data, fsync=self.fsync)
+        with self._lock:
+            if self._pending.get(path) is data:
+                del self._pending[path]
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                self._execute(*item)
+            finally:
+                self._queue.task_done()
+
+    def _execute(self, future, fn, args, kwargs):
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+            if self.on_error is not None:
+                try:
+                    self.on_error(e, fn)
+                except Exception:
+                    pass
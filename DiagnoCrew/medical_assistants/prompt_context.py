@@ -0,0 +1,230 @@
+import itertools
+import threading
+import time
+
+from google.genai import types
+
+from medical_assistants.gemini_client import GeminiClientManager
+from medical_assistants.prompt_serializer import count_tokens
+
+DEFAULT_TTL = 60 * 60  # seconds a cached context lives on the server
+DEFAULT_REFRESH_MARGIN = 5 * 60  # refresh a context this many seconds before it expires
+DEFAULT_RETRY_AFTER = 15 * 60  # seconds before retrying a context the server refused to cache
+
+# Smallest instruction, in tokens, the server caches explicitly, by model prefix
+MIN_CACHE_TOKENS = [
+    ("gemini-2.5-flash", 1024),
+    ("gemini-2.5-pro", 4096),
+    ("gemini-2.0", 4096),
+    ("gemini-1.5", 32768),
+]
+DEFAULT_MIN_CACHE_TOKENS = 4096
+
+
+def min_cache_tokens(model):
+    """Return the smallest instruction, in tokens, a model caches explicitly."""
+    for prefix, tokens in MIN_CACHE_TOKENS:
+        if model.startswith(prefix):
+            return tokens
+    return DEFAULT_MIN_CACHE_TOKENS
+
+
+class PromptContextManager:
+    """
+    Keeps the static part of the image prompts in server-side cached contexts.
+
+    There is one context per model and prompt key (an image type, or "batch"
+    for batched requests). It is created on first use, its TTL is extended
+    shortly before it expires, and requests only reference it by name, so
+    they carry just the variable text and the image.
+
+    Instructions shorter than the model's minimum for explicit caching are
+    sent as plain system instructions without asking the server. When the
+    server refuses an instruction anyway, it is sent the same way and caching
+    is retried after `retry_after` seconds. Server calls run outside the
+    lock and only one runs per context at a time; concurrent requests use
+    the current context or the plain instruction meanwhile, so a slow cache
+    request never holds up image requests.
+    """
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(
+        self,
+        client_manager=None,
+        caches=None,
+        ttl=DEFAULT_TTL,
+        refresh_margin=DEFAULT_REFRESH_MARGIN,
+        retry_after=DEFAULT_RETRY_AFTER,
+        min_tokens=None,
+    ):
+        """
+        Configure the manager. No context is created until `config` is called.
+
+        Args:
+            client_manager (GeminiClientManager, optional): Source of the Gemini client,
+                defaults to the process-wide pooled client
+            caches (object, optional): Cached-content API, defaults to `client.caches`;
+                pass an OfflineCaches to run without the network
+            ttl (float): Seconds a cached context lives
+            refresh_margin (float): Seconds before expiry at which a context is refreshed
+            retry_after (float): Seconds before retrying an instruction that could not be cached
+            min_tokens (int, optional): Smallest instruction to cache, defaults to the
+                model's minimum from MIN_CACHE_TOKENS; pass 0 with OfflineCaches
+        """
+        self.client_manager = client_manager or GeminiClientManager.shared()
+        self._caches = caches
+        self.ttl = ttl
+        self.refresh_margin = refresh_margin
+        self.retry_after = retry_after
+        self.min_tokens = min_tokens
+        self._entries = {}
+        self._in_flight = set()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def shared(cls):
+        """Return the process-wide manager, creating it on first use."""
+        if cls._shared is None:
+            with cls._shared_lock:
+                if cls._shared is None:
+                    cls._shared = cls()
+        return cls._shared
+
+    @property
+    def caches(self):
+        if self._caches is None:
+            self._caches = self.client_manager.get_client().caches
+        return self._caches
+
+    def config(self, model, key, instruction):
+        """
+        Return the request config carrying a static instruction.
+
+        Args:
+            model (str): Gemini model the request goes to
+            key (str): Name of the prompt, e.g. the image type
+            instruction (str): Static instruction text for this key
+
+        Returns:
+            types.GenerateContentConfig: References the cached context, or carries
+                the instruction as system instruction when it could not be cached
+        """
+        name = self._context_name((model, key), instruction)
+        if name is None:
+            return types.GenerateContentConfig(system_instruction=instruction)
+        return types.GenerateContentConfig(cached_content=name)
+
+    def clear(self):
+        """Delete every context created by this manager."""
+        with self._lock:
+            entries, self._entries = self._entries, {}
+        for entry in entries.values():
+            if entry["name"] is not None:
+                try:
+                    self.caches.delete(name=entry["name"])
+                except Exception:
+                    pass
+
+    def _context_name(self, entry_key, instruction):
+        """Return the name of a usable context, creating or refreshing it as needed."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(entry_key)
+            if entry is not None and entry["instruction"] != instruction:
+                entry = None
+            if entry is not None:
+                if entry["name"] is None and now < entry["expires"]:
+                    return None
+                if entry["name"] is not None and entry["expires"] - now > self.refresh_margin:
+                    return entry["name"]
+            if entry_key in self._in_flight:
+                # Another request is talking to the server for this context
+                valid = entry is not None and entry["name"] is not None and now < entry["expires"]
+                return entry["name"] if valid else None
+            self._in_flight.add(entry_key)
+
+        try:
+            entry = self._refresh_or_create(entry_key, entry, instruction, now)
+            with self._lock:
+                self._entries[entry_key] = entry
+            return entry["name"]
+        finally:
+            with self._lock:
+                self._in_flight.discard(entry_key)
+
+    def _refresh_or_create(self, entry_key, entry, instruction, now):
+        """Extend a context's TTL or create a new one; runs without the lock."""
+        model, key = entry_key
+        if entry is None:
+            min_tokens = min_cache_tokens(model) if self.min_tokens is None else self.min_tokens
+            if count_tokens(instruction) < min_tokens:
+                # Below the server's minimum: never worth a request
+                return {"name": None, "expires": float("inf"), "instruction": instruction}
+
+        if entry is not None and entry["name"] is not None:
+            try:
+                self.caches.update(
+                    name=entry["name"],
+                    config=types.UpdateCachedContentConfig(ttl=f"{int(self.ttl)}s"),
+                )
+                return {**entry, "expires": now + self.ttl}
+            except Exception:
+                # Expired or deleted on the server; create a new one below
+                pass
+
+        try:
+            context = self.caches.create(
+                model=model,
+                config=types.CreateCachedContentConfig(
+                    display_name=f"image-analysis-{key}",
+                    system_instruction=instruction,
+                    ttl=f"{int(self.ttl)}s",
+                ),
+            )
+            entry = {"name": context.name, "expires": now + self.ttl}
+        except Exception:
+            entry = {"name": None, "expires": now + self.retry_after}
+        entry["instruction"] = instruction
+        return entry
+
+
+class OfflineCaches:
+    """
+    In-memory stand-in for the Gemini cached-content API.
+
+    Records every create, update and delete so tests and benchmarks can use
+    PromptContextManager without network access. Instructions shorter than
+    `min_characters` are refused, like the server refuses contexts below the
+    model's minimum token count.
+    """
+
+    def __init__(self, min_characters=0):
+        self.min_characters = min_characters
+        self.contexts = {}
+        self.calls = []
+        self._ids = itertools.count(1)
+
+    def create(self, model, config):
+        self.calls.append(("create", model))
+        if len(config.system_instruction or "") < self.min_characters:
+            raise ValueError("Cached content is too small")
+        name = f"cachedContents/offline-{next(self._ids)}"
+        self.contexts[name] = {
+            "model": model,
+            "system_instruction": config.system_instruction,
+            "ttl": config.ttl,
+        }
+        return types.CachedContent(name=name, model=model)
+
+    def update(self, name, config):
+        self.calls.append(("update", name))
+        if name not in self.contexts:
+            raise KeyError(name)
+        self.contexts[name]["ttl"] = config.ttl
+        return types.CachedContent(name=name, model=self.contexts[name]["model"])
+
+    def delete(self, name):
+        self.calls.append(("delete", name))
+        self.contexts.pop(name, None)
@@ -0,0 +1,186 @@
+import json
+import re
+
+import yaml
+
+from medical_assistants.lab_engine import LabTable
+
+# Fields that identify the patient or point at files, with no diagnostic value
+IDENTIFIER_FIELDS = {
+    "id",
+    "patient_id",
+    "case_id",
+    "first_name",
+    "last_name",
+    "name",
+    "dob",
+    "email",
+    "phone",
+    "address",
+    "timestamp",
+    "filename",
+    "path",
+    "full_path",
+    "source_path",
+    "phash",
+    "similar_to",
+    "similar_to_case",
+    "digest",
+    "source_digest",
+    "source_digests",
+    "mime_type",
+    "series_uid",
+    "cache_hit",
+}
+
+# Short names for the LAB_TESTS panels
+PANEL_ABBREVIATIONS = {
+    "Complete Blood Count": "CBC",
+    "Basic Metabolic Panel": "BMP",
+    "Liver Function Tests": "LFT",
+    "Lipid Panel": "Lipids",
+}
+
+PLACEHOLDER_PATTERN = re.compile(r"\{(\w+)\}")
+
+
+def compact(value):
+    """
+    Drop empty values and identifier fields, recursively.
+
+    Returns:
+        The compacted value, or None when nothing is left
+    """
+    if isinstance(value, dict):
+        result = {}
+        for key, item in value.items():
+            if key in IDENTIFIER_FIELDS:
+                continue
+            item = compact(item)
+            if item is not None:
+                result[key] = item
+        return result or None
+    if isinstance(value, (list, tuple)):
+        items = [item for item in (compact(v) for v in value) if item is not None]
+        return items or None
+    if isinstance(value, str):
+        return value.strip() or None
+    return value
+
+
+def dumps(value):
+    """Serialize a compacted value as JSON without optional whitespace."""
+    value = compact(value)
+    if value is None:
+        return "none"
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False)
+
+
+def lab_table(lab_results, patient_data=None):
+    """
+    Write lab results as one dense line per panel, e.g. "CBC: WBC 13.1 x10^3/uL H (4.5-11)".
+
+    Values are parsed and flagged against the reference ranges for the
+    patient's age and sex, so the crew reads flags instead of raw strings.
+    Panels and tests without a value are left out.
+    """
+    if isinstance(lab_results, str):
+        return lab_results
+    patient_data = patient_data or {}
+    table = LabTable(lab_results, patient_data.get("age"), patient_data.get("gender"))
+    return table.to_prompt(PANEL_ABBREVIATIONS) or "none"
+
+
+def serialize_inputs(patient_data, symptoms, lab_results, image_results=None):
+    """
+    Build compact crew inputs.
+
+    Args:
+        patient_data (dict): Patient demographics and history
+        symptoms (dict): Chief complaint, symptom list and onset
+        lab_results (dict): Lab values by panel
+        image_results (list, optional): Image findings; left out when None
+
+    Returns:
+        dict: Crew inputs as strings
+    """
+    inputs = {
+        "patient_data": dumps(patient_data),
+        "symptoms": dumps(symptoms),
+        "lab_results": lab_table(lab_results, patient_data),
+    }
+    if image_results is not None:
+        inputs["image_results"] = dumps(image_results)
+    return inputs
+
+
+def count_tokens(text):
+    """Count the tokens of a text with tiktoken when it is installed, else estimate four characters per token."""
+    try:
+        import tiktoken
+    except ImportError:
+        return max(1, round(len(text) / 4)) if text else 0
+    return len(tiktoken.get_encoding("cl100k_base").encode(text))
+
+
+def placeholder_counts(config_paths, tasks):
+    """
+    Count how often each {input} placeholder is interpolated into the prompts of a crew.
+
+    Every task prompt carries the task's description and expected output and
+    its agent's role, goal and backstory, so the agent's placeholders count
+    once per task it runs.
+
+    Args:
+        config_paths (list): The agents.yaml and tasks.yaml files, in that order
+        tasks (iterable): Names of the tasks the crew runs
+
+    Returns:
+        dict: Occurrences by input name
+    """
+    agents_path, tasks_path = config_paths
+    with open(agents_path, "r") as f:
+        agents = yaml.safe_load(f) or {}
+    with open(tasks_path, "r") as f:
+        task_configs = yaml.safe_load(f) or {}
+
+    counts = {}
+    for name in tasks:
+        task = task_configs[name]
+        for text in (task, agents.get(task.get("agent"), {})):
+            for placeholder in PLACEHOLDER_PATTERN.findall(json.dumps(text)):
+                counts[placeholder] = counts.get(placeholder, 0) + 1
+    return counts
+
+
+def merge_counts(*counts):
+    """Add up placeholder counts, e.g. of every crew run for one case."""
+    total = {}
+    for count in counts:
+        for name, times in count.items():
+            total[name] = total.get(name, 0) + times
+    return total
+
+
+def token_report(raw_inputs, compact_inputs, occurrences):
+    """
+    Compare the prompt tokens of the raw and the compact inputs.
+
+    Args:
+        raw_inputs (dict): Inputs as `json.dumps` of the full data
+        compact_inputs (dict): Inputs from `serialize_inputs`
+        occurrences (dict): How often each input is interpolated into the prompts
+
+    Returns:
+        dict: Tokens per input before and after, and the totals weighted by occurrences
+    """
+    report = {"inputs": {}, "before": 0, "after": 0}
+    for key, raw in raw_inputs.items():
+        before = count_tokens(raw)
+        after = count_tokens(compact_inputs.get(key, ""))
+        times = occurrences.get(key, 1)
+        report["inputs"][key] = {"before": before, "after": after, "occurrences": times}
+        report["before"] += before * times
+        report["after"] += after * times
+    report["saved"] = report["before"] - report["after"]
+    return report
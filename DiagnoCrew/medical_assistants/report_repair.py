@@ -0,0 +1,98 @@
+import json
+import re
+
+# Typographic characters models sometimes put into JSON
+SMART_QUOTES = str.maketrans({"“": '"', "”": '"', "‘": "'", "’": "'"})
+TRAILING_COMMA_PATTERN = re.compile(r",\s*([}\]])")
+PYTHON_LITERAL_PATTERN = re.compile(r'("(?:[^"\\]|\\.)*")|\b(True|False|None)\b')
+PYTHON_LITERALS = {"True": "true", "False": "false", "None": "null"}
+
+
+def candidate_objects(text):
+    """
+    Yield the JSON object texts that may hold the report, most likely first.
+
+    Fenced ```json blocks come first, then every balanced top-level {...}
+    span of the text, outermost and longest first.
+    """
+    for match in re.finditer(r"```(?:json)?\s*(.*?)```", text, re.DOTALL):
+        yield match.group(1).strip()
+
+    spans = []
+    depth, start, in_string, escaped = 0, None, False, False
+    for position, char in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == "{":
+            if depth == 0:
+                start = position
+            depth += 1
+        elif char == "}" and depth:
+            depth -= 1
+            if depth == 0:
+                spans.append(text[start : position + 1])
+    if depth and start is not None:
+        # Truncated output: close the open braces and brackets
+        spans.append(close_brackets(text[start:]))
+    yield from sorted(spans, key=len, reverse=True)
+
+
+def close_brackets(fragment):
+    """Append the closing brackets a truncated JSON fragment is missing."""
+    stack, in_string, escaped = [], False, False
+    for char in fragment:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+        elif char in "}]" and stack:
+            stack.pop()
+    fragment = fragment.rstrip().rstrip(",")
+    if in_string:
+        fragment += '"'
+    return fragment + "".join(reversed(stack))
+
+
+def repair(candidate):
+    """Fix the JSON mistakes models commonly make: smart quotes, trailing commas and Python literals."""
+    candidate = candidate.translate(SMART_QUOTES)
+    candidate = TRAILING_COMMA_PATTERN.sub(r"\1", candidate)
+    return PYTHON_LITERAL_PATTERN.sub(
+        lambda m: m.group(1) or PYTHON_LITERALS[m.group(2)], candidate
+    )
+
+
+def extract_report(output):
+    """
+    Recover the diagnostic report from crew output without calling a model.
+
+    Args:
+        output (str): The raw crew output
+
+    Returns:
+        dict: The first candidate object that parses, as is or after repair,
+            and has a "primary_diagnosis"; None when there is none
+    """
+    for candidate in candidate_objects(output or ""):
+        for text in (candidate, repair(candidate)):
+            try:
+                report = json.loads(text)
+            except ValueError:
+                continue
+            if isinstance(report, dict) and "primary_diagnosis" in report:
+                return report
+    return None
@@ -0,0 +1,269 @@
+import io
+import math
+
+import numpy as np
+import PIL.Image
+
+from medical_assistants.dicom_ingestion import DicomImage
+
+SAMPLING_STRATEGIES = ("uniform", "variance", "distinct")
+DEFAULT_SLICE_COUNT = 8
+DEFAULT_TILE_SIZE = 512
+# Side of the thumbnails the variance and distinctness scores are computed on
+SCORE_SIZE = 64
+# Mean absolute difference (0-255) below which neighbouring slices count as near-identical
+DEFAULT_DISTINCT_THRESHOLD = 4.0
+# Keys describing one slice, which a montage of several slices must not inherit
+SLICE_KEYS = ("phash", "digest", "slice_position", "source_path")
+
+
+class ImageSeries:
+    """
+    Slices of one CT/MRI series, ordered along the scan axis.
+
+    Picks a bounded number of representative slices so a volumetric study
+    costs a predictable number of model calls, and can tile the picked
+    slices into montage images.
+    """
+
+    def __init__(self, slices, series_uid=None):
+        """
+        Initialize the series.
+
+        Args:
+            slices (list): Uploaded image dictionaries with the encoded slice in "file"
+                or the DICOM file in "source_path", see `load_slice`; ordered by "slice_position" when every slice has one, upload order otherwise
+            series_uid (str, optional): Identifier of the series
+        """
+        if all(s.get("slice_position") is not None for s in slices):
+            slices = sorted(slices, key=lambda s: s["slice_position"])
+        self.slices = list(slices)
+        self.series_uid = series_uid
+        self._thumbnails = None
+
+    def __len__(self):
+        return len(self.slices)
+
+    def sample(self, count=DEFAULT_SLICE_COUNT, strategy="uniform", threshold=None):
+        """
+        Pick representative slices.
+
+        Args:
+            count (int): Maximum number of slices to pick
+            strategy (str): "uniform" spaces picks evenly, "variance" takes the
+                slice with the most content from each of `count` equal stretches,
+                "distinct" drops slices nearly identical to the last kept one
+                and spaces picks evenly over the rest
+            threshold (float, optional): Difference threshold for "distinct"
+
+        Returns:
+            list: Positions of the picked slices, in scan order
+        """
+        if strategy not in SAMPLING_STRATEGIES:
+            raise ValueError(f"Unknown sampling strategy: {strategy}")
+        total = len(self.slices)
+        if total <= count:
+            return list(range(total))
+
+        if strategy == "uniform":
+            return uniform_positions(range(total), count)
+
+        thumbnails = self.thumbnails()
+        if strategy == "variance":
+            scores = thumbnails.reshape(total, -1).std(axis=1)
+            bounds = np.linspace(0, total, count + 1).astype(int)
+            return [
+                int(low + np.argmax(scores[low:high]))
+                for low, high in zip(bounds[:-1], bounds[1:])
+                if high > low
+            ]
+
+        threshold = DEFAULT_DISTINCT_THRESHOLD if threshold is None else threshold
+        kept = [0]
+        for position in range(1, total):
+            difference = np.abs(thumbnails[position] - thumbnails[kept[-1]]).mean()
+            if difference > threshold:
+                kept.append(position)
+        return uniform_positions(kept, count)
+
+    def thumbnails(self):
+        """Return small float grayscale versions of all slices, stacked in one array."""
+        if self._thumbnails is None:
+            self._thumbnails = np.stack(
+                [
+                    np.asarray(
+                        decode(load_slice(s))
+                        .convert("L")
+                        .resize((SCORE_SIZE, SCORE_SIZE), PIL.Image.BILINEAR),
+                        dtype=np.float32,
+                    )
+                    for s in self.slices
+                ]
+            )
+        return self._thumbnails
+
+    def montage(self, positions, tile_size=DEFAULT_TILE_SIZE):
+        """
+        Tile slices into one grid image, left to right and top to bottom.
+
+        Args:
+            positions (list): Positions of the slices to tile
+            tile_size (int): Side of each tile in pixels
+
+        Returns:
+            bytes: The montage encoded as PNG
+        """
+        columns = math.ceil(math.sqrt(len(positions)))
+        rows = math.ceil(len(positions) / columns)
+        sheet = PIL.Image.new("L", (columns * tile_size, rows * tile_size))
+        for tile, position in enumerate(positions):
+            image = decode(load_slice(self.slices[position])).convert("L")
+            image.thumbnail((tile_size, tile_size), PIL.Image.LANCZOS)
+            x = (tile % columns) * tile_size + (tile_size - image.width) // 2
+            y = (tile // columns) * tile_size + (tile_size - image.height) // 2
+            sheet.paste(image, (x, y))
+        buf = io.BytesIO()
+        sheet.save(buf, format="PNG")
+        return buf.getvalue()
+
+    def describe(self, positions):
+        """Describe which slices of the series an image shows, for the prompt and the findings."""
+        numbers = ", ".join(str(position + 1) for position in positions)
+        return f"Slices {numbers} of a {len(self.slices)}-slice series"
+
+
+class SeriesSampler:
+    """
+    Replaces each multi-slice series in a case by its representative slices.
+
+    Uploaded images that share a "series_uid" form a series. Images without
+    one, and series with a single slice, are passed through unchanged. DICOM
+    slices are rendered only when they are picked (or scored, for the
+    "variance" and "distinct" strategies).
+    """
+
+    def __init__(
+        self,
+        count=DEFAULT_SLICE_COUNT,
+        strategy="uniform",
+        montage_tiles=None,
+        tile_size=DEFAULT_TILE_SIZE,
+    ):
+        """
+        Initialize the sampler.
+
+        Args:
+            count (int): Maximum number of slices sent per series
+            strategy (str): Sampling strategy, see `ImageSeries.sample`
+            montage_tiles (int, optional): Tile up to this many picked slices into
+                each montage image; picked slices are sent one by one when None
+            tile_size (int): Side of each montage tile in pixels
+        """
+        if strategy not in SAMPLING_STRATEGIES:
+            raise ValueError(f"Unknown sampling strategy: {strategy}")
+        self.count = count
+        self.strategy = strategy
+        self.montage_tiles = montage_tiles
+        self.tile_size = tile_size
+
+    def reduce(self, uploaded_images):
+        """
+        Reduce the uploaded images of a case.
+
+        Args:
+            uploaded_images (list): Uploaded image dictionaries
+
+        Returns:
+            list: Image dictionaries to store and analyze, each with its encoded
+                image in "file"; those standing for a series carry a "series"
+                dictionary with its context
+        """
+        groups = {}
+        reduced = []
+        for img_data in uploaded_images or []:
+            series_uid = img_data.get("series_uid")
+            if series_uid is None:
+                reduced.append(img_data)
+                continue
+            if series_uid not in groups:
+                groups[series_uid] = []
+                reduced.append(series_uid)
+            groups[series_uid].append(img_data)
+
+        result = []
+        for entry in reduced:
+            if not isinstance(entry, str):
+                result.append(with_file(entry))
+            elif len(groups[entry]) == 1:
+                result.append(with_file(groups[entry][0]))
+            else:
+                result.extend(self._sample_series(ImageSeries(groups[entry], entry)))
+        return result
+
+    def _sample_series(self, series):
+        """Build the image dictionaries sent for one series."""
+        positions = series.sample(self.count, self.strategy)
+        if self.montage_tiles:
+            chunks = [
+                positions[first : first + self.montage_tiles]
+                for first in range(0, len(positions), self.montage_tiles)
+            ]
+        else:
+            chunks = [[position] for position in positions]
+
+        images = []
+        for chunk in chunks:
+            first = series.slices[chunk[0]]
+            description = series.describe(chunk)
+            if len(chunk) == 1:
+                image = {**first, "file": load_slice(first)}
+            else:
+                # The montage shares the series' upload details, but its hash
+                # and digest are computed from its own bytes downstream
+                image = {key: value for key, value in first.items() if key not in SLICE_KEYS}
+                image["file"] = series.montage(chunk, self.tile_size)
+                image["source_paths"] = [
+                    series.slices[position].get("source_path") for position in chunk
+                ]
+                description += ", tiled left to right and top to bottom"
+            images.append(
+                {
+                    **image,
+                    "series": {
+                        "series_uid": series.series_uid,
+                        "slice_count": len(series),
+                        "slices": [position + 1 for position in chunk],
+                        "strategy": self.strategy,
+                        "description": description,
+                    },
+                }
+            )
+        return images
+
+
+def uniform_positions(candidates, count):
+    """Pick up to `count` evenly spaced entries of `candidates`, keeping the first and last."""
+    candidates = list(candidates)
+    if len(candidates) <= count:
+        return candidates
+    picks = np.linspace(0, len(candidates) - 1, count).round().astype(int)
+    return [candidates[i] for i in sorted(set(picks.tolist()))]
+
+
+def load_slice(img_data):
+    """Return the encoded image of an upload, rendering a DICOM file kept on disk as PNG."""
+    if img_data.get("file"):
+        return img_data["file"]
+    return DicomImage(img_data["source_path"]).render_png()
+
+
+def with_file(img_data):
+    """Return the upload with its encoded image in "file"."""
+    if img_data.get("file"):
+        return img_data
+    return {**img_data, "file": load_slice(img_data)}
+
+
+def decode(data):
+    """Open encoded image bytes as a PIL image."""
+    return PIL.Image.open(io.BytesIO(data))
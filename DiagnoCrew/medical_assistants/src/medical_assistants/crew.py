@@ -1,9 +1,8 @@
 from crewai import Agent, Crew, Process, Task
 from crewai.project import CrewBase, agent, crew, task
 
-# from crewai.knowledge.source.text_file_knowledge_source import TextFileKnowledgeSource
-
-# text_source = TextFileKnowledgeSource(file_paths=["file.txt"])
+from .report import DiagnosticReport
+from .tools.knowledge_search import KnowledgeSearchTool
 
 
 @CrewBase
@@ -25,7 +24,7 @@ class MedicalAssistants:
         return Agent(
             config=self.agents_config["symptom_analyzer"],
             verbose=True,
-            # knowledge_sources=[text_source],
+            tools=[KnowledgeSearchTool()],
         )
 
     @agent
@@ -42,6 +41,30 @@ class MedicalAssistants:
     def create_diagnostic_report(self) -> Task:
         return Task(
             config=self.tasks_config["create_diagnostic_report"],
+            output_pydantic=DiagnosticReport,
+        )
+
+    def symptom_crew(self) -> Crew:
+        """Creates a crew that only runs the symptom analysis, for the text stage of a staged run"""
+        return Crew(
+            agents=[self.symptom_analyzer()],
+            tasks=[self.analyze_symptoms()],
+            process=Process.sequential,
+            verbose=True,
+        )
+
+    def report_crew(self) -> Crew:
+        """Creates a crew that merges a finished symptom analysis with the image findings into the report"""
+        return Crew(
+            agents=[self.report_creator()],
+            tasks=[
+                Task(
+                    config=self.tasks_config["merge_diagnostic_report"],
+                    output_pydantic=DiagnosticReport,
+                )
+            ],
+            process=Process.sequential,
+            verbose=True,
         )
 
     @crew
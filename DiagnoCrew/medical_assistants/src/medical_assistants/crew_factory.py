@@ -0,0 +1,137 @@
+import hashlib
+import os
+import threading
+import time
+
+from medical_assistants.src.medical_assistants.crew import MedicalAssistants
+
+# Crews a factory can hand out, by the MedicalAssistants method that builds them
+CREW_BUILDERS = {
+    "full": "crew",
+    "symptom": "symptom_crew",
+    "report": "report_crew",
+}
+# The tasks.yaml entries each crew runs, for counting its prompt tokens
+CREW_TASKS = {
+    "full": ("analyze_symptoms", "create_diagnostic_report"),
+    "symptom": ("analyze_symptoms",),
+    "report": ("merge_diagnostic_report",),
+}
+DEFAULT_CONFIG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config")
+# Seconds between checks of the YAML files for changes
+DEFAULT_CHECK_INTERVAL = 2.0
+
+
+class CrewFactory:
+    """
+    Builds the MedicalAssistants crews once per process and hands out copies.
+
+    Constructing MedicalAssistants parses config/agents.yaml and
+    config/tasks.yaml and builds every agent and its LLM client. The factory
+    does that once and keeps the resulting crews as templates. Each call to
+    `crew` returns a copy with its own agents and tasks, which share the
+    templates' LLM clients, so inputs interpolated by `kickoff` never leak
+    between cases. When either YAML file changes on disk the templates are
+    rebuilt on the next call.
+    """
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(
+        self,
+        crew_class=MedicalAssistants,
+        config_dir=DEFAULT_CONFIG_DIR,
+        check_interval=DEFAULT_CHECK_INTERVAL,
+    ):
+        """
+        Configure the factory. Nothing is built until `crew` is called.
+
+        Args:
+            crew_class (type): The @CrewBase class the crews come from
+            config_dir (str): Directory of the class' agents.yaml and tasks.yaml
+            check_interval (float): Seconds between checks of the YAML files for changes
+        """
+        self.crew_class = crew_class
+        self.check_interval = check_interval
+        self.config_paths = [
+            os.path.join(config_dir, "agents.yaml"),
+            os.path.join(config_dir, "tasks.yaml"),
+        ]
+        self._templates = None
+        self._mtimes = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+        self._stats = {
+            "builds": 0,
+            "build_seconds": 0.0,
+            "copies": 0,
+            "copy_seconds": 0.0,
+        }
+
+    @classmethod
+    def shared(cls):
+        """Return the process-wide factory, creating it on first use."""
+        if cls._shared is None:
+            with cls._shared_lock:
+                if cls._shared is None:
+                    cls._shared = cls()
+        return cls._shared
+
+    def crew(self, kind="full"):
+        """
+        Return a fresh crew for one case.
+
+        Args:
+            kind (str): "full" for the sequential crew, "symptom" for the symptom
+                analysis stage or "report" for the merge-and-report stage
+
+        Returns:
+            Crew: A copy of the template crew, ready for `kickoff`
+        """
+        with self._lock:
+            self._reload_if_changed()
+            start = time.perf_counter()
+            crew = self._templates[CREW_BUILDERS[kind]].copy()
+            self._stats["copies"] += 1
+            self._stats["copy_seconds"] += time.perf_counter() - start
+        return crew
+
+    def fingerprint(self):
+        """Return a hash of the agent/task YAML files and the crew's LLM setting."""
+        digest = hashlib.sha256()
+        for path in self.config_paths:
+            with open(path, "rb") as f:
+                digest.update(f.read())
+            digest.update(b"\0")
+        digest.update(os.getenv("MODEL", "").encode("utf-8"))
+        return digest.hexdigest()
+
+    def stats(self):
+        """Return how often and how long the templates were built and copied."""
+        with self._lock:
+            stats = dict(self._stats)
+        stats["mean_copy_seconds"] = (
+            stats["copy_seconds"] / stats["copies"] if stats["copies"] else 0.0
+        )
+        return stats
+
+    def _reload_if_changed(self):
+        """Build the templates on first use or when a YAML file changed. Caller holds the lock."""
+        now = time.monotonic()
+        if self._templates is not None and now - self._checked < self.check_interval:
+            return
+        self._checked = now
+        mtimes = [os.path.getmtime(path) for path in self.config_paths]
+        if self._templates is not None and mtimes == self._mtimes:
+            return
+
+        start = time.perf_counter()
+        assistants = self.crew_class()
+        self._templates = {
+            builder: getattr(assistants, builder)()
+            for builder in CREW_BUILDERS.values()
+        }
+        self._mtimes = mtimes
+        self._stats["builds"] += 1
+        self._stats["build_seconds"] += time.perf_counter() - start
@@ -0,0 +1,493 @@
+import contextlib
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+KNOWLEDGE_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "..", "knowledge"
+)
+DEFAULT_SOURCE = os.path.join(KNOWLEDGE_DIR, "questions_and_answers.json")
+DEFAULT_INDEX_DIR = os.path.join(KNOWLEDGE_DIR, "index")
+INDEX_VERSION = 2
+DEFAULT_SHARD_COUNT = 8
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from has have how i if in is it its "
+    "me my not of on or should that the their there these they this to was what "
+    "when which who why will with you your".split()
+)
+
+# Arrays of a shard, each saved as one .npy file and opened with mmap
+ARRAYS = ("terms", "term_offsets", "doc_ids", "term_freqs", "doc_lengths", "doc_offsets")
+
+
+def tokenize(text):
+    """Split a text into lowercase word tokens, without stopwords."""
+    return [t for t in TOKEN_PATTERN.findall((text or "").lower()) if t not in STOPWORDS]
+
+
+def iter_entries(path, chunk_size=1 << 16):
+    """
+    Stream the entries of a JSON array file one at a time.
+
+    Only one chunk and the entry being decoded are held in memory, instead
+    of the whole parsed file `json.load` would build.
+
+    Raises:
+        ValueError: If the file is not a JSON array
+    """
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8") as f:
+        buffer, position = "", 0
+
+        def fill():
+            # Append the next chunk to what is left of the buffer
+            nonlocal buffer, position
+            chunk = f.read(chunk_size)
+            buffer, position = buffer[position:] + chunk, 0
+            return bool(chunk)
+
+        def skip(characters):
+            # Move past separators; False once the file is exhausted
+            nonlocal position
+            while True:
+                while position < len(buffer) and buffer[position] in characters:
+                    position += 1
+                if position < len(buffer) or not fill():
+                    return position < len(buffer)
+
+        if not skip(" \t\r\n") or buffer[position] != "[":
+            raise ValueError(f"{path} does not hold a JSON array")
+        position += 1
+        while skip(" \t\r\n,") and buffer[position] != "]":
+            try:
+                entry, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # The entry is cut off at the end of the buffer
+                if not fill():
+                    raise
+                continue
+            yield entry
+            position = end
+
+
+def entry_text(entry):
+    """Return the question and answer of an entry with whitespace normalized."""
+    question = " ".join(str(entry.get("Question", "")).split())
+    answer = " ".join(str(entry.get("Answer", "")).split())
+    return question, answer
+
+
+def entry_digest(question, answer):
+    """Return the content hash of an entry."""
+    return hashlib.sha256(f"{question}\n{answer}".encode("utf-8")).hexdigest()
+
+
+def source_stamp(path):
+    """Return the size and modification time of a file, to notice changes without reading it."""
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def load_mapped(path):
+    """
+    Open a .npy file with mmap.
+
+    The memmap is viewed as a plain array: it still reads from the mapped
+    pages, without the per-slice overhead of the np.memmap subclass.
+    """
+    return np.asarray(np.load(path, mmap_mode="r"))
+
+
+class Shard:
+    """One shard of the index: an inverted index over part of the entries, opened with mmap."""
+
+    def __init__(self, shard_dir):
+        for name in ARRAYS:
+            setattr(self, name, load_mapped(os.path.join(shard_dir, f"{name}.npy")))
+        embeddings = os.path.join(shard_dir, "embeddings.npy")
+        self.embeddings = load_mapped(embeddings) if os.path.exists(embeddings) else None
+        self._texts = open(os.path.join(shard_dir, "docs.bin"), "rb")
+        self._texts_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    def postings(self, term):
+        """Return the postings range of a term, found by binary search in the sorted terms."""
+        key = term.encode("ascii")
+        i = int(np.searchsorted(self.terms, key))
+        if i < len(self.terms) and self.terms[i] == key:
+            return int(self.term_offsets[i]), int(self.term_offsets[i + 1])
+        return 0, 0
+
+    def document(self, doc):
+        """Return the question and answer of a document of the shard."""
+        start, end = int(self.doc_offsets[doc]), int(self.doc_offsets[doc + 1])
+        with self._texts_lock:
+            self._texts.seek(start)
+            question, _, answer = self._texts.read(end - start).decode("utf-8").partition("\n")
+        return {"question": question, "answer": answer}
+
+
+class KnowledgeIndex:
+    """
+    BM25 search over the bundled medical Q&A knowledge base.
+
+    Entries are spread over a fixed number of shards by their content hash.
+    Each shard is an inverted index in CSR layout: the postings of its i-th
+    term are doc_ids[term_offsets[i]:term_offsets[i + 1]] with their term
+    frequencies, and the texts are kept in one UTF-8 file addressed by
+    doc_offsets. Shards are opened with mmap and terms are found by binary
+    search, so opening the index reads no corpus data, and worker processes
+    share the pages through the OS cache. Document frequencies and lengths
+    are combined across shards at query time.
+    """
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, index_dir=DEFAULT_INDEX_DIR):
+        """
+        Open the current generation of a built index.
+
+        Args:
+            index_dir (str): Directory written by `build`
+        """
+        self.manifest = read_manifest(index_dir)
+        self.shards = [
+            Shard(os.path.join(index_dir, "shards", shard["name"]))
+            for shard in self.manifest["shards"]
+        ]
+        self.bases = np.cumsum([0] + [shard["documents"] for shard in self.manifest["shards"]])
+        self.doc_count = int(self.bases[-1])
+        self.average_length = float(self.manifest["average_length"])
+
+    @classmethod
+    def shared(cls, source=DEFAULT_SOURCE, index_dir=None):
+        """Return the process-wide index, building it first when it is missing or stale."""
+        with cls._shared_lock:
+            if cls._shared is None:
+                index_dir = index_dir or os.getenv("KNOWLEDGE_INDEX_DIR", DEFAULT_INDEX_DIR)
+                cls._shared = cls.load_or_build(source, index_dir)
+            return cls._shared
+
+    @classmethod
+    def load_or_build(cls, source=DEFAULT_SOURCE, index_dir=DEFAULT_INDEX_DIR, embed=None):
+        """
+        Open the index in `index_dir`, updating it first when the source file has changed.
+
+        The source is only read when its size or modification time differs
+        from the one recorded at the last build, so the usual startup cost
+        does not depend on the size of the corpus.
+        """
+        if not is_current(index_dir, source):
+            with index_lock(index_dir):
+                # Another process may have built it while we waited for the lock
+                if not is_current(index_dir, source):
+                    _build(source, index_dir, embed=embed)
+        return cls(index_dir)
+
+    def search(self, query, top_k=5):
+        """
+        Find the entries that best match a query.
+
+        Args:
+            query (str): Free text, e.g. the patient's symptoms
+            top_k (int): Number of entries to return
+
+        Returns:
+            list: {"question", "answer", "score"} dictionaries, best first
+        """
+        terms = set(tokenize(query))
+        if not terms or not self.doc_count:
+            return []
+        ranges = {term: [shard.postings(term) for shard in self.shards] for term in terms}
+
+        scores = np.zeros(self.doc_count, dtype=np.float32)
+        for term, spans in ranges.items():
+            document_frequency = sum(end - start for start, end in spans)
+            if not document_frequency:
+                continue
+            idf = np.log(
+                1 + (self.doc_count - document_frequency + 0.5) / (document_frequency + 0.5)
+            )
+            for shard, base, (start, end) in zip(self.shards, self.bases, spans):
+                if start == end:
+                    continue
+                docs = shard.doc_ids[start:end]
+                tf = shard.term_freqs[start:end]
+                norm = K1 * (1 - B + B * shard.doc_lengths[docs] / self.average_length)
+                # Each document occurs once per postings list, so plain fancy-index add is safe
+                scores[base + docs] += idf * tf * (K1 + 1) / (tf + norm)
+
+        # The knowledge base repeats some entries, so take extra candidates
+        # and skip the duplicates
+        candidates = min(top_k * 3, int(np.count_nonzero(scores)))
+        if candidates == 0:
+            return []
+        best = np.argpartition(-scores, candidates - 1)[:candidates]
+        best = best[np.argsort(-scores[best], kind="stable")]
+        results, seen = [], set()
+        for doc in best:
+            document = self.document(int(doc))
+            if document["question"] in seen:
+                continue
+            seen.add(document["question"])
+            results.append({**document, "score": round(float(scores[doc]), 3)})
+            if len(results) == top_k:
+                break
+        return results
+
+    def document(self, doc):
+        """Return the question and answer of a document by its index-wide number."""
+        shard = int(np.searchsorted(self.bases, doc, side="right")) - 1
+        return self.shards[shard].document(doc - int(self.bases[shard]))
+
+
+def read_manifest(index_dir):
+    """Return the manifest of the current generation of an index."""
+    with open(os.path.join(index_dir, "CURRENT"), "r") as f:
+        manifest_name = f.read().strip()
+    with open(os.path.join(index_dir, manifest_name), "r") as f:
+        return json.load(f)
+
+
+def is_current(index_dir, source):
+    """Check whether the index was built from the source file as it is now."""
+    try:
+        manifest = read_manifest(index_dir)
+    except (OSError, ValueError):
+        return False
+    return manifest.get("version") == INDEX_VERSION and manifest.get("source") == source_stamp(source)
+
+
+@contextlib.contextmanager
+def index_lock(index_dir):
+    """Hold an exclusive lock on an index directory, across threads and processes."""
+    os.makedirs(index_dir, exist_ok=True)
+    with open(os.path.join(index_dir, ".lock"), "a+") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        # Closing the file releases the lock
+        yield
+
+
+def write_atomic(path, text):
+    """Write a text file through a temporary file and a rename."""
+    directory = os.path.dirname(path)
+    fd, temporary = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    with os.fdopen(fd, "w") as f:
+        f.write(text)
+    os.replace(temporary, path)
+
+
+def write_shard(shard_dir, documents, embed=None):
+    """
+    Build the inverted index of one shard and write it to `shard_dir`.
+
+    Args:
+        shard_dir (str): Directory to create
+        documents (list): (question, answer) pairs of the shard, in source order
+        embed (callable, optional): Maps a list of texts to an embedding matrix
+    """
+    postings = {}
+    doc_lengths = []
+    texts = []
+    for doc, (question, answer) in enumerate(documents):
+        # The question names the topic, so its terms count twice
+        tokens = tokenize(question) * 2 + tokenize(answer)
+        doc_lengths.append(len(tokens))
+        counts = {}
+        for token in tokens:
+            counts[token] = counts.get(token, 0) + 1
+        for token, count in counts.items():
+            postings.setdefault(token, []).append((doc, count))
+        texts.append(f"{question}\n{answer}".encode("utf-8"))
+
+    terms = sorted(postings)
+    lengths = np.array([len(postings[t]) for t in terms], dtype=np.int64)
+    arrays = {
+        "terms": np.array([t.encode("ascii") for t in terms], dtype=bytes),
+        "term_offsets": np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64),
+        "doc_ids": np.array([d for t in terms for d, _ in postings[t]], dtype=np.int32),
+        "term_freqs": np.array([c for t in terms for _, c in postings[t]], dtype=np.float32),
+        "doc_lengths": np.array(doc_lengths, dtype=np.float32),
+        "doc_offsets": np.concatenate(
+            [[0], np.cumsum([len(text) for text in texts])]
+        ).astype(np.int64),
+    }
+    if embed is not None:
+        arrays["embeddings"] = np.asarray(
+            embed([f"{q}\n{a}" for q, a in documents]), dtype=np.float32
+        )
+
+    staging = tempfile.mkdtemp(dir=os.path.dirname(shard_dir), prefix=".shard-")
+    for name, array in arrays.items():
+        np.save(os.path.join(staging, f"{name}.npy"), array)
+    with open(os.path.join(staging, "docs.bin"), "wb") as f:
+        f.writelines(texts)
+    stats = {"documents": len(documents), "total_length": sum(doc_lengths)}
+    with open(os.path.join(staging, "shard.json"), "w") as f:
+        json.dump(stats, f)
+    try:
+        os.replace(staging, shard_dir)
+    except OSError:
+        # Shard names are content-addressed: a complete shard written by
+        # someone else in the meantime holds the same index
+        shutil.rmtree(staging, ignore_errors=True)
+        if not os.path.exists(os.path.join(shard_dir, "shard.json")):
+            raise
+    return stats
+
+
+def build(source=DEFAULT_SOURCE, index_dir=DEFAULT_INDEX_DIR, shard_count=None, embed=None):
+    """
+    Bring the index of a Q&A file up to date, holding the index lock.
+
+    See `_build` for the arguments.
+    """
+    with index_lock(index_dir):
+        return _build(source, index_dir, shard_count, embed)
+
+
+def _build(source, index_dir, shard_count=None, embed=None):
+    """
+    Bring the index of a Q&A file up to date.
+
+    The source is streamed twice: once to hash every entry and group the
+    hashes into shards, and once to collect the entries of the shards whose
+    hashes changed. Only those shards are rebuilt; the others are reused from
+    the previous generation. Shard directories are named after their content
+    digest and the new generation becomes visible by rewriting CURRENT, so
+    readers never see a half-written index and open indexes keep working.
+
+    Args:
+        source (str): JSON list of {"Question", "Answer"} entries
+        index_dir (str): Directory to write the index to
+        shard_count (int, optional): Number of shards; kept from the previous build by default
+        embed (callable, optional): Maps a list of texts to an embedding matrix,
+            saved as embeddings.npy next to each rebuilt shard
+
+    Returns:
+        dict: The manifest of the new generation, with the names of the rebuilt shards
+    """
+    shards_dir = os.path.join(index_dir, "shards")
+    os.makedirs(shards_dir, exist_ok=True)
+    try:
+        previous = read_manifest(index_dir)
+        if previous.get("version") != INDEX_VERSION:
+            previous = {}
+    except (OSError, ValueError):
+        previous = {}
+    shard_count = shard_count or previous.get("shard_count") or DEFAULT_SHARD_COUNT
+    stamp = source_stamp(source)
+
+    # First pass: content hashes only
+    hashes = [hashlib.sha256() for _ in range(shard_count)]
+    counts = [0] * shard_count
+    for entry in iter_entries(source):
+        digest = entry_digest(*entry_text(entry))
+        bucket = int(digest[:8], 16) % shard_count
+        hashes[bucket].update(digest.encode("ascii"))
+        counts[bucket] += 1
+    suffix = "-e" if embed is not None else ""
+    names = [f"{bucket:03d}-{h.hexdigest()[:16]}{suffix}" for bucket, h in enumerate(hashes)]
+    # Shard names are content-addressed, so an existing directory is up to date
+    stale = {
+        bucket
+        for bucket, name in enumerate(names)
+        if not os.path.exists(os.path.join(shards_dir, name, "shard.json"))
+    }
+
+    # Second pass: the entries of the changed shards
+    documents = {bucket: [] for bucket in stale}
+    if stale:
+        for entry in iter_entries(source):
+            question, answer = entry_text(entry)
+            bucket = int(entry_digest(question, answer)[:8], 16) % shard_count
+            if bucket in documents:
+                documents[bucket].append((question, answer))
+
+    shards = []
+    for bucket, name in enumerate(names):
+        shard_dir = os.path.join(shards_dir, name)
+        if bucket in stale:
+            stats = write_shard(shard_dir, documents[bucket], embed)
+        else:
+            with open(os.path.join(shard_dir, "shard.json"), "r") as f:
+                stats = json.load(f)
+        shards.append({"name": name, **stats, "embeddings": embed is not None})
+
+    generation = previous.get("generation", 0) + 1
+    total_documents = sum(counts)
+    manifest = {
+        "version": INDEX_VERSION,
+        "generation": generation,
+        "source": stamp,
+        "shard_count": shard_count,
+        "documents": total_documents,
+        "average_length": (
+            sum(s["total_length"] for s in shards) / total_documents if total_documents else 1.0
+        ),
+        "shards": shards,
+    }
+    manifest_name = f"manifest-{generation:06d}.json"
+    write_atomic(os.path.join(index_dir, manifest_name), json.dumps(manifest, indent=4))
+    write_atomic(os.path.join(index_dir, "CURRENT"), manifest_name)
+
+    collect_garbage(index_dir, keep={manifest_name, previous_manifest_name(previous)})
+    return {**manifest, "rebuilt": [names[bucket] for bucket in sorted(stale)]}
+
+
+def previous_manifest_name(manifest):
+    """Return the file name of a manifest, or None for an empty one."""
+    if not manifest:
+        return None
+    return f"manifest-{manifest['generation']:06d}.json"
+
+
+def collect_garbage(index_dir, keep):
+    """
+    Remove manifests and shards that no kept generation refers to.
+
+    Call it while holding `index_lock`.
+
+    The previous generation is kept, so processes that opened it before the
+    switch can still open shards lazily.
+    """
+    referenced = set()
+    for name in os.listdir(index_dir):
+        if not name.startswith("manifest-"):
+            continue
+        if name not in keep:
+            os.remove(os.path.join(index_dir, name))
+            continue
+        with open(os.path.join(index_dir, name), "r") as f:
+            referenced.update(shard["name"] for shard in json.load(f)["shards"])
+
+    shards_dir = os.path.join(index_dir, "shards")
+    for name in os.listdir(shards_dir):
+        # Dot-prefixed directories are shards still being written
+        if name not in referenced and not name.startswith("."):
+            shutil.rmtree(os.path.join(shards_dir, name), ignore_errors=True)
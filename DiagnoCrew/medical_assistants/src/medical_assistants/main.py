@@ -4,40 +4,14 @@ import warnings
 import os
 import json
 from datetime import datetime
-import re
 import PIL.Image
 import base64
 from medical_assistants.crew import MedicalAssistants
+from medical_assistants.report import parse_report as process_output
 
 warnings.filterwarnings("ignore", category=SyntaxWarning, module="pysbd")
 
 
-def process_output(output):
-    """
-    Process the crew output to ensure it's in the correct format.
-    Removes markdown code blocks and extracts valid JSON.
-
-    Args:
-        output (str): The output from the crew
-
-    Returns:
-        dict: The processed diagnostic report
-    """
-
-    match = re.search(r"```json\s*({.*?})\s*```", output, re.DOTALL)
-    if not match:
-        raise ValueError("No JSON content found in the Markdown block.")
-
-    json_string = match.group(1)  # Extract the JSON content
-
-    # Step 2: Parse the JSON string into a Python dictionary
-    try:
-        json_object = json.loads(json_string)
-        return json_object
-    except json.JSONDecodeError as e:
-        raise json.JSONDecodeError(f"Invalid JSON string: {str(e)}", e.doc, e.pos)
-
-
 def run():
     """
     Run the medical diagnostic crew with patient information.
@@ -81,15 +55,19 @@ def run():
     }
 
     try:
-        result = (MedicalAssistants().crew().kickoff(inputs=inputs)).raw
-        result_processed = process_output(result)
+        crew_output = MedicalAssistants().crew().kickoff(inputs=inputs)
+        if crew_output.pydantic is not None:
+            return crew_output.pydantic.model_dump()
 
         # Parse the report from the result
         try:
-            return json.loads(result_processed)
-        except:
+            return process_output(crew_output.raw)
+        except ValueError:
             # If the result isn't valid JSON, return it as is
-            return {"error": "Could not parse result as JSON", "raw_result": result}
+            return {
+                "error": "Could not parse result as JSON",
+                "raw_result": crew_output.raw,
+            }
     except Exception as e:
         return {"error": f"An error occurred while running the crew: {str(e)}"}
 
@@ -0,0 +1,129 @@
+import json
+import re
+from typing import List
+
+from pydantic import BaseModel, Field, field_validator, model_validator
+
+FENCED_JSON_PATTERN = re.compile(r"```(?:json)?\s*({.*?})\s*```", re.DOTALL)
+
+
+def to_number(value):
+    """
+    Turn numbers given as text, e.g. "85%" or "0.85", into floats.
+
+    Raises:
+        ValueError: For anything that is not a number, including null and lists,
+            so pydantic reports it as a validation error
+    """
+    if isinstance(value, str):
+        value = value.strip().rstrip("%").strip()
+    try:
+        return float(value)
+    except TypeError:
+        raise ValueError(f"Expected a number, got {type(value).__name__}")
+
+
+class DifferentialDiagnosis(BaseModel):
+    condition: str
+    probability: float = Field(
+        ge=0, le=100, description="Probability of the condition in percent"
+    )
+
+    @field_validator("probability", mode="before")
+    @classmethod
+    def parse_probability(cls, value):
+        return min(max(to_number(value), 0.0), 100.0)
+
+
+class DiagnosticReport(BaseModel):
+    """The diagnostic report produced by the report creator."""
+
+    primary_diagnosis: str
+    confidence: float = Field(
+        ge=0, le=1, description="Confidence in the primary diagnosis, from 0 to 1"
+    )
+    differential_diagnoses: List[DifferentialDiagnosis] = Field(default_factory=list)
+    supporting_evidence: List[str] = Field(default_factory=list)
+    recommended_actions: List[str] = Field(default_factory=list)
+    image_findings: List[str] = Field(default_factory=list)
+
+    @field_validator("confidence", mode="before")
+    @classmethod
+    def parse_confidence(cls, value):
+        # Models answer in percent as often as in fractions
+        confidence = to_number(value)
+        if confidence > 1:
+            confidence /= 100
+        return min(max(confidence, 0.0), 1.0)
+
+    @field_validator(
+        "supporting_evidence", "recommended_actions", "image_findings", mode="before"
+    )
+    @classmethod
+    def as_list(cls, value):
+        if value is None:
+            return []
+        if isinstance(value, str):
+            return [value]
+        return [str(item) for item in value]
+
+    @model_validator(mode="after")
+    def scale_probabilities(self):
+        # Probabilities given as fractions are scaled to percent, and all are
+        # rescaled to sum to 100 as the report format asks
+        differentials = self.differential_diagnoses
+        if differentials and all(d.probability <= 1 for d in differentials):
+            for d in differentials:
+                d.probability *= 100
+        total = sum(d.probability for d in differentials)
+        if total > 0:
+            for d in differentials:
+                d.probability = round(d.probability * 100 / total, 1)
+        return self
+
+
+def normalize_report(data):
+    """
+    Validate a report and normalize its confidence and probability ranges.
+
+    Args:
+        data (dict): The report as parsed from the model output
+
+    Returns:
+        dict: The normalized report
+
+    Raises:
+        ValueError: If the report is missing fields or has values of the wrong type
+    """
+    return DiagnosticReport.model_validate(data).model_dump()
+
+
+def parse_report(output):
+    """
+    Parse the report from crew output.
+
+    Structured output is plain JSON and is parsed directly; the fenced
+    ```json block the prose format asks for is found by regex only when the
+    output is not JSON itself.
+
+    Args:
+        output (str): The output from the crew
+
+    Returns:
+        dict: The normalized diagnostic report
+
+    Raises:
+        ValueError: If no valid report can be parsed
+    """
+    text = output.strip()
+    if not text.startswith("{"):
+        match = FENCED_JSON_PATTERN.search(output)
+        if not match:
+            raise ValueError("No JSON content found in the Markdown block.")
+        text = match.group(1)
+
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError as e:
+        raise json.JSONDecodeError(f"Invalid JSON string: {str(e)}", e.doc, e.pos)
+    return normalize_report(data)
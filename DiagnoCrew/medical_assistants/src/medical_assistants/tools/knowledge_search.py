@@ -0,0 +1,38 @@
+from typing import Type
+
+from crewai.tools import BaseTool
+from pydantic import BaseModel, Field
+
+from ..knowledge_index import KnowledgeIndex
+
+
+class KnowledgeSearchInput(BaseModel):
+    """Input schema for KnowledgeSearchTool."""
+
+    query: str = Field(
+        ..., description="Symptoms, findings or a condition to look up, in plain words"
+    )
+
+
+class KnowledgeSearchTool(BaseTool):
+    name: str = "Medical knowledge search"
+    description: str = (
+        "Searches the local medical Q&A knowledge base and returns the best "
+        "matching questions with their answers. Use it to check which conditions "
+        "fit the patient's symptoms and findings."
+    )
+    args_schema: Type[BaseModel] = KnowledgeSearchInput
+    top_k: int = 5
+    max_answer_chars: int = 600
+
+    def _run(self, query: str) -> str:
+        results = KnowledgeIndex.shared().search(query, top_k=self.top_k)
+        if not results:
+            return "No matching entries in the knowledge base."
+        snippets = []
+        for result in results:
+            answer = result["answer"]
+            if len(answer) > self.max_answer_chars:
+                answer = answer[: self.max_answer_chars].rsplit(" ", 1)[0] + " ..."
+            snippets.append(f"Q: {result['question']}\nA: {answer}")
+        return "\n\n".join(snippets)
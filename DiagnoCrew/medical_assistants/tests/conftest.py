@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The tests import the application packages (medical_assistants, utils, ...)
+# from the DiagnoCrew directory, wherever pytest is started from
+APP_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+if APP_DIR not in sys.path:
+    sys.path.insert(0, APP_DIR)
@@ -0,0 +1,104 @@
+import os
+
+from medical_assistants.case_store import CaseStore
+
+
+def add_case(store, case_id, created_at, patient_id="P1", diagnosis="Influenza"):
+    """Store a case with a data package, image metadata and diagnosis."""
+    store.save_case(
+        {"case_id": case_id, "timestamp": created_at, "patient_data": {"id": patient_id}}
+    )
+    store.save_images(case_id, [{"index": 0, "type": "Chest X-ray"}])
+    store.save_diagnosis(case_id, {"primary_diagnosis": diagnosis})
+
+
+def all_pages(store, limit, **filters):
+    """Walk `find_cases` page by page and return the pages' case ids."""
+    pages, after = [], None
+    while True:
+        cases, after = store.find_cases(limit=limit, after=after, **filters)
+        pages.append([case["case_id"] for case in cases])
+        if after is None:
+            return pages
+
+
+def test_pages_are_newest_first_without_gaps_or_repeats(tmp_path):
+    store = CaseStore(str(tmp_path))
+    for day in range(1, 8):
+        add_case(store, f"C{day}", f"2024-01-0{day} 10:00:00")
+
+    pages = all_pages(store, limit=3)
+    assert pages == [["C7", "C6", "C5"], ["C4", "C3", "C2"], ["C1"]]
+
+
+def test_full_last_page_is_followed_by_an_empty_page(tmp_path):
+    store = CaseStore(str(tmp_path))
+    for day in range(1, 5):
+        add_case(store, f"C{day}", f"2024-01-0{day} 10:00:00")
+
+    assert all_pages(store, limit=2) == [["C4", "C3"], ["C2", "C1"], []]
+
+
+def test_cases_with_the_same_timestamp_are_split_by_case_id(tmp_path):
+    store = CaseStore(str(tmp_path))
+    for case_id in ("A", "B", "C", "D"):
+        add_case(store, case_id, "2024-01-01 10:00:00")
+
+    pages = all_pages(store, limit=3)
+    assert pages == [["D", "C", "B"], ["A"]]
+
+
+def test_filters_apply_on_every_page(tmp_path):
+    store = CaseStore(str(tmp_path))
+    for day in range(1, 7):
+        add_case(
+            store,
+            f"C{day}",
+            f"2024-01-0{day} 10:00:00",
+            patient_id="P1" if day % 2 else "P2",
+            diagnosis="Pneumonia" if day > 2 else "Asthma",
+        )
+
+    assert all_pages(store, limit=1, patient_id="P1", diagnosis="pneu") == [["C5"], ["C3"], []]
+    assert all_pages(store, limit=5, since="2024-01-02", until="2024-01-03") == [["C3", "C2"]]
+
+
+def test_diagnosis_filter_treats_wildcards_literally(tmp_path):
+    store = CaseStore(str(tmp_path))
+    add_case(store, "C1", "2024-01-01 10:00:00", diagnosis="A_B")
+    add_case(store, "C2", "2024-01-02 10:00:00", diagnosis="AxB")
+
+    cases, _ = store.find_cases(diagnosis="A_")
+    assert [case["case_id"] for case in cases] == ["C1"]
+
+
+def test_archived_cases_load_as_before(tmp_path):
+    store = CaseStore(str(tmp_path))
+    add_case(store, "OLD1", "2020-03-01 10:00:00")
+    add_case(store, "OLD2", "2020-03-15 10:00:00", diagnosis="Asthma")
+    add_case(store, "OLD3", "2020-04-02 10:00:00")
+    add_case(store, "NEW", "2099-01-01 10:00:00")
+    before = {case_id: store.get_case(case_id) for case_id in ("OLD1", "OLD2", "OLD3", "NEW")}
+
+    assert store.archive(older_than_days=30) == 3
+    assert sorted(os.listdir(store.archive_dir)) == ["cases-2020-03.zip", "cases-2020-04.zip"]
+    for case_id, case in before.items():
+        assert store.get_case(case_id) == case
+
+    cases, _ = store.find_cases(diagnosis="Asthma", payloads=["diagnosis", "image_metadata"])
+    assert cases[0]["diagnosis"] == {"primary_diagnosis": "Asthma"}
+    assert cases[0]["image_metadata"] == [{"index": 0, "type": "Chest X-ray"}]
+
+    # Archiving again leaves archived cases alone
+    assert store.archive(older_than_days=30) == 0
+
+
+def test_case_written_after_archiving_uses_the_new_payload(tmp_path):
+    store = CaseStore(str(tmp_path))
+    add_case(store, "OLD", "2020-03-01 10:00:00")
+    store.archive(older_than_days=30)
+
+    store.save_diagnosis("OLD", {"primary_diagnosis": "Revised"})
+    case = store.get_case("OLD")
+    assert case["diagnosis"] == {"primary_diagnosis": "Revised"}
+    assert case["image_metadata"] == [{"index": 0, "type": "Chest X-ray"}]
@@ -0,0 +1,84 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from medical_assistants.diagnosis_cache import DiagnosisCache
+
+
+def blocking_compute(started, release, calls):
+    """Return a compute function that counts its calls and waits until released."""
+
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return {"primary_diagnosis": "Influenza"}
+
+    return compute
+
+
+def test_identical_runs_in_flight_share_one_computation(tmp_path):
+    cache = DiagnosisCache(str(tmp_path))
+    started, release, calls = threading.Event(), threading.Event(), []
+    compute = blocking_compute(started, release, calls)
+    lookups = threading.Semaphore(0)
+    get = cache.store.get
+
+    def counted_get(key):
+        value = get(key)
+        lookups.release()
+        return value
+
+    cache.store.get = counted_get
+
+    with ThreadPoolExecutor(4) as pool:
+        leader = pool.submit(cache.get_or_run, "key", compute)
+        assert started.wait(5)
+        followers = [pool.submit(cache.get_or_run, "key", compute) for _ in range(3)]
+        # Every follower missed the cache while the leader is still running;
+        # give them a moment to reach the in-flight run before releasing it
+        for _ in range(4):
+            assert lookups.acquire(timeout=5)
+        time.sleep(0.1)
+        release.set()
+        results = [leader.result(5)] + [f.result(5) for f in followers]
+
+    assert len(calls) == 1
+    assert results[0][1] == "miss"
+    assert {source for _, source in results[1:]} == {"shared"}
+    assert all(value == results[0][0] for value, _ in results)
+
+
+def test_finished_run_is_served_from_the_cache(tmp_path):
+    cache = DiagnosisCache(str(tmp_path))
+    cache.get_or_run("key", lambda: {"primary_diagnosis": "Influenza"})
+    value, source = cache.get_or_run("key", lambda: {"primary_diagnosis": "Other"})
+    assert source == "hit"
+    assert value == {"primary_diagnosis": "Influenza"}
+
+
+def test_bypass_does_not_join_a_run_in_flight(tmp_path):
+    cache = DiagnosisCache(str(tmp_path))
+    started, release, calls = threading.Event(), threading.Event(), []
+
+    with ThreadPoolExecutor(2) as pool:
+        leader = pool.submit(
+            cache.get_or_run, "key", blocking_compute(started, release, calls)
+        )
+        assert started.wait(5)
+        # Returns while the first run is still blocked
+        value, source = cache.get_or_run(
+            "key", lambda: {"primary_diagnosis": "Fresh"}, bypass=True
+        )
+        release.set()
+        leader.result(5)
+
+    assert source == "miss"
+    assert value == {"primary_diagnosis": "Fresh"}
+
+
+def test_uncacheable_values_are_not_stored(tmp_path):
+    cache = DiagnosisCache(str(tmp_path))
+    cache.get_or_run("key", lambda: {"error": "failed"}, cacheable=lambda v: "error" not in v)
+    _, source = cache.get_or_run("key", lambda: {"primary_diagnosis": "Influenza"})
+    assert source == "miss"
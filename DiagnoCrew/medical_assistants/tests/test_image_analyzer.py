@@ -0,0 +1,144 @@
+import threading
+import time
+
+import pytest
+
+# The service module needs the full application environment
+pytest.importorskip("dotenv")
+pytest.importorskip("crewai")
+pytest.importorskip("google.genai")
+
+from medical_assistants.backend_services import (  # noqa: E402
+    BatchSplitError,
+    ImageAnalyzer,
+    split_batch_response,
+)
+
+
+def make_analyzer(**kwargs):
+    """Build an analyzer that must not reach the network."""
+    return ImageAnalyzer(client_manager=object(), prompt_contexts=object(), **kwargs)
+
+
+def images(count):
+    return [{"index": i, "type": "Chest X-ray", "region": "Chest/Thorax"} for i in range(count)]
+
+
+def test_split_batch_response_returns_findings_by_label():
+    text = "=== IMAGE 0 ===\nClear lungs.\n=== IMAGE 1 ===\nRight lower lobe opacity."
+    assert split_batch_response(text, [0, 1]) == {
+        "0": "Clear lungs.",
+        "1": "Right lower lobe opacity.",
+    }
+
+
+def test_split_batch_response_accepts_sections_out_of_order():
+    text = "=== IMAGE 1 ===\nOpacity.\n=== IMAGE 0 ===\nClear."
+    assert split_batch_response(text, [0, 1]) == {"0": "Clear.", "1": "Opacity."}
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "Both images look normal.",
+        "=== IMAGE 0 ===\nClear lungs.",
+        "=== IMAGE 0 ===\nClear.\n=== IMAGE 0 ===\nClear again.",
+        "=== IMAGE 0 ===\nClear.\n=== IMAGE 1 ===\nOpacity.\n=== IMAGE 2 ===\nExtra.",
+        "=== IMAGE 0 ===\n\n=== IMAGE 1 ===\nOpacity.",
+        None,
+    ],
+)
+def test_split_batch_response_rejects_malformed_responses(text):
+    with pytest.raises(BatchSplitError):
+        split_batch_response(text, [0, 1])
+
+
+def test_unsplittable_batch_falls_back_to_one_request_per_image(monkeypatch):
+    analyzer = make_analyzer(batch_size=3)
+    single_calls = []
+
+    def analyze_image_batch(image_metadata):
+        raise BatchSplitError("no markers")
+
+    def analyze_image(image_metadata):
+        single_calls.append(image_metadata["index"])
+        return {"index": image_metadata["index"], "findings": "ok", "cache_hit": False}
+
+    monkeypatch.setattr(analyzer, "analyze_image_batch", analyze_image_batch)
+    monkeypatch.setattr(analyzer, "analyze_image", analyze_image)
+
+    results = analyzer.analyze_multiple_images(images(3))
+    assert sorted(single_calls) == [0, 1, 2]
+    assert [result["index"] for result in results] == [0, 1, 2]
+    assert all(result["findings"] == "ok" for result in results)
+
+
+def test_failed_batch_reports_an_error_for_each_image(monkeypatch):
+    analyzer = make_analyzer(batch_size=2)
+
+    def analyze_image_batch(image_metadata):
+        raise RuntimeError("quota exceeded")
+
+    monkeypatch.setattr(analyzer, "analyze_image_batch", analyze_image_batch)
+
+    results = analyzer.analyze_multiple_images(images(2))
+    assert [result["index"] for result in results] == [0, 1]
+    assert all("quota exceeded" in result["error"] for result in results)
+
+
+def test_slow_image_times_out_without_holding_back_the_others(monkeypatch):
+    analyzer = make_analyzer(max_concurrency=3, image_timeout=0.2)
+    monkeypatch.setattr(ImageAnalyzer, "POLL_INTERVAL", 0.01)
+    release = threading.Event()
+
+    def analyze_image(image_metadata):
+        if image_metadata["index"] == 1:
+            release.wait(5)
+        return {"index": image_metadata["index"], "findings": "ok", "cache_hit": False}
+
+    monkeypatch.setattr(analyzer, "analyze_image", analyze_image)
+
+    started = time.monotonic()
+    try:
+        results = analyzer.analyze_multiple_images(images(3))
+    finally:
+        release.set()
+
+    assert time.monotonic() - started < 2
+    assert results[0]["findings"] == "ok"
+    assert results[2]["findings"] == "ok"
+    assert results[1]["index"] == 1
+    assert "timed out" in results[1]["error"]
+
+
+def test_timeout_counts_from_the_start_of_a_queued_request(monkeypatch):
+    # With one request at a time the second image waits for the first,
+    # but its own time only starts when it is sent
+    analyzer = make_analyzer(max_concurrency=1, image_timeout=0.3)
+    monkeypatch.setattr(ImageAnalyzer, "POLL_INTERVAL", 0.01)
+
+    def analyze_image(image_metadata):
+        time.sleep(0.2)
+        return {"index": image_metadata["index"], "findings": "ok", "cache_hit": False}
+
+    monkeypatch.setattr(analyzer, "analyze_image", analyze_image)
+
+    results = analyzer.analyze_multiple_images(images(2))
+    assert [result.get("findings") for result in results] == ["ok", "ok"]
+
+
+def test_batch_gets_time_for_every_image_it_carries(monkeypatch):
+    analyzer = make_analyzer(batch_size=3, image_timeout=0.1)
+    monkeypatch.setattr(ImageAnalyzer, "POLL_INTERVAL", 0.01)
+
+    def analyze_image_batch(image_metadata):
+        time.sleep(0.2)
+        return [
+            {"index": metadata["index"], "findings": "ok", "cache_hit": False}
+            for metadata in image_metadata
+        ]
+
+    monkeypatch.setattr(analyzer, "analyze_image_batch", analyze_image_batch)
+
+    results = analyzer.analyze_multiple_images(images(3))
+    assert all(result.get("findings") == "ok" for result in results)
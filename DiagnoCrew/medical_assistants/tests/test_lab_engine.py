@@ -0,0 +1,83 @@
+import math
+
+from medical_assistants.lab_engine import LabTable, parse_value, to_reference_unit
+
+
+def flag_of(test, raw, panel="Panel", age=40, gender="male"):
+    """Flag a single lab value and return its record."""
+    (record,) = LabTable({panel: {test: raw}}, age, gender).records()
+    return record
+
+
+def test_parse_value_splits_number_and_unit():
+    assert parse_value("5.4 mmol/L") == (5.4, "mmol/L")
+    assert parse_value("<0,1") == (0.1, "")
+    assert math.isnan(parse_value("positive")[0])
+
+
+def test_value_in_reference_unit_is_flagged():
+    record = flag_of("WBC", "13.1 x10^3/uL")
+    assert record["value"] == 13.1
+    assert record["unit"] == "x10^3/uL"
+    assert record["flag"] == "H"
+
+
+def test_unitless_plausible_value_uses_reference_unit():
+    record = flag_of("WBC", "7.2")
+    assert record["value"] == 7.2
+    assert record["unit"] == "x10^3/uL"
+    assert record["flag"] == ""
+
+
+def test_unitless_cell_count_is_not_read_as_thousands():
+    # 7500 cells/uL must not become a critical 7500 x10^3/uL
+    record = flag_of("WBC", "7500")
+    assert record["flag"] == "?"
+    assert record["unit"] == ""
+    assert record["value"] == "7500"
+
+
+def test_cell_count_with_unit_is_converted():
+    record = flag_of("WBC", "7500 cells/uL")
+    assert record["value"] == 7.5
+    assert record["flag"] == ""
+
+
+def test_unitless_glucose_in_mmol_is_unverifiable():
+    # 5.5 looks like mmol/L; it is not a plausible mg/dL value either way
+    assert flag_of("Glucose", "5.5")["flag"] == "?"
+
+
+def test_glucose_in_mmol_is_converted():
+    record = flag_of("Glucose", "5.5 mmol/L")
+    assert record["value"] == 99.09
+    assert record["unit"] == "mg/dL"
+    assert record["flag"] == "H"
+
+
+def test_unknown_unit_is_unverifiable():
+    record = flag_of("Sodium", "140 mg/dL")
+    assert record["flag"] == "?"
+    assert record["unit"] == ""
+
+
+def test_equivalent_units_need_no_conversion():
+    assert flag_of("Sodium", "140 mEq/L")["value"] == 140
+    assert flag_of("WBC", "6.1 x10^9/L")["value"] == 6.1
+    assert flag_of("ALT", "30 IU/L")["flag"] == ""
+
+
+def test_critical_values_are_flagged():
+    assert flag_of("Potassium", "7.1 mmol/L")["flag"] == "HH"
+    assert flag_of("Hemoglobin", "6.2")["flag"] == "LL"
+
+
+def test_unverifiable_values_are_not_abnormal():
+    table = LabTable({"CBC": {"WBC": "7500", "Hemoglobin": "6.2"}}, 40, "male")
+    assert [record["test"] for record in table.abnormal()] == ["Hemoglobin"]
+
+
+def test_to_reference_unit_converts_and_checks_plausibility():
+    assert to_reference_unit("Creatinine", 88.4, "µmol/L", "mg/dL") == (1.0, "mg/dL")
+    value, unit = to_reference_unit("Creatinine", 88.4, "", "mg/dL")
+    assert math.isnan(value) and unit == ""
@@ -0,0 +1,49 @@
+from medical_assistants.prompt_serializer import merge_counts, placeholder_counts
+
+
+def write_config(tmp_path):
+    agents = tmp_path / "agents.yaml"
+    agents.write_text(
+        "analyst:\n"
+        "  role: Analyst\n"
+        "  goal: Review {patient_data}\n"
+        "writer:\n"
+        "  role: Writer\n"
+        "  goal: Write the report\n"
+    )
+    tasks = tmp_path / "tasks.yaml"
+    tasks.write_text(
+        "analyze:\n"
+        '  description: "Analyze {symptoms} and {lab_results}"\n'
+        "  agent: analyst\n"
+        "  expected_output: A list of conditions\n"
+        "report:\n"
+        '  description: "Report on {analysis}"\n'
+        "  agent: writer\n"
+        "  expected_output: A JSON report\n"
+        "merge:\n"
+        '  description: "Merge {analysis} with {image_results}"\n'
+        "  agent: writer\n"
+        "  expected_output: A JSON report\n"
+    )
+    return [str(agents), str(tasks)]
+
+
+def test_counts_only_the_tasks_a_crew_runs(tmp_path):
+    paths = write_config(tmp_path)
+    assert placeholder_counts(paths, ["analyze", "report"]) == {
+        "patient_data": 1,
+        "symptoms": 1,
+        "lab_results": 1,
+        "analysis": 1,
+    }
+    assert placeholder_counts(paths, ["merge"]) == {"analysis": 1, "image_results": 1}
+
+
+def test_agent_placeholders_count_once_per_task(tmp_path):
+    paths = write_config(tmp_path)
+    assert placeholder_counts(paths, ["analyze", "analyze"])["patient_data"] == 2
+
+
+def test_merge_counts_adds_up_crews():
+    assert merge_counts({"a": 1, "b": 2}, {"b": 1}, {}) == {"a": 1, "b": 3}
@@ -0,0 +1,48 @@
+from medical_assistants.report_repair import close_brackets, extract_report, repair
+
+
+def test_fenced_block_is_preferred():
+    output = 'Notes {"primary_diagnosis": "Other"}\n```json\n{"primary_diagnosis": "Influenza"}\n```'
+    assert extract_report(output) == {"primary_diagnosis": "Influenza"}
+
+
+def test_object_surrounded_by_prose_is_found():
+    output = 'Here is the report: {"primary_diagnosis": "Asthma", "confidence": 0.7} Hope it helps.'
+    assert extract_report(output) == {"primary_diagnosis": "Asthma", "confidence": 0.7}
+
+
+def test_common_json_mistakes_are_repaired():
+    output = '{“primary_diagnosis”: “Asthma”, "urgent": True, "extra": None, "tags": ["a",],}'
+    assert extract_report(output) == {
+        "primary_diagnosis": "Asthma",
+        "urgent": True,
+        "extra": None,
+        "tags": ["a"],
+    }
+
+
+def test_python_literals_inside_strings_are_kept():
+    assert repair('{"note": "True story", "flag": False}') == '{"note": "True story", "flag": false}'
+
+
+def test_truncated_output_is_closed():
+    output = '{"primary_diagnosis": "Pneumonia", "differential_diagnoses": [{"condition": "Flu"'
+    assert extract_report(output) == {
+        "primary_diagnosis": "Pneumonia",
+        "differential_diagnoses": [{"condition": "Flu"}],
+    }
+
+
+def test_close_brackets_ends_an_open_string():
+    assert close_brackets('{"a": ["b", "c') == '{"a": ["b", "c"]}'
+
+
+def test_objects_without_a_diagnosis_are_ignored():
+    assert extract_report('{"confidence": 0.5} {"summary": "none"}') is None
+    assert extract_report("") is None
+    assert extract_report(None) is None
+
+
+def test_nested_object_does_not_hide_the_report():
+    output = '{"primary_diagnosis": "Migraine", "meta": {"source": "crew"}}'
+    assert extract_report(output)["meta"] == {"source": "crew"}
@@ -4,7 +4,6 @@ import warnings
 import os
 import json
 from datetime import datetime
-import re
 import PIL.Image
 import base64
 from medical_assistants.crew import MedicalAssistants
@@ -12,32 +11,6 @@ from medical_assistants.crew import MedicalAssistants
 warnings.filterwarnings("ignore", category=SyntaxWarning, module="pysbd")
 
 
-def process_output(output):
-    """
-    Process the crew output to ensure it's in the correct format.
-    Removes markdown code blocks and extracts valid JSON.
-
-    Args:
-        output (str): The output from the crew
-
-    Returns:
-        dict: The processed diagnostic report
-    """
-
-    match = re.search(r"```json\s*({.*?})\s*```", output, re.DOTALL)
-    if not match:
-        raise ValueError("No JSON content found in the Markdown block.")
-
-    json_string = match.group(1)  # Extract the JSON content
-
-    # Step 2: Parse the JSON string into a Python dictionary
-    try:
-        json_object = json.loads(json_string)
-        return json_object
-    except json.JSONDecodeError as e:
-        raise json.JSONDecodeError(f"Invalid JSON string: {str(e)}", e.doc, e.pos)
-
-
 def test():
     """
     Test the crew execution and returns the results.
@@ -0,0 +1,369 @@
+import json
+import os
+import re
+import threading
+import time
+
+import numpy as np
+
+from medical_assistants.lab_engine import LabTable
+from medical_assistants.src.medical_assistants.knowledge_index import (
+    DEFAULT_INDEX_DIR,
+    DEFAULT_SOURCE,
+    iter_entries,
+    source_stamp,
+    write_atomic,
+)
+
+# Condition profiles saved next to the knowledge index, so a process start
+# reads a small file instead of streaming the whole knowledge base
+PROFILES_FILENAME = "condition_profiles.json"
+
+# Phrases that stand for each of the COMMON_SYMPTOMS in free text
+SYMPTOM_TERMS = {
+    "Fever": ["fever", "febrile", "high temperature", "chills"],
+    "Cough": ["cough"],
+    "Shortness of breath": [
+        "shortness of breath",
+        "short of breath",
+        "breathless",
+        "difficulty breathing",
+        "trouble breathing",
+    ],
+    "Fatigue": ["fatigue", "tiredness", "tired", "weakness", "lethargy"],
+    "Headache": ["headache"],
+    "Nausea": ["nausea", "nauseous"],
+    "Vomiting": ["vomiting", "vomit", "throwing up"],
+    "Diarrhea": ["diarrhea", "diarrhoea", "loose stools"],
+    "Chest pain": ["chest pain", "chest discomfort", "chest tightness", "angina"],
+    "Abdominal pain": ["abdominal pain", "stomach pain", "belly pain", "abdominal cramps"],
+    "Back pain": ["back pain"],
+    "Joint pain": ["joint pain", "aching joints", "arthralgia"],
+    "Rash": ["rash", "hives"],
+    "Sore throat": ["sore throat"],
+    "Dizziness": ["dizziness", "dizzy", "lightheaded", "light-headed", "fainting"],
+    "Loss of appetite": ["loss of appetite", "poor appetite", "appetite loss"],
+}
+SYMPTOMS = list(SYMPTOM_TERMS)
+
+# Questions in the knowledge base that describe a condition by its symptoms
+CONDITION_QUESTION_PATTERN = re.compile(
+    r"^what are (?:the )?(?:common )?(?:signs|symptoms)(?: and (?:signs|symptoms))? of (?:an? |the )?(.+?)\s*\??$",
+    re.IGNORECASE,
+)
+
+# Lab flags that point towards a condition: (analyte, flags, keyword in the condition name)
+LAB_HINTS = [
+    ("Glucose", ("H", "HH"), "diabetes"),
+    ("WBC", ("H", "HH"), "infection"),
+    ("WBC", ("H", "HH"), "pneumonia"),
+    ("Hemoglobin", ("L", "LL"), "anemia"),
+    ("ALT", ("H", "HH"), "liver"),
+    ("AST", ("H", "HH"), "liver"),
+    ("Bilirubin", ("H", "HH"), "liver"),
+    ("Bilirubin", ("H", "HH"), "hepatitis"),
+    ("Creatinine", ("H", "HH"), "kidney"),
+    ("BUN", ("H", "HH"), "kidney"),
+    ("LDL", ("H",), "heart"),
+    ("Total Cholesterol", ("H",), "heart"),
+]
+LAB_HINT_WEIGHT = 0.5
+HISTORY_WEIGHT = 0.5
+
+# Red flags: every symptom listed must be present, plus any of the extra conditions
+RED_FLAG_RULES = [
+    {
+        "flag": "Chest pain with shortness of breath",
+        "reason": "Rule out acute coronary syndrome and pulmonary embolism",
+        "symptoms": ["Chest pain", "Shortness of breath"],
+    },
+    {
+        "flag": "Chest pain with cardiovascular risk",
+        "reason": "Cardiac history or risk factors make a cardiac cause more likely",
+        "symptoms": ["Chest pain"],
+        "conditions": ["Heart Disease", "Hypertension", "Diabetes", "Stroke"],
+        "min_age": 50,
+    },
+    {
+        "flag": "Fever with shortness of breath",
+        "reason": "Possible pneumonia or sepsis; check oxygen saturation",
+        "symptoms": ["Fever", "Shortness of breath"],
+    },
+    {
+        "flag": "Fever in a vulnerable patient",
+        "reason": "Fever in infants, older adults and immunocompromised patients needs prompt review",
+        "symptoms": ["Fever"],
+        "conditions": ["Cancer", "Kidney Disease", "Liver Disease"],
+        "min_age": 65,
+        "max_age": 1,
+    },
+    {
+        "flag": "Sudden headache with dizziness or vomiting",
+        "reason": "Rule out stroke and intracranial bleeding",
+        "symptoms": ["Headache"],
+        "any_symptoms": ["Dizziness", "Vomiting"],
+        "max_days": 1,
+    },
+    {
+        "flag": "Abdominal pain with vomiting",
+        "reason": "Possible acute abdomen or obstruction",
+        "symptoms": ["Abdominal pain", "Vomiting"],
+    },
+    {
+        "flag": "Vomiting and diarrhea with electrolyte imbalance",
+        "reason": "Risk of dehydration; replace fluids and electrolytes",
+        "any_symptoms": ["Vomiting", "Diarrhea"],
+        "labs": {"Sodium": ("L", "LL", "H", "HH"), "Potassium": ("L", "LL", "H", "HH")},
+    },
+    {
+        "flag": "Breathing difficulty with lung disease",
+        "reason": "Possible exacerbation of asthma or COPD",
+        "symptoms": ["Shortness of breath"],
+        "conditions": ["Asthma", "COPD"],
+    },
+]
+
+DURATION_DAYS = {"day": 1, "week": 7, "month": 30, "year": 365}
+
+
+_warm_up_lock = threading.Lock()
+_warm_up_thread = None
+
+# Condition profiles by (source, cache directory), loaded once per process
+_profiles = {}
+_profiles_lock = threading.Lock()
+
+
+def condition_profiles(path=DEFAULT_SOURCE, cache_dir=DEFAULT_INDEX_DIR):
+    """
+    Load the symptom profile of every condition in the knowledge base.
+
+    The profiles are saved to `cache_dir` and rebuilt only when the source
+    file or the symptom list changes. They are loaded once per process;
+    concurrent callers wait for that one load.
+
+    Returns:
+        tuple: Condition names and a (conditions x symptoms) matrix that is 1
+            where the condition's answer mentions the symptom
+    """
+    key = (path, cache_dir)
+    with _profiles_lock:
+        if key not in _profiles:
+            _profiles[key] = load_condition_profiles(path, cache_dir)
+        return _profiles[key]
+
+
+def loaded_condition_profiles(path=DEFAULT_SOURCE, cache_dir=DEFAULT_INDEX_DIR):
+    """Return the condition profiles if they are already in memory, else None, without waiting."""
+    return _profiles.get((path, cache_dir))
+
+
+def load_condition_profiles(path=DEFAULT_SOURCE, cache_dir=DEFAULT_INDEX_DIR):
+    """Read the saved profiles, or build and save them; see `condition_profiles`."""
+    cache_path = os.path.join(cache_dir, PROFILES_FILENAME)
+    stamp = source_stamp(path)
+    try:
+        with open(cache_path, "r") as f:
+            saved = json.load(f)
+        if saved["source"] == stamp and saved["symptoms"] == SYMPTOMS:
+            return saved["names"], np.array(saved["matrix"], dtype=float).reshape(
+                len(saved["names"]), len(SYMPTOMS)
+            )
+    except (OSError, ValueError, KeyError):
+        pass
+
+    names, matrix = build_condition_profiles(path)
+    os.makedirs(cache_dir, exist_ok=True)
+    write_atomic(
+        cache_path,
+        json.dumps(
+            {"source": stamp, "symptoms": SYMPTOMS, "names": names, "matrix": matrix.tolist()}
+        ),
+    )
+    return names, matrix
+
+
+def build_condition_profiles(path=DEFAULT_SOURCE):
+    """Stream the knowledge base and build the profiles returned by `condition_profiles`."""
+    profiles = {}
+    for entry in iter_entries(path):
+        match = CONDITION_QUESTION_PATTERN.match(entry.get("Question", "").strip())
+        if not match:
+            continue
+        name = match.group(1).strip(" ?.")
+        mentioned = mentioned_symptoms(entry.get("Answer", ""))
+        if mentioned:
+            key = name.lower()
+            condition, found = profiles.get(key, (name, set()))
+            profiles[key] = (condition, found | mentioned)
+
+    names = [condition for condition, _ in profiles.values()]
+    matrix = np.zeros((len(names), len(SYMPTOMS)))
+    for row, (_, found) in enumerate(profiles.values()):
+        for symptom in found:
+            matrix[row, SYMPTOMS.index(symptom)] = 1.0
+    return names, matrix
+
+
+def warm_up():
+    """
+    Load the condition profiles on a background thread, once per process.
+
+    Called at app start, so the first triage finds them in memory, and by a
+    triage that finds them missing; a load that failed is started again.
+    """
+    global _warm_up_thread
+    with _warm_up_lock:
+        if loaded_condition_profiles() is not None:
+            return
+        if _warm_up_thread is None or not _warm_up_thread.is_alive():
+            _warm_up_thread = threading.Thread(
+                target=condition_profiles, name="triage-warm-up", daemon=True
+            )
+            _warm_up_thread.start()
+
+
+def mentioned_symptoms(text):
+    """Return the COMMON_SYMPTOMS named in a free text."""
+    text = f" {(text or '').lower()} "
+    return {
+        symptom
+        for symptom, terms in SYMPTOM_TERMS.items()
+        if any(re.search(rf"\b{re.escape(term)}\b", text) for term in terms)
+    }
+
+
+def duration_days(onset_info):
+    """Turn the onset duration, e.g. "3 Days", into days; None when it is not given."""
+    match = re.match(r"\s*(\d+)\s*(day|week|month|year)", str((onset_info or {}).get("duration", "")).lower())
+    if not match:
+        return None
+    return int(match.group(1)) * DURATION_DAYS[match.group(2)]
+
+
+def red_flags(symptoms, conditions, age, days, lab_flags):
+    """
+    Apply the red flag rules and the critical lab values.
+
+    Returns:
+        list: One {"flag", "reason"} dictionary per red flag raised
+    """
+    raised = []
+    for rule in RED_FLAG_RULES:
+        if not set(rule.get("symptoms", [])) <= symptoms:
+            continue
+        if rule.get("any_symptoms") and not symptoms & set(rule["any_symptoms"]):
+            continue
+        if "max_days" in rule and (days is None or days > rule["max_days"]):
+            continue
+        if "labs" in rule and not any(
+            lab_flags.get(test) in flags for test, flags in rule["labs"].items()
+        ):
+            continue
+        # Risk factors: any listed history, or an age outside the bounds
+        risk_factors = [key for key in ("conditions", "min_age", "max_age") if key in rule]
+        if risk_factors and not (
+            conditions & set(rule.get("conditions", []))
+            or (age is not None and age >= rule.get("min_age", float("inf")))
+            or (age is not None and age < rule.get("max_age", float("-inf")))
+        ):
+            continue
+        raised.append({"flag": rule["flag"], "reason": rule["reason"]})
+
+    for test, flag in lab_flags.items():
+        if flag in ("LL", "HH"):
+            level = "low" if flag == "LL" else "high"
+            raised.append({"flag": f"Critical {test}", "reason": f"{test} is critically {level}"})
+    return raised
+
+
+def rank_conditions(symptoms, conditions, lab_flags, limit=5, profiles=None):
+    """
+    Rank the knowledge base conditions against the patient's findings.
+
+    The score is the number of matching symptoms normalized by the length
+    of the condition's profile, plus a bonus for supporting lab flags and
+    for conditions already in the patient's history.
+
+    Args:
+        profiles (tuple, optional): Names and matrix from `condition_profiles`,
+            loaded when not given
+
+    Returns:
+        list: Up to `limit` {"condition", "score", "matched"} dictionaries, best first
+    """
+    names, matrix = profiles or condition_profiles()
+    if not names or not symptoms:
+        return []
+    patient = np.array([symptom in symptoms for symptom in SYMPTOMS], dtype=float)
+    overlap = matrix @ patient
+    scores = overlap / np.sqrt(np.maximum(matrix.sum(axis=1), 1.0) * patient.sum())
+
+    lowered = [name.lower() for name in names]
+    for test, flags, keyword in LAB_HINTS:
+        if lab_flags.get(test) in flags:
+            scores += LAB_HINT_WEIGHT * np.array([keyword in name for name in lowered]) * (overlap > 0)
+    for condition in conditions:
+        keyword = condition.lower().replace(" disease", "").replace(" disorder", "")
+        scores += HISTORY_WEIGHT * np.array([keyword in name for name in lowered]) * (overlap > 0)
+
+    ranked = []
+    for row in np.argsort(-scores, kind="stable")[:limit]:
+        if overlap[row] == 0:
+            break
+        ranked.append(
+            {
+                "condition": names[row],
+                "score": round(float(scores[row]), 2),
+                "matched": [s for s, hit in zip(SYMPTOMS, matrix[row] * patient) if hit],
+            }
+        )
+    return ranked
+
+
+def triage_case(patient_data, symptoms, lab_results, chief_complaint="", additional_symptoms="", onset_info=None):
+    """
+    Produce a preliminary triage from local rules and the knowledge base.
+
+    No model is called, so the red flags are available while the crew runs.
+    The red flags and lab flags need no knowledge base; the conditions are
+    ranked only once the profiles are in memory, so a cold start does not
+    wait for them and starts loading them in the background instead.
+
+    Args:
+        patient_data (dict): Patient information, with "age", "gender" and "existing_conditions"
+        symptoms (list): Selected COMMON_SYMPTOMS
+        lab_results (dict): Lab values by panel
+        chief_complaint (str): Free-text complaint, searched for further symptoms
+        additional_symptoms (str): Free-text symptoms, searched as well
+        onset_info (dict, optional): Onset "date" and "duration"
+
+    Returns:
+        dict: "red_flags", ranked "conditions" (None while the profiles are
+            loading), abnormal "lab_flags" and "elapsed_ms"
+    """
+    started = time.perf_counter()
+    patient_data = patient_data or {}
+    found = set(symptoms or []) | mentioned_symptoms(f"{chief_complaint} {additional_symptoms}")
+    conditions = set(patient_data.get("existing_conditions") or [])
+    try:
+        age = float(patient_data.get("age"))
+    except (TypeError, ValueError):
+        age = None
+
+    abnormal = LabTable(lab_results, age, patient_data.get("gender")).abnormal()
+    lab_flags = {record["test"]: record["flag"] for record in abnormal}
+
+    flags = red_flags(found, conditions, age, duration_days(onset_info), lab_flags)
+    profiles = loaded_condition_profiles()
+    if profiles is None:
+        warm_up()
+        ranked = None
+    else:
+        ranked = rank_conditions(found, conditions, lab_flags, profiles=profiles)
+    return {
+        "red_flags": flags,
+        "conditions": ranked,
+        "lab_flags": abnormal,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 2),
+    }
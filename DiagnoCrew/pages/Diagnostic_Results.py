@@ -4,6 +4,8 @@ from PIL import Image
 import io
 from components.patient_info_display import display_patient_info
 from state import navigate_to, reset_session_data
+from utils.diagnostics import load_patient_history, run_diagnostic_analysis, run_triage
+from medical_assistants.series import load_slice
 
 
 def render_results_page():
@@ -13,16 +15,40 @@ def render_results_page():
     # Display patient info
     display_patient_info()
 
+    if st.session_state.analysis_pending:
+        # The local triage is shown while the crew runs and is replaced by its report;
+        # it is ranked again if the condition profiles were still loading
+        if st.session_state.triage and st.session_state.triage["conditions"] is None:
+            run_triage()
+        display_triage(st.session_state.triage)
+        try:
+            with st.spinner("Running diagnostic analysis..."):
+                run_diagnostic_analysis()
+        finally:
+            # A failed run must not start again on every rerun
+            st.session_state.analysis_pending = False
+        st.rerun()
+
+    display_analysis_status()
+
     if not st.session_state.diagnosis:
         st.warning(
             "No diagnostic results available. Please complete the diagnostic analysis first."
         )
         if st.button("Go to Symptoms & Lab Results", use_container_width=True):
             navigate_to("Symptoms_Lab_Results")
+    elif "error" in st.session_state.diagnosis:
+        st.error(st.session_state.diagnosis["error"])
+        display_triage(st.session_state.triage)
+        if st.button("Back to Symptoms & Lab Results", use_container_width=True):
+            navigate_to("Symptoms_Lab_Results")
     else:
-        # Display diagnostic results
+        # Display diagnostic results, normalized by the DiagnosticReport model
         diagnosis = st.session_state.diagnosis
 
+        # Red flags stay visible next to the report
+        display_red_flags(st.session_state.triage)
+
         col1, col2 = st.columns([2, 1])
 
         with col1:
@@ -34,17 +60,73 @@ def render_results_page():
         with col2:
             display_image_analysis(diagnosis)
             display_patient_symptoms()
+            display_case_history()
 
         display_analysis_notes()
         display_action_buttons()
 
 
+def display_analysis_status():
+    """Display the outcome of the last analysis run and whether its case was saved"""
+    message = st.session_state.get("analysis_message")
+    if message:
+        st.success(message)
+        st.session_state.analysis_message = None
+
+    case_saved = st.session_state.get("case_saved")
+    if case_saved is None:
+        return
+    if not case_saved.done():
+        st.caption("The case is still being saved.")
+    elif case_saved.exception() is not None:
+        st.warning(
+            f"Case {st.session_state.case_id} could not be saved: {case_saved.exception()}. "
+            "It will not appear in the patient history."
+        )
+
+
+def display_triage(triage):
+    """Display the preliminary triage: red flags, flagged labs and provisional conditions"""
+    if not triage:
+        return
+    st.subheader("Preliminary Triage")
+    st.caption(
+        f"Rule-based triage from local data in {triage['elapsed_ms']:g} ms. "
+        "It will be replaced by the full diagnostic report."
+    )
+    display_red_flags(triage)
+
+    if triage["lab_flags"]:
+        st.markdown("**Flagged Lab Values**")
+        st.dataframe(triage["lab_flags"], use_container_width=True, hide_index=True)
+
+    st.markdown("**Provisional Conditions**")
+    if triage["conditions"] is None:
+        st.caption("The knowledge base is still loading; conditions are not ranked yet.")
+    elif triage["conditions"]:
+        for rank, condition in enumerate(triage["conditions"], start=1):
+            st.markdown(
+                f"{rank}. **{condition['condition']}** - matches {', '.join(condition['matched'])}"
+            )
+    else:
+        st.write("No matching conditions in the knowledge base")
+    st.divider()
+
+
+def display_red_flags(triage):
+    """Display the red flags raised by the triage"""
+    if not triage or not triage["red_flags"]:
+        return
+    for red_flag in triage["red_flags"]:
+        st.error(f"**{red_flag['flag']}**: {red_flag['reason']}")
+
+
 def display_primary_diagnosis(diagnosis):
     """Display the primary diagnosis section"""
     st.subheader("Primary Diagnosis")
     st.markdown(f"### {diagnosis['primary_diagnosis']}")
     st.progress(diagnosis["confidence"])
-    st.caption(f"Confidence: {diagnosis['confidence']}")
+    st.caption(f"Confidence: {diagnosis['confidence']:.0%}")
 
 
 def display_supporting_evidence(diagnosis):
@@ -70,16 +152,22 @@ def display_differential_diagnoses(diagnosis):
         with col1:
             st.markdown(f"**{diff['condition']}**")
         with col2:
-            st.markdown(f"**{diff['probability']}%**")
+            st.markdown(f"**{diff['probability']:g}%**")
 
 
 def display_image_analysis(diagnosis):
     """Display image analysis section"""
     st.subheader("Image Analysis")
     if st.session_state.uploaded_images:
+        # One image per DICOM series; its slices are rendered from disk on demand
+        shown_series = set()
         for image in st.session_state.uploaded_images:
-            image_data = image["file"]
-            image = Image.open(io.BytesIO(image_data))
+            series_uid = image.get("series_uid")
+            if series_uid is not None:
+                if series_uid in shown_series:
+                    continue
+                shown_series.add(series_uid)
+            image = Image.open(io.BytesIO(load_slice(image)))
             st.image(image, caption="Analyzed Image", use_container_width=True)
 
         st.markdown("**Key Findings**")
@@ -100,6 +188,18 @@ def display_patient_symptoms():
         st.write("No symptoms recorded")
 
 
+def display_case_history():
+    """Display the patient's earlier cases"""
+    st.subheader("Case History")
+    history = load_patient_history()
+    if not history:
+        st.write("No earlier cases for this patient")
+        return
+    for case in history:
+        diagnosis = case["primary_diagnosis"] or case["status"].capitalize()
+        st.markdown(f"- **{case['created_at'][:10]}**: {diagnosis}")
+
+
 def display_analysis_notes():
     """Display analysis notes section"""
     st.subheader("Analysis Notes")
@@ -5,7 +5,8 @@ import time
 from components.patient_info_display import display_patient_info
 from components.navigation_buttons import render_navigation_buttons
 from constants import COMMON_SYMPTOMS, LAB_TESTS
-from utils.diagnostics import run_diagnostic_analysis
+from medical_assistants.lab_engine import LabTable
+from utils.diagnostics import run_triage
 from state import navigate_to
 
 
@@ -33,13 +34,20 @@ def render_symptoms_page():
             navigate_to("Upload_Images")
 
     with col2:
+        st.checkbox(
+            "Ignore cached results",
+            key="bypass_diagnosis_cache",
+            help="Run the full analysis even if this case was diagnosed before",
+        )
         if st.button(
             "Run Diagnostic Analysis", type="primary", use_container_width=True
         ):
-            with st.spinner("Running diagnostic analysis..."):
-                # Run the diagnostic analysis
-                run_diagnostic_analysis()
+            # Show the triage right away; the results page runs the analysis
+            run_triage()
+            st.session_state.diagnosis = None
+            st.session_state.analysis_pending = True
             navigate_to("Diagnostic_Results")
+            st.rerun()
 
 
 def render_symptoms_tab():
@@ -122,7 +130,24 @@ def render_lab_results_tab():
                     if value:
                         category_results[test] = value
 
-            lab_results[category] = category_results
+            # Skipped panels are left out instead of stored as empty
+            if category_results:
+                lab_results[category] = category_results
+
+    # Flag values against the patient's reference ranges as they are typed
+    patient_data = st.session_state.patient_data
+    table = LabTable(lab_results, patient_data.get("age"), patient_data.get("gender"))
+    flagged = table.abnormal()
+    if flagged:
+        st.markdown("#### Flagged Values")
+        st.dataframe(flagged, use_container_width=True, hide_index=True)
+    unverified = [record for record in table.records() if record["flag"] == "?"]
+    if unverified:
+        st.caption(
+            "Not checked against reference ranges; enter them with their unit, e.g. "
+            "\"5.5 mmol/L\": "
+            + ", ".join(f"{record['test']} {record['value']}" for record in unverified)
+        )
 
     # Save lab results
     if st.button("Save Lab Results", use_container_width=True):
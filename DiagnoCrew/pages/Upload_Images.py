@@ -5,7 +5,18 @@ from datetime import datetime
 import io
 from components.patient_info_display import display_patient_info
 from components.navigation_buttons import render_navigation_buttons
-from constants import IMAGE_TYPES, BODY_REGIONS
+from constants import IMAGE_TYPES, BODY_REGIONS, DICOM_UPLOAD_DIR, CACHE_DIR
+from medical_assistants.dicom_ingestion import (
+    DicomImage,
+    is_dicom_upload,
+    spool_upload,
+)
+from medical_assistants.series import load_slice
+from medical_assistants.perceptual_hash import (
+    PerceptualHashIndex,
+    find_duplicate,
+    perceptual_hash,
+)
 
 
 def render_images_page():
@@ -31,30 +42,46 @@ def render_images_page():
     if "uploaded_images" not in st.session_state:
         st.session_state.uploaded_images = []
 
-    # Display existing uploaded images
+    # Display existing uploaded images; a DICOM series is shown as its middle slice
     if st.session_state.uploaded_images:
         st.subheader("Uploaded Images")
-        image_cols = st.columns(min(3, len(st.session_state.uploaded_images)))
+        entries = group_uploaded_images(st.session_state.uploaded_images)
+        image_cols = st.columns(min(3, len(entries)))
 
-        for idx, img_data in enumerate(st.session_state.uploaded_images):
+        for idx, indices in enumerate(entries):
             col_idx = idx % 3
+            img_data = st.session_state.uploaded_images[indices[len(indices) // 2]]
             with image_cols[col_idx]:
-                if img_data.get("file"):
+                if img_data.get("file") or img_data.get("source_path"):
                     try:
-                        image = Image.open(io.BytesIO(img_data["file"]))
+                        # DICOM slices are rendered from disk for the preview only
+                        image = Image.open(io.BytesIO(load_slice(img_data)))
+                        caption = f"{img_data['type']} - {img_data['date']}"
+                        if len(indices) > 1:
+                            caption += f" ({len(indices)} slices)"
                         st.image(
                             image,
-                            caption=f"{img_data['type']} - {img_data['date']}",
+                            caption=caption,
                             use_container_width=True,
                         )
                         if st.button(f"Remove", key=f"remove_{idx}"):
-                            st.session_state.uploaded_images.pop(idx)
+                            for position in sorted(indices, reverse=True):
+                                st.session_state.uploaded_images.pop(position)
                             st.rerun()
                     except Exception as e:
                         st.error(f"Error displaying image {idx+1}: {e}")
 
     # New image upload section
-    st.subheader("Add New Image")
+    st.subheader("Add New Images")
+
+    # Prefill type, region and date from the header of an uploaded DICOM file
+    uploads = [
+        prepare_upload(uploaded_file)
+        for uploaded_file in st.session_state.get("new_image_files") or []
+    ]
+    dicom_defaults = next(
+        (upload["metadata"] for upload in uploads if upload["metadata"]), {}
+    )
 
     col1, col2 = st.columns([2, 3])
 
@@ -69,7 +96,11 @@ def render_images_page():
                 "Ultrasound",
                 "Other",
             ],
-            index=0,
+            index=(
+                IMAGE_TYPES.index(dicom_defaults["type"])
+                if dicom_defaults.get("type") in IMAGE_TYPES
+                else 0
+            ),
             key="new_image_type",
         )
 
@@ -77,50 +108,77 @@ def render_images_page():
             "Body Region",
             ["Chest/Thorax", "Abdomen", "Head/Brain", "Spine", "Extremities", "Other"],
             index=(
-                0
-                if image_type == "Chest X-ray"
-                else 2 if image_type == "Brain MRI" else 1
+                BODY_REGIONS.index(dicom_defaults["region"])
+                if dicom_defaults.get("region") in BODY_REGIONS
+                else (
+                    0
+                    if image_type == "Chest X-ray"
+                    else 2 if image_type == "Brain MRI" else 1
+                )
             ),
             key="new_body_region",
         )
 
         image_date = st.date_input(
-            "Image Date", value=datetime.now(), key="new_image_date"
+            "Image Date",
+            value=dicom_defaults.get("date") or datetime.now(),
+            key="new_image_date",
         )
         image_notes = st.text_area("Notes about the image", key="new_image_notes")
 
     with col2:
-        uploaded_file = st.file_uploader(
-            "Upload Medical Image",
+        # All slices of a CT/MRI series can be selected at once; they are
+        # grouped on their series UID so the series is sampled as a whole
+        st.file_uploader(
+            "Upload Medical Images",
             type=["jpg", "jpeg", "png", "dcm"],
-            key="new_image_file",
+            accept_multiple_files=True,
+            key="new_image_files",
         )
 
-        if uploaded_file is not None:
+        if uploads:
             try:
-                # Display the image
-                image = Image.open(uploaded_file)
-                st.image(
-                    image,
-                    caption=f"{image_type} - {image_date}",
-                    use_container_width=True,
-                )
+                new_images = []
+                for group in group_uploads(uploads):
+                    # One preview and duplicate check per series, on its middle slice
+                    preview = group[len(group) // 2]
+                    caption = f"{image_type} - {image_date}"
+                    if len(group) > 1:
+                        caption += f" ({len(group)} slices)"
+                    preview_bytes = load_slice(preview)
+                    st.image(
+                        Image.open(io.BytesIO(preview_bytes)),
+                        caption=caption,
+                        use_container_width=True,
+                    )
+                    phash = perceptual_hash(preview_bytes)
+                    duplicate_warning = describe_duplicate(phash)
+                    if duplicate_warning:
+                        st.warning(duplicate_warning)
+
+                    for upload in group:
+                        new_image = {
+                            "file": upload["file"],
+                            "source_path": upload["source_path"],
+                            "phash": phash if upload is preview else None,
+                            "type": image_type,
+                            "region": body_region,
+                            "date": str(image_date),
+                            "notes": image_notes,
+                        }
+                        if upload["metadata"]:
+                            new_image["modality"] = upload["metadata"].get("modality")
+                            new_image["series_uid"] = upload["metadata"].get("series_uid")
+                            new_image["slice_position"] = upload["metadata"].get(
+                                "slice_position"
+                            )
+                        new_images.append(new_image)
 
-                if st.button("Add This Image"):
+                label = "Add This Image" if len(new_images) == 1 else "Add These Images"
+                if st.button(label):
                     # Save to session state
-                    buf = io.BytesIO()
-                    image.save(buf, format="PNG")
-                    new_image = {
-                        "file": buf.getvalue(),
-                        "type": image_type,
-                        "region": body_region,
-                        "date": str(image_date),
-                        "notes": image_notes,
-                    }
-                    st.session_state.uploaded_images.append(new_image)
-                    st.success("Image added successfully!")
-                    # Clear the uploader
-                    # st.session_state.new_image_file = None
+                    st.session_state.uploaded_images.extend(new_images)
+                    st.success(f"{len(new_images)} image(s) added successfully!")
                     st.rerun()
 
             except Exception as e:
@@ -132,3 +190,103 @@ def render_images_page():
     render_navigation_buttons(
         prev_page="Patient_Information", next_page="Symptoms_Lab_Results"
     )
+
+
+def prepare_upload(uploaded_file):
+    """
+    Read an uploaded file once per upload.
+
+    DICOM files are spooled to disk and only their path and header metadata
+    are kept in session state; pixels are decoded when a slice is previewed
+    or picked for analysis (see `load_slice`), so large studies neither fill
+    the session nor are decoded up front. JPEG/PNG uploads keep their
+    original encoding.
+
+    Returns:
+        dict: The image bytes (None for DICOM), the spooled path (None for
+            other uploads) and the DICOM metadata ({} for other uploads)
+    """
+    if not is_dicom_upload(uploaded_file.name):
+        return {"file": uploaded_file.getvalue(), "source_path": None, "metadata": {}}
+
+    upload_key = (uploaded_file.name, uploaded_file.size)
+    cache = st.session_state.setdefault("dicom_uploads", {})
+    if upload_key not in cache:
+        path = spool_upload(uploaded_file, DICOM_UPLOAD_DIR)
+        cache[upload_key] = {
+            "file": None,
+            "source_path": path,
+            "metadata": DicomImage(path).metadata(),
+        }
+    return cache[upload_key]
+
+
+def group_uploads(uploads):
+    """
+    Group prepared uploads into series.
+
+    DICOM slices sharing a series UID form one group, in upload order;
+    every other upload is a group of its own.
+
+    Returns:
+        list: Lists of uploads
+    """
+    groups = []
+    by_series = {}
+    for upload in uploads:
+        series_uid = upload["metadata"].get("series_uid")
+        if series_uid is None:
+            groups.append([upload])
+        elif series_uid in by_series:
+            by_series[series_uid].append(upload)
+        else:
+            by_series[series_uid] = [upload]
+            groups.append(by_series[series_uid])
+    return groups
+
+
+def group_uploaded_images(uploaded_images):
+    """Return the positions of the added images, grouped by series UID."""
+    groups = []
+    by_series = {}
+    for position, img_data in enumerate(uploaded_images):
+        series_uid = img_data.get("series_uid")
+        if series_uid is None:
+            groups.append([position])
+        elif series_uid in by_series:
+            by_series[series_uid].append(position)
+        else:
+            by_series[series_uid] = [position]
+            groups.append(by_series[series_uid])
+    return groups
+
+
+def describe_duplicate(phash):
+    """
+    Describe an earlier image that looks like a new upload.
+
+    A perceptual match can miss small differences such as a new lesion,
+    so the upload is always stored and analyzed on its own; the warning
+    lets the user check it was not added by mistake.
+
+    Returns:
+        str: A warning for the user, or None when the image is new
+    """
+    hash_index = PerceptualHashIndex.for_directory(CACHE_DIR)
+    uploaded_hashes = [
+        img_data.get("phash") for img_data in st.session_state.uploaded_images or []
+    ]
+    match = find_duplicate(phash, uploaded_hashes, hash_index.threshold)
+    if match is not None:
+        return (
+            f"This image looks very similar to image {match + 1} already added to this case. "
+            "Check that it was not added twice."
+        )
+
+    earlier = hash_index.find(phash)
+    if earlier is not None:
+        return (
+            f"This image looks very similar to one from case {earlier['case_id']}. "
+            "It will still be analyzed on its own."
+        )
+    return None
@@ -23,6 +23,14 @@ def initialize_session_state():
         st.session_state.onset_info = {}
     if "case_id" not in st.session_state:
         st.session_state.case_id = None
+    if "triage" not in st.session_state:
+        st.session_state.triage = None
+    if "analysis_pending" not in st.session_state:
+        st.session_state.analysis_pending = False
+    if "analysis_message" not in st.session_state:
+        st.session_state.analysis_message = None
+    if "case_saved" not in st.session_state:
+        st.session_state.case_saved = None
 
 
 def navigate_to(page):
@@ -41,4 +49,8 @@ def reset_session_data():
     st.session_state.onset_info = {}
     st.session_state.uploaded_images = []
     st.session_state.case_id = None
+    st.session_state.triage = None
+    st.session_state.analysis_pending = False
+    st.session_state.analysis_message = None
+    st.session_state.case_saved = None
     navigate_to("home")
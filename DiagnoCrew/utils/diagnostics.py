@@ -3,6 +3,23 @@ import streamlit as st
 import time
 from datetime import datetime
 from medical_assistants.backend_services import DiagnosticService
+from medical_assistants.triage import triage_case
+
+
+def run_triage():
+    """
+    Run the local triage on the session data; it takes milliseconds and
+    needs no model, so it is shown while the full analysis runs.
+    """
+    st.session_state.triage = triage_case(
+        patient_data=st.session_state.patient_data,
+        symptoms=st.session_state.symptoms,
+        lab_results=st.session_state.lab_results,
+        chief_complaint=st.session_state.get("chief_complaint", ""),
+        additional_symptoms=st.session_state.get("additional_symptoms", ""),
+        onset_info=st.session_state.get("onset_info", {}),
+    )
+    return st.session_state.triage
 
 
 def run_diagnostic_analysis():
@@ -30,20 +47,81 @@ def run_diagnostic_analysis():
         onset_info=onset_info,
     )
 
-    # Store the case ID
+    # Store the case ID; DICOM originals have moved into the blob store
     st.session_state.case_id = result["case_id"]
+    st.session_state.uploaded_images = result["uploaded_images"]
+    # Their spooled copies are removed, so uploads still selected are spooled again
+    st.session_state.pop("dicom_uploads", None)
 
-    # Run the diagnostic analysis
+    # Run the diagnostic analysis, showing image findings as they arrive
     diagnosis = diagnostic_service.run_diagnosis(
         case_id=result["case_id"],
         data_package=result["data_package"],
         image_metadata=result["image_metadata"],
+        on_image_event=render_image_findings_live(result["image_metadata"]),
+        bypass_cache=st.session_state.get("bypass_diagnosis_cache", False),
     )
 
     # Store the diagnosis in session state
     st.session_state.diagnosis = diagnosis
 
-    # Log success message
-    st.success(f"Analysis complete! Case ID: {result['case_id']}")
+    # The results page reruns after the analysis, so the status is shown
+    # from session state; case data is still being saved in the background
+    st.session_state.analysis_message = f"Analysis complete! Case ID: {result['case_id']}"
+    st.session_state.case_saved = diagnostic_service.case_saved(result["case_id"])
 
     return st.session_state.diagnosis
+
+
+def load_patient_history(limit=5):
+    """
+    Load the patient's earlier cases, newest first, without their payloads.
+
+    Args:
+        limit (int): Number of cases to return
+
+    Returns:
+        list: Case summaries, excluding the current case
+    """
+    patient_id = st.session_state.patient_data.get("id")
+    if not patient_id:
+        return []
+    cases, _ = DiagnosticService().patient_history(patient_id, limit=limit + 1)
+    return [case for case in cases if case["case_id"] != st.session_state.case_id][
+        :limit
+    ]
+
+
+def render_image_findings_live(image_metadata):
+    """
+    Create placeholders for each image and return a callback that fills them
+    with findings as they stream in.
+
+    Args:
+        image_metadata (list): Metadata of the case images
+
+    Returns:
+        callable: Handler for the events of run_diagnosis, or None when there are no images
+    """
+    if not image_metadata:
+        return None
+
+    st.subheader("Image Findings")
+    placeholders = []
+    for metadata in image_metadata:
+        st.markdown(
+            f"**Image {metadata['index'] + 1}: {metadata.get('type')} - {metadata.get('region')}**"
+        )
+        placeholders.append(st.empty())
+    texts = [""] * len(image_metadata)
+
+    def on_image_event(position, kind, payload):
+        if kind == "chunk":
+            texts[position] += payload
+            placeholders[position].markdown(texts[position] + " ▌")
+        elif "error" in payload:
+            placeholders[position].error(payload["error"])
+        else:
+            placeholders[position].markdown(payload["findings"])
+
+    return on_image_event